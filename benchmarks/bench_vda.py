@@ -0,0 +1,278 @@
+"""Scaling benchmarks of the VDA stages, on synthetic data.
+
+Example:
+    python benchmarks/bench_vda.py                    # compare with benchmarks/baseline.json
+    python benchmarks/bench_vda.py --save-baseline    # record a new baseline
+
+Every case runs the whole pipeline on a `VDA_synthetic_source` catalog, growing
+one of the number of events, channel groups, viewings, samples per event and
+bootstraps (of the poisson_cusum_bootstrap onset method) from the base case.
+The wall time, throughput (processed rows per second) and peak memory of every
+stage and hot path (see `VDA_profiler`) are recorded. The wall times are compared
+relative to the time of a fixed numpy/pandas workload run in the same process
+(the reference time), so that a baseline recorded on another machine still
+applies. The exit status is 1 when a span of the largest case of a sweep got
+slower, or needs more memory, than the baseline by more than the threshold, and
+0 otherwise: the smaller cases are listed, but their spans take too little time
+to tell changes from noise.
+"""
+import argparse
+import json
+import platform
+import sys
+
+import numpy as np
+import pandas as pd
+
+from contextlib import redirect_stdout
+from io import StringIO
+from os import path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from vda import VDA  # noqa: E402
+from vda_pipeline import VDA_pipeline  # noqa: E402
+from vda_profiler import VDA_profiler  # noqa: E402
+from vda_synthetic import VDA_synthetic_source  # noqa: E402
+from vda_tool_configuration import VDA_parameters  # noqa: E402
+
+
+EXIT_OK = 0
+EXIT_REGRESSION = 1
+
+BASELINE_FILEPATH = path.join(path.dirname(path.abspath(__file__)), "baseline.json")
+
+BASE_CASE = {"events": 4, "groups": 8, "viewings": 1, "samples": 84, "bootstraps": 0}
+# sweep -> cases, as changes of the base case
+SWEEPS = {
+    "events": [{"events": n} for n in (4, 16, 64, 256)],
+    "groups": [{"groups": n} for n in (2, 8, 32)],
+    "viewings": [{"viewings": n} for n in (1, 2, 4)],
+    "samples": [{"samples": n} for n in (84, 420, 2520, 10080)],
+    # the bootstrap onset method is much slower, hence the smaller catalog
+    "bootstraps": [{"events": 1, "groups": 2, "bootstraps": n} for n in (10, 100, 500)],
+}
+VIEWINGS = ["sun", "asun", "north", "south"]
+
+# the cases whose regressions fail the benchmarks: the largest one of every sweep
+GATED_CASES = [{**BASE_CASE, **cases[-1]} for cases in SWEEPS.values()]
+# spans of the synthetic data source (a copy of memoized data), not of the VDA
+UNGATED_SPANS = ("epd_load",)
+
+# differences below these are noise, whatever the threshold
+MIN_WALL_TIME = 0.1
+MIN_PEAK_MEMORY = 1.0
+
+
+class _memoized_source:
+    """Keeps the loaded data of a source, so that the benchmarks time the VDA stages rather than the data generation."""
+
+    def __init__(self, source):
+        self.source = source
+        self._loaded = {}
+
+    def __call__(self, sensor, level, startdate, enddate, viewing, path=None, autodownload=True):
+        key = (sensor, level, startdate, enddate, viewing)
+        if key not in self._loaded:
+            self._loaded[key] = self.source(sensor, level, startdate, enddate, viewing)
+        df_protons, df_electrons, energies = self._loaded[key]
+        return df_protons.copy(), df_electrons.copy(), dict(energies)
+
+    def observer_distance(self, time):
+        return self.source.observer_distance(time)
+
+    def energy_tables(self, sensor):
+        return self.source.energy_tables(sensor)
+
+
+def reference_time(repeat: int = 5) -> float:
+    """Returns the median wall time of a fixed numpy/pandas workload, the speed of the machine the VDA runs on."""
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame(rng.random((400_000, 16)), index=pd.date_range("2021-01-01", periods=400_000, freq="1min"))
+        df.resample("5min").mean().rolling(12).std()
+        np.sort(df.to_numpy(), axis=0)
+        times.append(perf_counter() - start)
+    return float(np.median(times))
+
+
+def case_name(case: dict) -> str:
+    return ",".join(f"{k}={v}" for k, v in case.items() if v != BASE_CASE[k]) or "base"
+
+
+def _parameters(case: dict, reference_times_filepath: str) -> VDA_parameters:
+    parameters = VDA_parameters()
+    parameters.input_type = 2
+    parameters.reference_times_filepath = reference_times_filepath
+    parameters.view_dfs = False
+    window = (parameters.bg_hours_prior + parameters.bg_hours_after) * 3600
+    resample_seconds = window // case["samples"]
+    parameters.resample_frequency = f"{resample_seconds}s"
+    parameters.viewings_tt = [v in VIEWINGS[:case["viewings"]] for v in parameters.AVAILABLE_VIEWINGS]
+    parameters.default_channel_groups = {
+        "protons": {"HET": [list(map(int, g)) for g in np.array_split(range(36), case["groups"])]}
+    }
+    parameters.channel_groups = parameters.channel_groups_from_defaults()
+    # one hour of background, whatever the resampling
+    bg_end = 3600 // resample_seconds
+    if case["bootstraps"] > 0:
+        parameters.onset_method = "poisson_cusum_bootstrap"
+        parameters.onset_method_parameters = {
+            "bg_start": 0, "bg_end": bg_end, "bootstraps": case["bootstraps"], "cusum_minutes": 60,
+            "sample_size": 0.75, "limit_averaging": "4 min",
+        }
+    else:
+        parameters.onset_method_parameters["bg_end"] = bg_end
+    return parameters
+
+
+def _run_pipeline(parameters: VDA_parameters, source, memory: bool) -> pd.DataFrame:
+    vda = VDA(parameters)
+    vda.data_source = source
+    vda.profiler = VDA_profiler(memory=memory)
+    try:
+        with redirect_stdout(StringIO()):
+            VDA_pipeline(vda).run()
+    finally:
+        vda.profiler.stop()
+    return vda.profiler.report()
+
+
+def run_case(case: dict, repeat: int = 5, memory: bool = True) -> dict:
+    """Runs the pipeline on the synthetic catalog of `case` and returns the figures of every span.
+
+    The wall time is the median of `repeat` runs; the peak memory comes from one more, memory traced run.
+    """
+    case = {**BASE_CASE, **case}
+    with TemporaryDirectory() as tmp_dir:
+        parameters = _parameters(case, path.join(tmp_dir, "reference_times.csv"))
+        # the data are at least as fine as the resampling
+        cadence = min(pd.Timedelta("1min"), pd.Timedelta(parameters.resample_frequency))
+        source = VDA_synthetic_source.random_catalog(case["events"], cadence=cadence)
+        source.reference_times().to_csv(parameters.reference_times_filepath)
+        source = _memoized_source(source)
+
+        # the first run also loads the data into the memoized source
+        _run_pipeline(parameters, source, memory=False)
+        reports = [_run_pipeline(parameters, source, memory=False) for _ in range(repeat)]
+        wall_time = pd.concat([r["Wall Time [s]"] for r in reports], axis="columns").median(axis="columns")
+        rows = reports[0]["Rows"]
+        peak_memory = _run_pipeline(parameters, source, memory=True)["Peak Memory [MB]"] if memory else None
+
+    spans = {}
+    for span in wall_time.index:
+        spans[span] = {
+            "wall_time": float(wall_time[span]),
+            "rows": int(rows[span]),
+            "throughput": float(rows[span] / wall_time[span]) if wall_time[span] > 0 else None,
+            "peak_memory_mb": float(peak_memory[span]) if peak_memory is not None else None,
+        }
+    return {"case": case, "spans": spans}
+
+
+def run_benchmarks(sweeps: list, repeat: int = 5, memory: bool = True) -> dict:
+    reference = reference_time(repeat)
+    cases = {}
+    for sweep in sweeps:
+        for case in SWEEPS[sweep]:
+            name = case_name({**BASE_CASE, **case})
+            if name in cases:
+                continue
+            print(f"Running {name}...", file=sys.stderr)
+            cases[name] = run_case(case, repeat=repeat, memory=memory)
+            for figures in cases[name]["spans"].values():
+                figures["relative_time"] = figures["wall_time"] / reference
+    return {
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+        },
+        "reference_time": reference,
+        "cases": cases,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.25) -> pd.DataFrame:
+    """Lists the spans of the cases in both runs, with their change from the baseline and whether it is a regression.
+
+    The wall times are compared relative to the reference times of the runs (`relative_time`), and their noise
+    in seconds of the current run. Only the spans of `GATED_CASES` (but `UNGATED_SPANS`) can be regressions.
+    """
+    gated_cases = [case_name(case) for case in GATED_CASES]
+    rows = []
+    for name, result in current["cases"].items():
+        if name not in baseline["cases"]:
+            continue
+        baseline_spans = baseline["cases"][name]["spans"]
+        for span, figures in result["spans"].items():
+            if span not in baseline_spans:
+                continue
+            for metric, noise in (("relative_time", MIN_WALL_TIME / current["reference_time"]),
+                                  ("peak_memory_mb", MIN_PEAK_MEMORY)):
+                before, after = baseline_spans[span][metric], figures[metric]
+                if before is None or after is None:
+                    continue
+                rows.append({
+                    "Case": name,
+                    "Span": span,
+                    "Metric": metric,
+                    "Baseline": before,
+                    "Current": after,
+                    "Ratio": after / before if before > 0 else np.nan,
+                    "Regression": name in gated_cases and span not in UNGATED_SPANS
+                    and after > before * (1 + threshold) and after - before > noise,
+                })
+    return pd.DataFrame(rows, columns=["Case", "Span", "Metric", "Baseline", "Current", "Ratio", "Regression"])
+
+
+def construct_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="bench_vda.py", description="Scaling benchmarks of the VDA stages.")
+    parser.add_argument("--sweeps", nargs="*", default=list(SWEEPS), choices=list(SWEEPS),
+                        help="dimensions to grow")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case, the median counts")
+    parser.add_argument("--no-memory", action="store_true", help="skip the (slow) memory traced runs")
+    parser.add_argument("--baseline", default=BASELINE_FILEPATH, help="baseline file (.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results to the baseline file")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="relative slow down (or memory growth) counted as a regression")
+    parser.add_argument("--output", default=None, help="also write the results to this file (.json)")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = construct_parser().parse_args(argv)
+    current = run_benchmarks(args.sweeps, repeat=args.repeat, memory=not args.no_memory)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=1)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(current, f, indent=1)
+        print(f"Baseline written to {args.baseline}")
+        return EXIT_OK
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["machine"] != current["machine"]:
+        # the relative times still compare, but not as closely
+        print(f"Warning: the baseline was recorded on {baseline['machine']}", file=sys.stderr)
+    df_comparison = compare(baseline, current, args.threshold)
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(df_comparison.to_string(index=False))
+    df_regressions = df_comparison[df_comparison["Regression"]]
+    if len(df_regressions) > 0:
+        print(f"{len(df_regressions)} regressions beyond {args.threshold:.0%}", file=sys.stderr)
+        return EXIT_REGRESSION
+    print("No regressions")
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,14 @@
 import filecmp
+import json
 import math
 import matplotlib
+import numpy as np
+import pandas as pd
 import pytest
+import subprocess
+import sys
 
+from pathlib import Path
 from warnings import simplefilter, filterwarnings
 from pandas.errors import PerformanceWarning
 from astropy.visualization import quantity_support
@@ -11,6 +17,7 @@ from tests.helpers import strip_figure_text
 from vda_tool_configuration import VDA_parameters
 from vda_views import VDA_nb_displayer
 from vda import VDA
+from vda_pipeline import VDA_pipeline
 
 # omit Pandas' PerformanceWarning
 simplefilter(action='ignore', category=PerformanceWarning)
@@ -95,3 +102,704 @@ def test_vda_default():
     if not _mpl_old:
         # Strip before returning — don't rely solely on remove_text=True
         return strip_figure_text(fig)
+
+
+def _vda_with_options(onsets, inv_betas):
+    """
+    Build a VDA object with `df_options` and `df_channels_chars` filled in from
+    {(channel, viewing): onset} and {channel: inverse beta}, skipping data loading.
+    """
+    vda = VDA(VDA_parameters())
+    index = pd.MultiIndex.from_tuples(
+        [(1, "het", "protons", viewing, "H_Flux", channel) for channel, viewing in onsets],
+        names=[vda.EVENT_INDEX_NAME, "sensor", "particle", "viewing", "prefix", "channels"],
+    )
+    vda.df_onsets_existing = pd.DataFrame({"Onset Time": list(onsets.values())}, index=index)
+    vda.construct_options_df()
+    vda.df_channels_chars = pd.DataFrame(
+        {"Inverse Beta": list(inv_betas.values())},
+        index=pd.MultiIndex.from_tuples([("het", "protons", c) for c in inv_betas],
+                                        names=["sensor", "particle", "channel"]),
+    )
+    vda._t_sun_to_observer = lambda index_event: 480.0
+    return vda
+
+
+def test_linear_regression_matches_polyfit():
+    vda = VDA(VDA_parameters())
+    rng = np.random.default_rng(0)
+    x = rng.random((4, 6))
+    y = rng.random((4, 6)) * 1000
+    a, b, a_error, b_error = vda._linear_regression(x, y)
+    for i in range(len(x)):
+        p, V = np.polyfit(x[i], y[i], 1, cov=True)
+        assert np.allclose([a[i], b[i]], p)
+        assert np.allclose([a_error[i], b_error[i]], np.sqrt(np.diag(V)))
+
+
+def test_explore_onset_combinations():
+    t0 = pd.Timestamp("2021-10-28 15:00")
+    inv_betas = {"c1": 1.2, "c2": 1.5, "c3": 2.0}
+    # "sun" onsets lie exactly on a line, "asun" onsets are shifted off it
+    onsets = {}
+    for channel, inv_beta in inv_betas.items():
+        onsets[(channel, "sun")] = t0 + pd.Timedelta(seconds=600 * inv_beta)
+        onsets[(channel, "asun")] = t0 + pd.Timedelta(seconds=600 * inv_beta + 120)
+    onsets[("c2", "asun")] += pd.Timedelta(seconds=300)
+    vda = _vda_with_options(onsets, inv_betas)
+
+    selected = vda.explore_onset_combinations()
+    assert len(vda.df_combinations) == 2 ** 3
+    assert list(selected["Viewing"]) == ["sun", "sun", "sun"]
+    assert vda.df_combinations["Score"].min() == pytest.approx(0, abs=1e-6)
+
+    vda.explore_onset_combinations(max_combinations=5)
+    assert len(vda.df_combinations) == 5
+    assert not vda.df_combinations.duplicated().any()
+
+    # two channels always fit a line, and equal inverse betas fit none: the hierarchy decides
+    for inv_betas in ({"c1": 1.2, "c2": 1.5}, {"c1": 1.5, "c2": 1.5}):
+        vda = _vda_with_options({key: t for key, t in onsets.items() if key[0] != "c3"}, inv_betas)
+        vda.parameters.viewings_hierarchy = ["asun", "sun"]
+        assert list(vda.explore_onset_combinations()["Viewing"]) == ["asun", "asun"]
+
+
+def test_select_onsets_by_hierarchy():
+    t0 = pd.Timestamp("2021-10-28 15:00")
+    onsets = {("c1", "asun"): t0, ("c1", "north"): t0,
+              ("c2", "omni"): t0,
+              ("c3", "sun"): t0, ("c3", "omni"): t0}
+    vda = _vda_with_options(onsets, {"c1": 1.2, "c2": 1.5, "c3": 2.0})
+
+    selected = vda.select_onsets_by_hierarchy()
+    assert list(selected["Viewing"]) == ["north", "omni", "sun"]
+
+    selected = vda.select_onsets_by_hierarchy(["asun", "sun"])
+    assert list(selected["Viewing"]) == ["asun", None, "sun"]
+
+
+def test_vda_points():
+    t0 = pd.Timestamp("2021-10-28 15:00")
+    inv_betas = {"c1": 2.0, "c2": 1.2, "c3": 1.5}
+    onsets = {(channel, "sun"): t0 + pd.Timedelta(seconds=600 * inv_beta) for channel, inv_beta in inv_betas.items()}
+    vda = _vda_with_options(onsets, inv_betas)
+    vda.parameters.selected_onsets = vda.select_onsets_by_hierarchy()
+    vda.parameters.selected_onsets.loc[(1, "het", "protons", "H_Flux", "c3"), "Viewing"] = None
+
+    points = vda._vda_points()
+    assert list(points) == [1]
+    x, y = points[1]
+    assert list(x) == [1.2, 2.0]
+    assert list(y) == [t0.timestamp() + 720, t0.timestamp() + 1200]
+
+
+def test_pipeline_invalidation():
+    parameters = VDA_parameters()
+    parameters.channel_groups = {"protons": {
+        "HET/protons Channel 1": {"sensor": "het", "channels": [0, 1]},
+        "HET/protons Channel 2": {"sensor": "het", "channels": [2, 3]},
+    }}
+    pipeline = VDA_pipeline(VDA(parameters))
+    pipeline.dirty.clear()
+    pipeline._channel_groups = {p: {k: dict(v) for k, v in g.items()} for p, g in parameters.channel_groups.items()}
+    pipeline._sensors_particles = parameters.sensors_particles
+
+    parameters.channel_groups["protons"]["HET/protons Channel 2"]["channels"] = [2, 3, 4]
+    pipeline.invalidate("channel_groups")
+    changed = {("protons", "HET/protons Channel 2")}
+    assert pipeline.dirty_groups == {"group_energy_channels": changed, "calculate_onsets": changed}
+    assert "construct_particles_df" not in pipeline.dirty
+    assert {"clean_onsets", "select_onsets", "calculate_vda"} <= pipeline.dirty
+
+    pipeline.dirty.clear()
+    pipeline.dirty_groups.clear()
+    pipeline.invalidate("onset_selection")
+    assert pipeline.dirty == {"select_onsets", "calculate_vda"}
+
+    parameters.channel_groups["electrons"] = {"HET/electrons Channel 1": {"sensor": "het", "channels": [0]}}
+    pipeline.invalidate("channel_groups")
+    assert "construct_particles_df" in pipeline.dirty
+
+
+def test_pipeline_cache_inputs(tmp_path):
+    from vda_synthetic import VDA_synthetic_source
+
+    source = VDA_synthetic_source.random_catalog(3, seed=4)
+    reference_times = source.reference_times()
+    reference_times.iloc[:2].to_csv(tmp_path / "reference_times.csv")
+
+    def run():
+        parameters = VDA_parameters()
+        parameters.input_type = 2
+        parameters.reference_times_filepath = str(tmp_path / "reference_times.csv")
+        parameters.results_store = str(tmp_path / "results.pkl")
+        parameters.view_dfs = False
+        parameters.channel_groups = parameters.channel_groups_from_defaults()
+        vda = VDA(parameters)
+        vda.data_source = source
+        VDA_pipeline(vda, cache_dir=str(tmp_path / "cache")).run()
+        return vda
+
+    assert list(run().results.index) == [1, 2]
+    # an event appended to the same file is found, the stored ones are not processed again
+    reference_times.to_csv(tmp_path / "reference_times.csv")
+    vda = run()
+    assert list(vda.df_times.index) == [1, 2, 3] and vda.stored_events.keys() == {1, 2}
+    assert list(vda.data_cube.events) == [3] and list(vda.results.index) == [1, 2, 3]
+
+
+def test_parameters_fingerprint():
+    parameters = VDA_parameters()
+    fingerprint = parameters.fingerprint()
+    assert fingerprint == VDA_parameters().fingerprint()
+
+    parameters.channel_groups = {"protons": {
+        "HET/protons Channel 1": {"sensor": "het", "channels": [0, 1]},
+        "HET/protons Channel 2": {"sensor": "het", "channels": [2, 3]},
+    }}
+    reordered = VDA_parameters()
+    reordered.channel_groups = dict(reversed(parameters.channel_groups["protons"].items()))
+    reordered.channel_groups = {"protons": reordered.channel_groups}
+    assert parameters.fingerprint("channel_groups") == reordered.fingerprint("channel_groups")
+    assert parameters.fingerprint("onset_method") == reordered.fingerprint("onset_method")
+
+    bg_start = pd.Series(pd.to_datetime(["2021-10-28 14:00", "2021-11-02 10:00"]), index=[1, 2])
+    parameters.onset_method_parameters["bg_start"] = bg_start
+    reordered.onset_method_parameters["bg_start"] = bg_start.copy()
+    assert parameters.fingerprint("onset_method_parameters") == reordered.fingerprint("onset_method_parameters")
+    reordered.onset_method_parameters["bg_start"].iloc[1] += pd.Timedelta(minutes=5)
+    assert parameters.fingerprint("onset_method_parameters") != reordered.fingerprint("onset_method_parameters")
+    assert parameters.fingerprint() != fingerprint
+
+
+def test_parameters_serialization(tmp_path):
+    parameters = VDA_parameters()
+    parameters.channel_groups = parameters.channel_groups_from_defaults()
+    parameters.onset_selection = 3
+    parameters.onset_method_parameters["s"] = 4
+    parameters.save(tmp_path / "config.json")
+
+    loaded = VDA_parameters.load(str(tmp_path / "config.json"))
+    assert loaded.fingerprint() == parameters.fingerprint()
+    assert loaded.channel_groups["protons"]["HET/protons Channel 2"] == {"sensor": "het", "channels": [10, 11, 12]}
+    assert loaded.sensors_particles == {"het": ["electrons", "protons"]}
+
+    with pytest.raises(ValueError):
+        VDA_parameters.from_dict({"onset_treshold": 3})
+
+
+def test_cli_invalid_config(tmp_path, capsys):
+    import vda_cli
+
+    (tmp_path / "config.json").write_text('{"onset_selection": 1}')
+    assert vda_cli.main(["run", str(tmp_path / "config.json"), "-o", str(tmp_path)]) == vda_cli.EXIT_INVALID_CONFIG
+    assert vda_cli.main(["run", str(tmp_path / "missing.json")]) == vda_cli.EXIT_INVALID_CONFIG
+    assert "Invalid configuration" in capsys.readouterr().err
+
+
+def test_cli_shards_merge(tmp_path, monkeypatch):
+    import vda_cli
+    from vda_synthetic import VDA_synthetic_source
+
+    source = VDA_synthetic_source.random_catalog(5, seed=6)
+    source.reference_times().to_csv(tmp_path / "reference_times.csv")
+    parameters = VDA_parameters()
+    parameters.input_type = 2
+    parameters.reference_times_filepath = str(tmp_path / "reference_times.csv")
+    parameters.viewings_tt = [v in ("sun", "asun") for v in parameters.AVAILABLE_VIEWINGS]
+    parameters.save(tmp_path / "config.json")
+
+    construct_vda = VDA.__init__
+
+    def synthetic_vda(self, parameters):
+        construct_vda(self, parameters)
+        self.data_source = source
+
+    monkeypatch.setattr(VDA, "__init__", synthetic_vda)
+    config = str(tmp_path / "config.json")
+    assert vda_cli.main(["run", config, "-o", str(tmp_path / "single"), "--figures"]) == vda_cli.EXIT_OK
+    for shard in ("0/2", "1/2"):
+        assert vda_cli.main(["run", config, "-o", str(tmp_path / "sharded"), "--figures", "--shard", shard]) \
+            == vda_cli.EXIT_OK
+    assert vda_cli.main(["merge", str(tmp_path / "sharded")]) == vda_cli.EXIT_OK
+
+    # the merged outputs are the ones of a single run
+    for filename in ("results.pkl", "selected_onsets.pkl", "onsets.pkl"):
+        pd.testing.assert_frame_equal(pd.read_pickle(tmp_path / "sharded" / filename),
+                                      pd.read_pickle(tmp_path / "single" / filename))
+
+
+def test_background_stages():
+    from threading import Event
+    from vda_synthetic import VDA_synthetic_source
+
+    parameters = VDA_parameters()
+    parameters.input_type = 0
+    parameters.view_dfs = False
+    parameters.channel_groups = parameters.channel_groups_from_defaults()
+    vda = VDA(parameters)
+    vda.data_source = VDA_synthetic_source.random_catalog(1, seed=7)
+    parameters.date_start, parameters.date_end = vda.data_source.reference_times().iloc[0, 0] + \
+        pd.to_timedelta(["-2h", "5h"])
+    vda.construct_times_df()
+    vda.construct_energies_df()
+    displayer = VDA_nb_displayer(vda)
+    with pytest.raises(ValueError, match="No onsets are selected"):
+        vda.calculate_vda()
+    # the default chain of the background stages runs on a fresh tool
+    for stage in VDA_nb_displayer.BACKGROUND_STAGES:
+        displayer._run_stage(stage, Event(), lambda stage, done, total: None)
+    assert list(vda.results.index) == [1] and 1 in vda.vda_fits
+
+
+def test_lazy_imports():
+    # the heavy dependencies are only imported by the stages that need them
+    heavy = ["astropy", "sunpy", "solo_epd_loader", "cdflib", "pyonset", "matplotlib", "IPython", "ipywidgets"]
+    code = (
+        "import sys; "
+        "import vda, vda_pipeline, vda_cli, vda_prefetch; "
+        f"print([m for m in {heavy} if m in sys.modules])"
+    )
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         cwd=Path(__file__).parents[1]).stdout
+    assert out.strip() == "[]"
+
+
+def test_construct_times_df_shards():
+    parameters = VDA_parameters()
+    parameters.input_type = 2
+    vda = VDA(parameters)
+    events = list(vda.construct_times_df().index)
+
+    sharded = []
+    for index in range(2):
+        parameters.shard = [index, 2]
+        sharded += list(vda.construct_times_df().index)
+    assert sorted(sharded) == events
+
+    parameters.shard = [2, 2]
+    with pytest.raises(ValueError):
+        vda.construct_times_df()
+
+
+def test_checkpoints(tmp_path):
+    parameters = VDA_parameters()
+    vda = VDA(parameters)
+    vda.construct_times_df()
+    df_event = pd.DataFrame({"Onset Time": [pd.Timestamp("2021-10-28 15:00")]})
+
+    # no checkpoint directory: nothing is written
+    vda._save_checkpoint("calculate_onsets", 1, df_event)
+    assert vda._load_checkpoint("calculate_onsets", 1) is None
+
+    parameters.checkpoint_dir = str(tmp_path)
+    vda._save_checkpoint("calculate_onsets", 1, df_event)
+    assert vda._load_checkpoint("calculate_onsets", 1) is None
+    parameters.resume = True
+    pd.testing.assert_frame_equal(vda._load_checkpoint("calculate_onsets", 1), df_event)
+
+    # checkpoints of other parameters are not resumed from
+    parameters.onset_method_parameters["s"] = 4
+    assert vda._load_checkpoint("calculate_onsets", 1) is None
+    assert vda._load_checkpoint("construct_particles_df", 1) is None
+
+
+def test_results_store(tmp_path):
+    parameters = VDA_parameters()
+    parameters.input_type = 2
+    parameters.results_store = str(tmp_path / "store.pkl")
+    vda = VDA(parameters)
+    vda.construct_times_df()
+    assert vda.events_to_process() == [1, 2, 3]
+
+    result = {"Release Time": "2021-05-22 20:00:00", "Release Time Error": pd.Timedelta(seconds=60),
+              "Extra Time": pd.Timedelta(seconds=480), "APL": 1.2, "APL Error": 0.1}
+    vda.results.loc[1] = result
+    vda.results.loc[2] = result
+    # event 3 has no onsets, hence no results row
+    vda.vda_fits = {1: {"a": 1}, 2: {"a": 2}}
+    vda.update_results_store()
+
+    vda = VDA(parameters)
+    vda.construct_times_df()
+    assert vda.events_to_process() == []
+    vda.vda_fits = {}
+    vda.update_results_store()
+    assert list(vda.results.index) == [1, 2, 3]
+    assert vda.results.loc[2, "APL"] == 1.2 and pd.isna(vda.results.loc[3, "APL"])
+    assert vda.vda_fits == {1: {"a": 1}, 2: {"a": 2}}
+
+    # the stages analysing the data are skipped
+    vda = VDA(parameters)
+    VDA_pipeline(vda).run()
+    assert list(vda.results.index) == [1, 2, 3] and len(vda.df_onsets) == 0
+
+    parameters.onset_method_parameters["s"] = 4
+    vda.construct_times_df()
+    assert vda.events_to_process() == [1, 2, 3]
+
+    # the manual selections are part of the stored results
+    parameters.onset_selection = 1
+    parameters.selected_onsets = pd.DataFrame(
+        {"Viewing": ["sun", "sun"]},
+        index=pd.MultiIndex.from_tuples([(1, "het", "protons", "H_Flux", "c1"), (2, "het", "protons", "H_Flux", "c1")]),
+    )
+    vda.construct_times_df()
+    vda.update_results_store()
+    parameters.selected_onsets.iloc[1] = "asun"
+    vda.construct_times_df()
+    assert vda.events_to_process() == [2]
+
+
+def test_profiler(tmp_path):
+    from vda_profiler import VDA_profiler
+
+    parameters = VDA_parameters()
+    parameters.input_type = 2
+    vda = VDA(parameters)
+    vda.profiler = VDA_profiler(memory=True)
+    vda.construct_times_df()
+    vda.construct_times_df()
+    with vda._profile("outer"):
+        with vda._profile("inner") as span:
+            span.rows = 10
+            data = np.ones(2**20)
+    del data
+    vda.profiler.stop()
+
+    report = vda.profiler.report()
+    assert report.loc["construct_times_df", "Calls"] == 2
+    assert report.loc["construct_times_df", "Rows"] == 6
+    assert report.loc["inner", "Rows"] == 10
+    # the memory of the inner span also counts for the outer one
+    assert report.loc["outer", "Peak Memory [MB]"] >= report.loc["inner", "Peak Memory [MB]"] >= 8
+
+    vda.profiler.export_trace(tmp_path / "trace.json")
+    with open(tmp_path / "trace.json") as f:
+        events = json.load(f)["traceEvents"]
+    assert [e["name"] for e in events] == ["construct_times_df", "construct_times_df", "inner", "outer"]
+
+
+def test_synthetic_source(tmp_path):
+    from vda_synthetic import VDA_synthetic_source
+
+    source = VDA_synthetic_source.random_catalog(2, seed=1)
+    df_protons, df_electrons, energies = source("ept", "l2", "2021-10-28", "2021-10-29", "sun")
+    assert df_protons["Ion_Flux"].shape[1] == len(energies["Ion_Bins_Low_Energy"]) == 64
+    assert df_electrons["Electron_Flux"].shape[1] == len(energies["Electron_Bins_Width"]) == 34
+    pd.testing.assert_frame_equal(df_protons, source("ept", "l2", "2021-10-28", "2021-10-29", "sun")[0])
+
+    source.reference_times().to_csv(tmp_path / "reference_times.csv")
+    parameters = VDA_parameters()
+    parameters.input_type = 2
+    parameters.reference_times_filepath = str(tmp_path / "reference_times.csv")
+    parameters.view_dfs = False
+    parameters.channel_groups = parameters.channel_groups_from_defaults()
+    vda = VDA(parameters)
+    vda.data_source = source
+    VDA_pipeline(vda).run()
+
+    # the injected release times and path lengths are recovered
+    expected = source.expected_results()
+    release_times = pd.to_datetime(vda.results["Release Time"])
+    assert (abs(release_times - expected["Release Time"]) < pd.Timedelta(minutes=5)).all()
+    assert np.allclose(vda.results["APL"].astype(float), expected["APL"], rtol=0.1)
+
+
+def test_energy_tables(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    vda = VDA(VDA_parameters())
+    data_dir = tmp_path / "particle_data" / "l2" / "epd" / "het"
+    data_dir.mkdir(parents=True)
+    for filename in ("solo_L2_epd-het-sun-rates_20211028_V01.cdf", "solo_L2_epd-het-north-rates_20211027_V02.cdf"):
+        (data_dir / filename).touch()
+    assert vda._latest_cdf("het").endswith("_V02.cdf") and vda._latest_cdf("ept") is None
+
+    # cached tables are used as they are, without opening the data files
+    energies = {"H_Bins_Low_Energy": np.array([1.0, 2.0]), "H_Bins_Width": np.array([1.0, 1.0]),
+                "Electron_Bins_Low_Energy": np.array([0.5]), "Electron_Bins_Width": np.array([0.2])}
+    Path(vda.ENERGY_TABLES_PATH).mkdir()
+    pd.to_pickle(energies, Path(vda.ENERGY_TABLES_PATH) / "het-l2-V02.pkl")
+    assert list(vda.energy_tables("het")["H_Bins_Width"]) == [1.0, 1.0]
+
+    # a data source with energy tables loads no data
+    from vda_synthetic import VDA_synthetic_source
+
+    vda.data_source = VDA_synthetic_source.random_catalog(1)
+    monkeypatch.setattr(VDA_synthetic_source, "__call__", lambda *args, **kwargs: pytest.fail("data loaded"))
+    vda.construct_energies_df()
+    assert vda.df_energies.loc[("ept", "Electron_Flux_33"), "High Energy"] == pytest.approx(0.47)
+
+
+def test_reduced_precision(tmp_path):
+    from vda_synthetic import VDA_synthetic_source
+
+    source = VDA_synthetic_source.random_catalog(3, seed=3)
+    source.reference_times().to_csv(tmp_path / "reference_times.csv")
+
+    def run(**kwargs):
+        parameters = VDA_parameters()
+        parameters.input_type = 2
+        parameters.reference_times_filepath = str(tmp_path / "reference_times.csv")
+        parameters.view_dfs = False
+        parameters.viewings_tt = [v in ("sun", "asun") for v in parameters.AVAILABLE_VIEWINGS]
+        parameters.channel_groups = parameters.channel_groups_from_defaults()
+        for name, value in kwargs.items():
+            setattr(parameters, name, value)
+        vda = VDA(parameters)
+        vda.data_source = source
+        VDA_pipeline(vda).run()
+        return vda
+
+    full = run()
+    reduced = run(reduced_precision=True)
+    assert reduced.data_cube.values.dtype == np.float32 and reduced.grouped_cube.values.dtype == np.float32
+    assert reduced.data_cube.values.nbytes == full.data_cube.values.nbytes // 2
+    # float32 flux: grouped fluxes within float32 precision, same onsets and VDA results
+    assert np.allclose(reduced.grouped_cube.values, full.grouped_cube.values, rtol=1e-6, equal_nan=True)
+    pd.testing.assert_frame_equal(reduced.df_onsets.drop(columns=["bg_level", "threshold"]),
+                                  full.df_onsets.drop(columns=["bg_level", "threshold"]))
+    assert np.allclose(reduced.df_onsets["bg_level"], full.df_onsets["bg_level"], rtol=1e-6)
+    release_times = pd.to_datetime(reduced.results["Release Time"]) - pd.to_datetime(full.results["Release Time"])
+    assert (release_times.abs() < pd.Timedelta(seconds=1)).all()
+    assert np.allclose(reduced.results["APL"].astype(float), full.results["APL"].astype(float), rtol=1e-6)
+
+    # beyond the memory budget, the loaded events are spilled to disk and the data memory mapped
+    spilled = run(reduced_precision=True, memory_budget=0.05, spill_dir=str(tmp_path / "spill"))
+    assert isinstance(spilled.data_cube.values, np.memmap)
+    assert list((tmp_path / "spill").iterdir()) == []
+    pd.testing.assert_frame_equal(spilled.df_onsets, reduced.df_onsets)
+    pd.testing.assert_frame_equal(spilled.results, reduced.results)
+
+
+def test_benchmarks():
+    from benchmarks.bench_vda import GATED_CASES, case_name, compare, reference_time, run_case
+
+    result = run_case({"events": 1, "groups": 2}, repeat=1, memory=False)
+    assert result["spans"]["calculate_onsets"]["rows"] == 2
+    assert result["spans"]["epd_load"]["throughput"] > 0
+    assert reference_time(repeat=1) > 0
+
+    # only the largest cases are gated, and not on the spans of the synthetic data source
+    gated = case_name(GATED_CASES[0])
+    baseline_spans = {
+        "calculate_onsets": {"relative_time": 1.0, "peak_memory_mb": 10.0},
+        "calculate_vda": {"relative_time": 1.0, "peak_memory_mb": 10.0},
+        "epd_load": {"relative_time": 1.0, "peak_memory_mb": None},
+    }
+    current_spans = {
+        "calculate_onsets": {"relative_time": 1.2, "peak_memory_mb": 20.0},
+        "calculate_vda": {"relative_time": 1.5, "peak_memory_mb": None},
+        "epd_load": {"relative_time": 2.0, "peak_memory_mb": None},
+    }
+    # the wall times are relative to the speed of the machine
+    baseline = {"reference_time": 1.0, "cases": {"base": {"spans": baseline_spans}, gated: {"spans": baseline_spans}}}
+    current = {"reference_time": 2.0, "cases": {"base": {"spans": current_spans}, gated: {"spans": current_spans}}}
+    df_comparison = compare(baseline, current, threshold=0.25).set_index(["Case", "Span", "Metric"])
+    assert not df_comparison.loc["base", "Regression"].any()
+    assert list(df_comparison.loc[gated, "Regression"].items()) == [
+        (("calculate_onsets", "relative_time"), False),
+        (("calculate_onsets", "peak_memory_mb"), True),
+        (("calculate_vda", "relative_time"), True),
+        (("epd_load", "relative_time"), False),
+    ]
+
+
+def test_event_cube():
+    from vda_cube import VDA_event_cube
+
+    columns = pd.MultiIndex.from_tuples(
+        [("het", "protons", viewing, "P", f"P_{c}") for viewing in ("sun", "asun") for c in range(3)]
+    )
+    frames = [
+        pd.DataFrame(np.arange(n * 6, dtype=float).reshape(n, 6), columns=columns,
+                     index=pd.date_range("2021-10-28", periods=n, freq="5min"))
+        for n in (4, 2)
+    ]
+    cube = VDA_event_cube.from_frames([3, 1], frames)
+    assert len(cube) == 6 and list(cube.offsets) == [0, 4, 6]
+    pd.testing.assert_frame_equal(cube.event_frame(1), frames[1].rename_axis("Time"), check_freq=False)
+    pd.testing.assert_frame_equal(VDA_event_cube.from_frame(cube.to_frame()).to_frame(), cube.to_frame())
+
+    # the columns of a viewing are next to each other: no copy
+    sun = cube.select(viewing="sun")
+    assert np.shares_memory(sun.values, cube.values) and sun.shape == (6, 3)
+    assert not np.shares_memory(cube.take_columns([0, 5]).values, cube.values)
+
+    # missing channels count as 0, unless the whole group is missing
+    vda = VDA(VDA_parameters())
+    values = np.array([[1.0, np.nan, 3.0], [np.nan, np.nan, 3.0]])
+    widths = np.array([[1.0, 0.0], [1.0, 0.0], [0.0, 2.0]])
+    assert np.allclose(vda._group_channels_de(values, widths), [[0.5, 3.0], [np.nan, 3.0]], equal_nan=True)
+
+
+def test_onset_store():
+    from vda_onsets import VDA_onset_store
+
+    t = pd.Timestamp("2021-10-28 15:00")
+    keys = [(1, "het", "protons", viewing, "P", "HET/protons Channel 1") for viewing in ("sun", "asun", "north")]
+    store = VDA_onset_store.from_rows(keys[:2], [
+        (t, t, t, VDA_onset_store.STATUS_FOUND, {"bg_level": 1.0, "threshold": 2.0}),
+        (None, t, t, VDA_onset_store.STATUS_NOT_FOUND, {"bg_level": 3.0, "threshold": 4.0}),
+    ])
+    bootstrap = VDA_onset_store.from_rows(keys[2:], [(t, t, t, VDA_onset_store.STATUS_FOUND, [t] * 6)])
+    store = VDA_onset_store.concat([store, bootstrap])
+
+    assert store["Onset Time"].dtype == "datetime64[ns]" and store["bg_level"].dtype == float
+    assert list(store.positions([keys[2], keys[1], (2,) + keys[0][1:]])) == [2, 1, -1]
+    existing = store.existing()
+    assert list(existing.level("viewing")) == ["sun", "north"]
+    assert np.isnan(existing["threshold"][1]) and existing["onset_mode"][1] == t
+
+    df = store.to_frame()
+    assert list(df.columns[:4]) == ["Onset Time", "Background Start", "Background End", "Status"]
+    pd.testing.assert_frame_equal(VDA_onset_store.from_frame(df).to_frame(), df)
+
+    # catalogs can label their events with other than numbers
+    labelled = VDA_onset_store.from_rows([("2021-a",) + keys[0][1:]], [(t, t, t, VDA_onset_store.STATUS_FOUND, None)])
+    assert list(VDA_onset_store.concat([store, labelled]).level("Event No")) == [1, 1, 1, "2021-a"]
+
+    # stores concatenated from parts have the categories of a store built at once
+    concatenated = VDA_onset_store.concat([existing, labelled])
+    assert list(concatenated.keys[3].categories) == ["north", "sun"]
+
+
+def test_kinematics_table():
+    vda = VDA(VDA_parameters())
+    keys = [f"{vda.PROTON_COLUMN_PREFIX}_{c}" for c in range(36)]
+    vda.df_energies = pd.DataFrame(
+        {"Low Energy": np.arange(1.0, 37.0), "Bin Width": np.ones(36), "High Energy": np.arange(2.0, 38.0)},
+        index=pd.MultiIndex.from_product([["het"], keys], names=["sensor", "channel"]),
+    )
+    low, high, geo_mean, inv_beta = vda.kinematics.lookup("het", "protons", 2, 5)
+    assert (low, high) == (3.0, 7.0) and geo_mean == pytest.approx(math.sqrt(21.0))
+    assert inv_beta == pytest.approx(1 / math.sqrt(1 - (1 / (1 + geo_mean / vda.M_REST["protons"])) ** 2))
+    # reversed ranges and channels without energies
+    assert np.isnan(vda.kinematics.lookup("het", "protons", 5, 2)[3])
+    assert np.isnan(vda.kinematics.lookup("ept", "protons", 0, 1)[3])
+
+    df = vda.kinematics.gather(["het", "het"], ["protons", "protons"], [2, 0], [5, 0])
+    assert list(df["Geomagnetic Mean"]) == [geo_mean, math.sqrt(2.0)]
+
+
+def test_plan():
+    from vda_plan import VDA_plan
+
+    parameters = VDA_parameters()
+    parameters.viewings_tt = [v in ("sun", "north") for v in parameters.AVAILABLE_VIEWINGS]
+    parameters.channel_groups = parameters.channel_groups_from_defaults()
+    prefixes = {"protons": "H_Flux", "electrons": "Electron_Flux"}
+    widths = {("het", "protons"): np.arange(36.0), ("het", "electrons"): np.ones(4)}
+    plan = VDA_plan.compile(parameters, prefixes, widths)
+    assert [(item.particle, item.viewing) for item in plan.items] == [
+        ("electrons", "sun"), ("electrons", "north"), ("protons", "sun"), ("protons", "north")
+    ]
+    assert plan.items[2].channels[0] == (1, 2, 3) and plan.items[2].widths[0] == (1.0, 2.0, 3.0)
+    assert hash(plan) == hash(VDA_plan.compile(parameters, prefixes, dict(widths)))
+    assert plan.fingerprint != VDA_plan.compile(parameters, prefixes).fingerprint
+
+    items = plan.select({("protons", "HET/protons Channel 2")}, viewing="north")
+    assert len(items) == 1 and items[0].groups == ("HET/protons Channel 2",)
+    assert items[0].widths == ((10.0, 11.0, 12.0),)
+
+
+def test_time_window():
+    from vda import _time_window
+
+    times = pd.date_range("2021-10-28", periods=100, freq="min")
+    df = pd.DataFrame(np.random.default_rng(0).random((100, 3)), index=times)
+    start, end = pd.Timestamp("2021-10-28 00:10:30"), pd.Timestamp("2021-10-28 00:20")
+    window = _time_window(df, start, end)
+    pd.testing.assert_frame_equal(window, df[(df.index >= start) & (df.index <= end)])
+    assert np.shares_memory(window.to_numpy(), df.to_numpy())
+    pd.testing.assert_frame_equal(_time_window(df.iloc[::-1], start, end), window)
+
+    # the onset is the start of the first n consecutive points above the threshold
+    vda = VDA(VDA_parameters())
+    series = pd.Series(np.r_[np.ones(20), 5, 1, 5, 5, 5, 5], index=times[:26])
+    onset_time, bg_start, bg_end, stats = vda._onset_detection_sigma(series, s=3, n=3, bg_start=0, bg_end=12)
+    assert onset_time == times[22] and bg_end == times[12] and stats["bg_level"] == 1.0
+    assert vda._onset_detection_sigma(series[:24], s=3, n=3)[0] is None
+
+
+def test_resample():
+    vda = VDA(VDA_parameters())
+    rng = np.random.default_rng(0)
+    # irregular times, with a gap of empty bins and missing values
+    times = pd.DatetimeIndex(np.sort(pd.Timestamp("2021-10-28 00:00:30")
+                                     + pd.to_timedelta(rng.choice(np.r_[0:100, 130:600], 300, replace=False),
+                                                       unit="min")), name="Time")
+    values = rng.random((300, 5))
+    values[rng.random(values.shape) < 0.2] = np.nan
+    values[:4, 0] = np.nan
+    frames = [
+        pd.DataFrame(values[:, :3], index=times, columns=pd.MultiIndex.from_product([["a"], ["x", "y", "z"]])),
+        pd.DataFrame(values[:, 3:], index=times, columns=pd.MultiIndex.from_product([["b"], ["x", "y"]])),
+        pd.DataFrame(values[1:, :2], index=times[1:], columns=pd.MultiIndex.from_product([["c"], ["x", "y"]])),
+    ]
+    for frequency in ("5min", "17min", "1h"):
+        for frame, resampled in zip(frames, vda._resample(frames, frequency)):
+            expected = frame.resample(frequency, origin="start").mean()
+            expected.index = expected.index.floor("min")
+            pd.testing.assert_frame_equal(resampled, expected, check_freq=False)
+
+
+def test_run_streaming(tmp_path):
+    import threading
+    import time
+    from vda_prefetch import VDA_prefetcher
+    from vda_synthetic import VDA_synthetic_source
+
+    source = VDA_synthetic_source.random_catalog(3, seed=5)
+    source.reference_times().to_csv(tmp_path / "reference_times.csv")
+
+    def construct_vda():
+        parameters = VDA_parameters()
+        parameters.input_type = 2
+        parameters.reference_times_filepath = str(tmp_path / "reference_times.csv")
+        parameters.view_dfs = False
+        parameters.viewings_tt = [v in ("sun", "asun") for v in parameters.AVAILABLE_VIEWINGS]
+        parameters.channel_groups = parameters.channel_groups_from_defaults()
+        vda = VDA(parameters)
+        vda.data_source = source
+        return vda
+
+    batch = construct_vda()
+    VDA_pipeline(batch).run()
+    streamed = construct_vda()
+    streamed.construct_times_df()
+    streamed.run_streaming(prefetch=1)
+    pd.testing.assert_frame_equal(streamed.df_grouped, batch.df_grouped)
+    pd.testing.assert_frame_equal(streamed.df_onsets, batch.df_onsets)
+    pd.testing.assert_frame_equal(streamed.parameters.selected_onsets, batch.parameters.selected_onsets)
+    pd.testing.assert_frame_equal(streamed.results, batch.results)
+    assert streamed.vda_fits.keys() == batch.vda_fits.keys()
+    # the flux data of the events are dropped once they are fitted
+    assert len(streamed.data_cube) == 0
+
+    # the loading waits while the queue is full
+    loaded = []
+    condition = threading.Condition()
+
+    def loader(**kwargs):
+        with condition:
+            loaded.append(kwargs["startdate"])
+            condition.notify_all()
+        return kwargs["startdate"]
+
+    def wait_loaded(count):
+        with condition:
+            assert condition.wait_for(lambda: len(loaded) >= count, timeout=30)
+        # the loading should then be blocked: waiting longer loads nothing more
+        time.sleep(0.05)
+        assert len(loaded) == count
+
+    requests = [[dict(sensor="het", level="l2", startdate=i, enddate=i, viewing=v) for v in ("sun", "asun")]
+                for i in range(5)]
+    prefetcher = VDA_prefetcher(loader, requests, depth=2)
+    # 2 events in the queue, and the one waiting for room
+    wait_loaded(6)
+    assert prefetcher(sensor="het", level="l2", startdate=0, enddate=0, viewing="asun") == 0
+    wait_loaded(8)
+    prefetcher.close()
+    assert not any(thread.name == "vda-prefetcher" for thread in threading.enumerate())
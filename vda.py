@@ -1,24 +1,74 @@
+import hashlib
+import re
 import numpy as np
 import pandas as pd
-import astropy.units as u
 
-from math import sqrt
-from os import getcwd
+from math import ceil
+from os import close, getcwd, makedirs, path, remove, replace
 from datetime import timezone, datetime, timedelta
-from copy import deepcopy
+from copy import copy, deepcopy
+from contextlib import nullcontext
+from functools import wraps
+from glob import glob
+from tempfile import mkstemp
+from types import SimpleNamespace
 
-from matplotlib import pyplot as plt
-from matplotlib import dates as mdates
-from sunpy.coordinates import spice
-from sunpy.data import cache
-from solo_epd_loader import epd_load
-from pyonset import Onset, BootstrapWindow
+from vda_cube import VDA_event_cube
+from vda_kinematics import VDA_kinematics_table
+from vda_onsets import VDA_onset_store
+from vda_plan import VDA_plan
+
+# astropy, sunpy, solo_epd_loader, pyonset and matplotlib take seconds to import,
+# so they are imported by the methods that need them.
+
+
+class VDA_cancelled(Exception):
+    pass
+
+
+def _profiled(rows_attribute: str | None = None):
+    """Records the decorated stage on `VDA.profiler`, with the length of `rows_attribute` as processed rows."""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.profiler is None:
+                return method(self, *args, **kwargs)
+            with self.profiler.record(method.__name__) as span:
+                result = method(self, *args, **kwargs)
+                if rows_attribute is not None and getattr(self, rows_attribute, None) is not None:
+                    span.rows = len(getattr(self, rows_attribute))
+            return result
+        return wrapper
+    return decorator
+
+
+def _from_timestamp(timestamp: float) -> datetime:
+    # the fits work on UTC epoch timestamps of the (naive, UTC) onset times
+    return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+
+
+def _time_window(df: pd.DataFrame | pd.Series, start, end) -> pd.DataFrame | pd.Series:
+    """Returns the rows of `df` from `start` to `end` (both included), found by binary search on its
+    (sorted) time index: a slice of `df` instead of a boolean mask and a copy."""
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index()
+    return df.iloc[df.index.searchsorted(start, side="left"):df.index.searchsorted(end, side="right")]
 
 
 class VDA:
 
     def __init__(self, parameters):
         self.parameters = parameters
+        # optional hooks for long running stages, see _report_progress
+        self.progress_callback = None
+        self.cancel_event = None
+        # optional VDA_profiler (vda_profiler.py) recording the stages and their hot paths
+        self.profiler = None
+        # optional stand-in for solo_epd_loader.epd_load (e.g. VDA_synthetic_source of vda_synthetic.py);
+        # if it has an observer_distance(time) method, it replaces SPICE as well
+        self.data_source = None
+        self._kinematics = None
+        self._plan = None
         self.results = pd.DataFrame({
             "Release Time": [],
             "Release Time Error": [],
@@ -53,6 +103,14 @@ class VDA:
     def DATA_PATH(self):
         return f"{getcwd()}/particle_data"
 
+    @property
+    def SPILL_PATH(self):
+        return self.parameters.spill_dir or path.join(self.DATA_PATH, "spill")
+
+    @property
+    def FLUX_DTYPE(self):
+        return np.float32 if self.parameters.reduced_precision else np.float64
+
     @property
     def PROTON_COLUMN_PREFIX(self):
         return "H_Flux"
@@ -78,10 +136,152 @@ class VDA:
     @property
     def M_REST(self):
         return {"protons": 938.27, "electrons": 0.511}
-    
+
+    ############### Checkpoints ###############
+    @property
+    def CHECKPOINT_PARAMETERS(self):
+        # parameters the per-event results of each checkpointed stage depend on
+        data = ("load_data", "load_data_filepath", "viewings_tt", "resample_frequency", "sensors_particles",
+                "reduced_precision")
+        onsets = data + ("channel_groups", "onset_method", "onset_method_parameters")
+        return {
+            "construct_particles_df": data,
+            "calculate_onsets": onsets,
+            "calculate_vda": onsets,
+            "results_store": onsets + ("onset_selection", "viewings_hierarchy", "max_onset_combinations"),
+        }
+
+    def _checkpoint_filepath(self, stage: str, event_no, extra: pd.Series | pd.DataFrame | None = None) -> str:
+        return path.join(
+            self.parameters.checkpoint_dir, stage, f"event-{event_no}-{self._event_key(stage, event_no, extra)[:16]}.pkl"
+        )
+
+    def _event_key(self, stage: str, event_no, extra: pd.Series | pd.DataFrame | None = None) -> str:
+        # the window of the event and the parameters its results depend on
+        digest = hashlib.sha256(
+            self.parameters.fingerprint(*self.CHECKPOINT_PARAMETERS[stage], per_event=True).encode()
+        )
+        digest.update(pd.util.hash_pandas_object(self.df_times.loc[[event_no]], index=False).to_numpy().tobytes())
+        if extra is not None:
+            digest.update(pd.util.hash_pandas_object(extra).to_numpy().tobytes())
+        return digest.hexdigest()
+
+    def _load_checkpoint(self, stage: str, event_no, extra: pd.Series | pd.DataFrame | None = None):
+        """Returns the checkpointed result of `stage` for the event, or None when there is none to resume from."""
+        if not self._has_checkpoint(stage, event_no, extra):
+            return None
+        return pd.read_pickle(self._checkpoint_filepath(stage, event_no, extra))
+
+    def _has_checkpoint(self, stage: str, event_no, extra: pd.Series | pd.DataFrame | None = None) -> bool:
+        if self.parameters.checkpoint_dir == "" or not self.parameters.resume:
+            return False
+        return path.exists(self._checkpoint_filepath(stage, event_no, extra))
+
+    ############### Results Store ###############
+    def _read_results_store(self) -> dict:
+        if not path.exists(self.parameters.results_store):
+            return {}
+        return pd.read_pickle(self.parameters.results_store)
+
+    def diff_results_store(self):
+        """Finds the events of `df_times` whose results are in `parameters.results_store`.
+
+        The store is keyed by the window of an event and the parameters its results
+        depend on, so added or modified events (and all events after a parameter
+        change) are not found and get processed. The found events are kept in
+        `stored_events` (event number -> store key) and skipped by the data loading.
+        """
+        store = self._read_results_store()
+        self.stored_events = {}
+        for event_no in self.df_times.index:
+            key = self._event_key("results_store", event_no, self._stored_selection(event_no))
+            if key in store:
+                self.stored_events[event_no] = key
+        print(f"{len(self.stored_events)} of {len(self.df_times)} events are unchanged in the results store.")
+
+    def events_to_process(self) -> list:
+        return [event_no for event_no in self.df_times.index if event_no not in self.stored_events]
+
+    def _stored_selection(self, event_no) -> pd.DataFrame | None:
+        # the selections of the manual modes are made by the user, the results depend on them
+        selected = self.parameters.selected_onsets
+        if self.parameters.onset_selection in (0, 3) or not isinstance(selected, pd.DataFrame):
+            return None
+        return selected[selected.index.get_level_values(0) == event_no]
+
+    def complete_from_results_store(self):
+        """Takes the results of every event from `parameters.results_store`, when all of them
+        are stored: the stages loading and analysing the data are then skipped."""
+        self.data_cube = VDA_event_cube.from_frames([], [])
+        self.grouped_cube = VDA_event_cube.from_frames([], [])
+        self.onset_store = VDA_onset_store.from_rows([], [])
+        self.existing_onset_store = self.onset_store
+        self.parameters.selected_onsets = pd.DataFrame({"Viewing": []})
+        self.vda_fits = {}
+        self.update_results_store()
+
+    def update_results_store(self):
+        """Adds the processed events to `parameters.results_store` and completes `results`
+        and `vda_fits` with the stored events."""
+        store = self._read_results_store()
+        for event_no in self.events_to_process():
+            # events without onsets (no results row) are stored too, so that they are not processed again
+            store[self._event_key("results_store", event_no, self._stored_selection(event_no))] = {
+                "result": self.results.loc[event_no].to_dict()
+                if event_no in self.vda_fits and event_no in self.results.index else None,
+                "fit": self.vda_fits.get(event_no),
+            }
+        makedirs(path.dirname(path.abspath(self.parameters.results_store)), exist_ok=True)
+        pd.to_pickle(store, f"{self.parameters.results_store}.tmp")
+        replace(f"{self.parameters.results_store}.tmp", self.parameters.results_store)
+
+        for event_no, key in self.stored_events.items():
+            if store[key]["fit"] is None:
+                self.results.loc[event_no] = np.nan
+            else:
+                self.results.loc[event_no] = store[key]["result"]
+                self.vda_fits[event_no] = store[key]["fit"]
+        self.results = self.results.sort_index()
+        self.vda_fits = dict(sorted(self.vda_fits.items()))
+
+    def _save_checkpoint(self, stage: str, event_no, value, extra: pd.Series | pd.DataFrame | None = None) -> None:
+        if self.parameters.checkpoint_dir == "":
+            return
+        filepath = self._checkpoint_filepath(stage, event_no, extra)
+        makedirs(path.dirname(filepath), exist_ok=True)
+        # written under a temporary name first, so that an interruption never leaves a partial checkpoint
+        pd.to_pickle(value, f"{filepath}.tmp")
+        replace(f"{filepath}.tmp", filepath)
+
+    def _profile(self, name: str):
+        """Context recording `name` on the profiler, if any; yields a span taking the processed `rows`."""
+        if self.profiler is None:
+            return nullcontext(SimpleNamespace())
+        return self.profiler.record(name)
+
     def _epd_load(self, *args, **kwargs):
-        return epd_load(*args, **kwargs)
+        if self.data_source is not None:
+            epd_load = self.data_source
+        else:
+            from solo_epd_loader import epd_load
+
+        with self._profile("epd_load") as span:
+            df_protons, df_electrons, energies = epd_load(*args, **kwargs)
+            span.rows = len(df_protons)
+        return df_protons, df_electrons, energies
+
+    def _report_progress(self, stage: str, done: int, total: int) -> None:
+        """Forwards the progress of a stage to `progress_callback(stage, done, total)`.
 
+        Raises VDA_cancelled when `cancel_event` (a threading.Event) has been set,
+        which stops the running stage at its next progress report.
+        """
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise VDA_cancelled(f'Stage "{stage}" was cancelled')
+        if self.progress_callback is not None:
+            self.progress_callback(stage, done, total)
+
+    @_profiled("df_times")
     def construct_times_df(self):
         if self.parameters.input_type == 0:
             self.df_times = pd.DataFrame(
@@ -124,7 +324,7 @@ class VDA:
             self.df_times[self.REF_TIME_COLNAME] = pd.to_datetime(
                 self.df_times[self.REF_TIME_COLNAME]
             )
-            self.df_times[self.START_TIME_COLNAME] = self.df_times[
+            self.df_times[self.BG_START_TIME_COLNAME] = self.df_times[
                 self.REF_TIME_COLNAME
             ].apply(lambda x: x - timedelta(hours=self.parameters.bg_hours_prior))
             self.df_times[self.END_TIME_COLNAME] = self.df_times[
@@ -132,26 +332,156 @@ class VDA:
             ].apply(lambda x: x + timedelta(hours=self.parameters.bg_hours_after))
             self.df_times = self.df_times.drop(self.REF_TIME_COLNAME, axis="columns")
 
+        if self.parameters.shard is not None:
+            index, count = self.parameters.shard
+            if not 0 <= index < count:
+                raise ValueError(f"Invalid shard {index}/{count}")
+            self.df_times = self.df_times.iloc[index::count]
+
+        self.stored_events = {}
+        if self.parameters.results_store != "":
+            self.diff_results_store()
+
         # self.df_times = self.df_times.map(lambda x: x.replace(tzinfo=timezone.utc))
 
         if self.parameters.view_dfs:
             return self.df_times
 
-    def _download_data(self, show_progress: bool = True) -> pd.DataFrame:
+    @property
+    def ENERGY_TABLES_PATH(self):
+        return path.join(self.DATA_PATH, "energy_tables")
+
+    def _energy_bins_names(self, sensor: str) -> dict:
+        return {"protons": "H_Bins" if sensor == "het" else "Ion_Bins", "electrons": "Electron_Bins"}
+
+    def _latest_cdf(self, sensor: str) -> str | None:
+        filepaths = glob(path.join(self.DATA_PATH, "l2", "epd", sensor, f"solo_L2_epd-{sensor}-*-rates_*_V*.cdf"))
+        if len(filepaths) == 0:
+            return None
+        return max(filepaths, key=lambda f: (self._cdf_version(f), path.basename(f)))
+
+    def _cdf_version(self, filepath: str) -> int:
+        return int(re.search(r"_V(\d+)\.cdf$", filepath).group(1))
+
+    def _load_day(self, sensor: str) -> tuple:
+        # one day of data, at the start of the first event
+        day = self.df_times.iloc[0][self.BG_START_TIME_COLNAME]
+        return self._epd_load(sensor=sensor, level="l2", startdate=day, enddate=day,
+                              viewing="sun", path=self.DATA_PATH, autodownload=True)
+
+    def energy_tables(self, sensor: str) -> dict:
+        """Returns the `<H|Ion|Electron>_Bins_<Low_Energy|Width>` energy tables of the level 2 data of `sensor`.
+
+        The tables are read from a local data file once per sensor and data version, and kept in
+        `ENERGY_TABLES_PATH`, so no flux data are loaded (one day is downloaded when there are no
+        local files). A data source with an `energy_tables(sensor)` method provides them itself.
+        """
+        if self.data_source is not None and hasattr(self.data_source, "energy_tables"):
+            return self.data_source.energy_tables(sensor)
+
+        if self.data_source is not None:
+            return self._load_day(sensor)[2]
+
+        cdf_filepath = self._latest_cdf(sensor)
+        if cdf_filepath is None:
+            self._load_day(sensor)
+            cdf_filepath = self._latest_cdf(sensor)
+            if cdf_filepath is None:
+                raise ValueError(f"No {sensor.upper()} level 2 data found to read the energy tables from")
+
+        filepath = path.join(self.ENERGY_TABLES_PATH, f"{sensor}-l2-V{self._cdf_version(cdf_filepath):02d}.pkl")
+        if path.exists(filepath):
+            return pd.read_pickle(filepath)
+
+        import cdflib
+
+        with self._profile("read_energy_tables"):
+            cdf = cdflib.CDF(cdf_filepath)
+            energies = {
+                f"{name}_{table}": cdf.varget(f"{name}_{table}")
+                for name in self._energy_bins_names(sensor).values()
+                for table in ("Low_Energy", "Width")
+            }
+        makedirs(self.ENERGY_TABLES_PATH, exist_ok=True)
+        pd.to_pickle(energies, f"{filepath}.tmp")
+        replace(f"{filepath}.tmp", filepath)
+        return energies
+
+    @_profiled("df_energies")
+    def construct_energies_df(self):
+        self.df_energies = pd.DataFrame({})
+        df_sensors = []
+        for sensor, particles in self.parameters.AVAILABLE_SENSORS_PARTICLES.items():
+            
+            if len(particles) == 0:
+                continue
+
+            energies = self.energy_tables(sensor)
+            bins_names = self._energy_bins_names(sensor)
+            df_particles = []
+            for particle in particles:
+                particle_prefix = self.PROTON_COLUMN_PREFIX if particle == "protons" else self.ELECTRON_COLUMN_PREFIX
+                low_energy = energies[f"{bins_names[particle]}_Low_Energy"]
+                df_energies_particle = pd.DataFrame(
+                    {
+                        "Low Energy": low_energy,
+                        "Bin Width": energies[f"{bins_names[particle]}_Width"],
+                    },
+                    index=[f"{particle_prefix}_{i}" for i in range(len(low_energy))],
+                )
+                df_energies_particle["High Energy"] = (
+                    df_energies_particle["Low Energy"] + df_energies_particle["Bin Width"]
+                )
+                df_particles.append(df_energies_particle)
+            df_sensors.append(pd.concat(df_particles))
+
+        self.df_energies = pd.concat(
+            df_sensors,
+            keys=[s for s, p in self.parameters.AVAILABLE_SENSORS_PARTICLES.items() if len(p) > 0],
+            names=["sensor", "channel"],
+        )
+
+        if self.parameters.view_dfs:
+            return self.df_energies
+
+    def define_bg_windows(self):
+        """Uses the background windows of `df_times` (input type 1) for the onset determination."""
+        if self.parameters.input_type != 1:
+            raise ValueError("Background windows are only given with the date range file input (input type 1)")
+        self.parameters.onset_method_parameters["bg_start"] = self.df_times[self.BG_START_TIME_COLNAME]
+        self.parameters.onset_method_parameters["bg_end"] = self.df_times[self.BG_END_TIME_COLNAME]
+
+    def _download_data(self, show_progress: bool = True) -> VDA_event_cube:
         df_rows = []
         keys = []
-        for index, row in self.df_times.iterrows():
+        # loaded events still held in memory, and their size
+        held = []
+        held_bytes = 0
+        max_bytes = int(self.parameters.memory_budget * 2 ** 20)
+        df_times = self.df_times.loc[self.events_to_process()]
+        plan = self.plan
+        total = len(df_times) * len(plan.sensors_particles) * len(plan.viewings)
+        done = 0
+        self._report_progress("construct_particles_df", done, total)
+        for index, row in df_times.iterrows():
+            keys.append(index)
+            df_row = self._load_checkpoint("construct_particles_df", index)
+            if df_row is not None:
+                done += len(plan.sensors_particles) * len(plan.viewings)
+                self._report_progress("construct_particles_df", done, total)
+                df_rows.append(df_row)
+                continue
             if show_progress:
                 print(f"Working on event {index}...")
-            df_row = pd.DataFrame({})
-            keys.append(index)
-            for sensor, particles in self.parameters.sensors_particles.items():
+            frames = []
+            for sensor, particles in plan.sensors_particles:
                 
                 if len(particles) == 0:
                     continue
                 
-                for viewing in self.parameters.viewings:
-                    df_protons, df_electrons, _ = epd_load(
+                for viewing in plan.viewings:
+                    done += 1
+                    df_protons, df_electrons, _ = self._epd_load(
                         sensor=sensor,
                         level="l2",
                         startdate=row[self.BG_START_TIME_COLNAME],
@@ -165,22 +495,13 @@ class VDA:
                             flux_cols_name = "H_Flux"
                         elif sensor == "ept":
                             flux_cols_name = "Ion_Flux"
-                        df_protons = df_protons[
-                            [c for c in df_protons.columns if c[0] == flux_cols_name]
-                        ]
                         # df_protons.index = df_protons.index.tz_localize(timezone.utc)
+                        df_protons = _time_window(
+                            df_protons, row[self.BG_START_TIME_COLNAME], row[self.END_TIME_COLNAME]
+                        )
                         df_protons = df_protons[
-                            (df_protons.index >= row[self.BG_START_TIME_COLNAME])
-                            & (df_protons.index <= row[self.END_TIME_COLNAME])
+                            [c for c in df_protons.columns if c[0] == flux_cols_name]
                         ]
-                        if (
-                            self.parameters.resample_frequency is not None
-                            and self.parameters.resample_frequency != ""
-                        ):
-                            df_protons = df_protons.resample(
-                                self.parameters.resample_frequency, origin="start"
-                            ).mean()
-                            df_protons.index = df_protons.index.floor("min")
                         df_protons = pd.concat(
                             [df_protons],
                             keys=[(sensor, "protons", viewing)],
@@ -192,28 +513,19 @@ class VDA:
                             ),
                             axis="columns",
                         )
-                        df_row = pd.concat([df_row, df_protons], axis="columns")
+                        frames.append(df_protons)
                     if "electrons" in particles:
                         if sensor == "het" or sensor == "ept":
                             flux_cols_name = "Electron_Flux"
-                        df_electrons = df_electrons[
-                            [c for c in df_electrons.columns if c[0] == flux_cols_name]
-                        ]
                         # df_electrons.index = df_electrons.index.tz_localize(
                         #     timezone.utc
                         # )
+                        df_electrons = _time_window(
+                            df_electrons, row[self.BG_START_TIME_COLNAME], row[self.END_TIME_COLNAME]
+                        )
                         df_electrons = df_electrons[
-                            (df_electrons.index >= row[self.BG_START_TIME_COLNAME])
-                            & (df_electrons.index <= row[self.END_TIME_COLNAME])
+                            [c for c in df_electrons.columns if c[0] == flux_cols_name]
                         ]
-                        if (
-                            self.parameters.resample_frequency is not None
-                            and self.parameters.resample_frequency != ""
-                        ):
-                            df_electrons = df_electrons.resample(
-                                self.parameters.resample_frequency, origin="start"
-                            ).mean()
-                            df_electrons.index = df_electrons.index.floor("min")
                         df_electrons = pd.concat(
                             [df_electrons],
                             keys=[(sensor, "electrons", viewing)],
@@ -225,74 +537,306 @@ class VDA:
                             ),
                             axis="columns",
                         )
-                        df_row = pd.concat([df_row, df_electrons], axis="columns")
+                        frames.append(df_electrons)
+                    self._report_progress("construct_particles_df", done, total)
+            if self.parameters.resample_frequency is not None and self.parameters.resample_frequency != "":
+                frames = self._resample(frames, self.parameters.resample_frequency)
+            df_row = pd.concat(frames, axis="columns") if len(frames) > 0 else pd.DataFrame({})
+            self._save_checkpoint("construct_particles_df", index, df_row)
             df_rows.append(df_row)
+            if max_bytes > 0:
+                held.append(len(df_rows) - 1)
+                held_bytes += df_row.size * np.dtype(self.FLUX_DTYPE).itemsize
+                if held_bytes > max_bytes:
+                    for i in held:
+                        df_rows[i] = self._spill(keys[i], df_rows[i])
+                    held, held_bytes = [], 0
 
         if show_progress:
             print(f"Done")
-        return pd.concat(df_rows, keys=keys, names=[self.EVENT_INDEX_NAME, "Time"])
+        try:
+            return VDA_event_cube.from_frames(
+                keys, df_rows, names=[self.EVENT_INDEX_NAME, "Time"], dtype=self.FLUX_DTYPE,
+                spill_dir=self.SPILL_PATH if max_bytes > 0 else None, max_bytes=max_bytes,
+            )
+        finally:
+            for df_row in df_rows:
+                if isinstance(df_row, str):
+                    remove(df_row)
+
+    def _resample(self, frames: list, frequency: str) -> list:
+        """Resamples the frames of an event like `frame.resample(frequency, origin="start").mean()`, with
+        the labels floored to the minute.
+
+        The bins are computed once per distinct time index, and the means of all the columns of the
+        frames sharing it in one NaN-aware reduction (sums over counts of the valid values).
+        """
+        offset = pd.tseries.frequencies.to_offset(frequency)
+        if not isinstance(offset, pd.offsets.Tick) or any(len(frame) == 0 for frame in frames):
+            # bins of varying length: pandas does the binning
+            resampled = []
+            for frame in frames:
+                with self._profile("resample") as span:
+                    span.rows = len(frame)
+                    frame = frame.resample(frequency, origin="start").mean()
+                frame.index = frame.index.floor("min")
+                resampled.append(frame)
+            return resampled
+
+        # frames sharing a time index (e.g. the particles, or the viewings, of a sensor)
+        groups = []
+        for i, frame in enumerate(frames):
+            for group in groups:
+                if frames[group[0]].index.equals(frame.index):
+                    group.append(i)
+                    break
+            else:
+                groups.append([i])
+
+        resampled = [None] * len(frames)
+        for group in groups:
+            index = frames[group[0]].index
+            with self._profile("resample") as span:
+                span.rows = len(index) * len(group)
+                # origin="start": the bins start at the first time
+                times = index.to_numpy(dtype="datetime64[ns]").view(np.int64)
+                codes = (times - times[0]) // offset.nanos
+                n_bins = codes[-1] + 1
+                values = np.hstack([frames[i].to_numpy(dtype=float) for i in group])
+                valid = ~np.isnan(values)
+                # the rows are sorted, so the rows of every bin are next to each other
+                starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+                sums = np.zeros((n_bins, values.shape[1]))
+                counts = np.zeros((n_bins, values.shape[1]))
+                sums[codes[starts]] = np.add.reduceat(np.where(valid, values, 0), starts, axis=0)
+                counts[codes[starts]] = np.add.reduceat(valid, starts, axis=0)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    means = np.where(counts > 0, sums / counts, np.nan)
+            labels = pd.DatetimeIndex(
+                (times[0] + np.arange(n_bins) * offset.nanos).astype("datetime64[ns]").astype(index.dtype),
+                name=index.name,
+            ).floor("min")
+            position = 0
+            for i in group:
+                width = frames[i].shape[1]
+                resampled[i] = pd.DataFrame(means[:, position:position + width], index=labels,
+                                            columns=frames[i].columns)
+                position += width
+        return resampled
+
+    def _spill(self, event_no, df_row: pd.DataFrame) -> str:
+        """Writes the data of a loaded event to the spill directory, and returns its file."""
+        makedirs(self.SPILL_PATH, exist_ok=True)
+        handle, filepath = mkstemp(prefix=f"event-{event_no}-", suffix=".pkl", dir=self.SPILL_PATH)
+        close(handle)
+        pd.to_pickle(df_row.astype(self.FLUX_DTYPE), filepath)
+        return filepath
+
+    @property
+    def STREAMED_STAGES(self):
+        # the stages run_streaming runs one event at a time, in order
+        return ("construct_particles_df", "group_energy_channels", "calculate_onsets", "clean_onsets",
+                "construct_options_df", "select_onsets", "calculate_vda")
+
+    def _prefetch_requests(self, events: list) -> list:
+        """Returns the epd_load calls of every event to load, in the order of _download_data."""
+        plan = self.plan
+        requests = []
+        for event_no in events:
+            if self._has_checkpoint("construct_particles_df", event_no):
+                continue
+            row = self.df_times.loc[event_no]
+            requests.append([
+                dict(sensor=sensor, level="l2", startdate=row[self.BG_START_TIME_COLNAME],
+                     enddate=row[self.END_TIME_COLNAME], viewing=viewing, path=self.DATA_PATH, autodownload=True)
+                for sensor, particles in plan.sensors_particles if len(particles) > 0
+                for viewing in plan.viewings
+            ])
+        return requests
+
+    def run_streaming(self, prefetch: int | None = None):
+        """Runs the stages following construct_times_df while the data of the next events are loaded
+        in the background.
+
+        The events are loaded, grouped, have their onsets determined and selected,
+        and are fitted one at a time (`STREAMED_STAGES`), while a VDA_prefetcher
+        (vda_prefetch.py) loads the data of the next `prefetch` events
+        (`parameters.prefetch_events` by default): at most that many loaded events
+        wait in memory. The flux data of an event are dropped once it is fitted
+        (unless `parameters.save_data` is set), so `data_cube` stays empty; the other
+        outputs are the ones of running the stages one after the other. The
+        combinations explored by onset selection 3 are drawn from one random
+        generator for all the events, so with it only the loading, grouping and
+        onsets are streamed, and the events are selected and fitted together at the
+        end. While streaming, the `epd_load` span of the profiler is the time spent
+        waiting for the data.
+        """
+        if self.parameters.load_data:
+            raise ValueError("Streaming loads the data of the events, it cannot be combined with load_data")
+        if self.parameters.results_store != "" and len(self.events_to_process()) == 0:
+            self.complete_from_results_store()
+            return
+        from vda_prefetch import VDA_prefetcher
+
+        if self.data_source is not None:
+            loader = self.data_source
+        else:
+            from solo_epd_loader import epd_load as loader
+
+        self.construct_energies_df()
+        self.define_spacecraft_parameters()
+        self.construct_energy_channels_characteristics()
+        events = self.events_to_process()
+        prefetcher = VDA_prefetcher(
+            loader, self._prefetch_requests(events),
+            self.parameters.prefetch_events if prefetch is None else prefetch,
+        )
+        parameters = copy(self.parameters)
+        # saved once all the events are loaded, and stored once all of them are fitted
+        parameters.save_data = False
+        parameters.results_store = ""
+        fitted = self.parameters.onset_selection != 3
+        stages = self.STREAMED_STAGES if fitted else self.STREAMED_STAGES[:self.STREAMED_STAGES.index("select_onsets")]
+        data_cubes, grouped_cubes, onset_stores, selections, vda_fits = [], [], [], [], {}
+        try:
+            for event_no in events:
+                event_vda = copy(self)
+                # the selection of the event, from the previous selection of all the events
+                event_vda.parameters = copy(parameters)
+                event_vda.df_times = self.df_times.loc[[event_no]]
+                event_vda.data_source = prefetcher
+                # the events fill in the results of this VDA
+                event_vda.results = self.results
+                for stage in stages:
+                    getattr(event_vda, stage)()
+                if self.parameters.save_data:
+                    data_cubes.append(event_vda.data_cube)
+                grouped_cubes.append(event_vda.grouped_cube)
+                onset_stores.append(event_vda.onset_store)
+                if fitted:
+                    selections.append(event_vda.parameters.selected_onsets)
+                    vda_fits.update(event_vda.vda_fits)
+                del event_vda
+        finally:
+            prefetcher.close()
+
+        max_bytes = int(self.parameters.memory_budget * 2 ** 20)
+        self.data_cube = VDA_event_cube.concat_events(
+            data_cubes, spill_dir=self.SPILL_PATH if max_bytes > 0 else None, max_bytes=max_bytes,
+        )
+        self.grouped_cube = VDA_event_cube.concat_events(grouped_cubes)
+        self.onset_store = VDA_onset_store.concat(onset_stores) if len(onset_stores) > 0 \
+            else VDA_onset_store.from_rows([], [])
+        if self.parameters.save_data:
+            self.df_data.to_pickle(self.parameters.save_data_filepath)
+        self.clean_onsets()
+        self.construct_options_df()
+        if not fitted:
+            self.select_onsets()
+            self.calculate_vda()
+            return
+        self.parameters.selected_onsets = pd.concat(selections) if len(selections) > 0 \
+            else self.construct_empty_selection()
+        # in the order of calculate_vda
+        self.results = self.results.sort_index()
+        self.vda_fits = dict(sorted(vda_fits.items()))
+        if self.parameters.results_store != "":
+            self.update_results_store()
+
+    # df_data and df_grouped are pandas views of the event cubes the stages work on
+    @property
+    def df_data(self) -> pd.DataFrame:
+        return self.data_cube.to_frame()
+
+    @df_data.setter
+    def df_data(self, df: pd.DataFrame) -> None:
+        self.data_cube = VDA_event_cube.from_frame(df)
+
+    @property
+    def df_grouped(self) -> pd.DataFrame:
+        return self.grouped_cube.to_frame()
+
+    @df_grouped.setter
+    def df_grouped(self, df: pd.DataFrame) -> None:
+        self.grouped_cube = VDA_event_cube.from_frame(df)
 
+    @_profiled("data_cube")
     def construct_particles_df(self):
         if self.parameters.load_data:
-            self.df_data = pd.read_pickle(self.parameters.load_data_filepath)
+            df_data = pd.read_pickle(self.parameters.load_data_filepath)
+            if len(self.stored_events) > 0:
+                df_data = df_data.loc[~df_data.index.get_level_values(0).isin(list(self.stored_events))]
+            self.data_cube = VDA_event_cube.from_frame(df_data, dtype=self.FLUX_DTYPE)
         else:
-            self.df_data = self._download_data()
+            self.data_cube = self._download_data(show_progress=self.progress_callback is None)
             if self.parameters.save_data:
+                # saved as a DataFrame, the format load_data reads
                 self.df_data.to_pickle(self.parameters.save_data_filepath)
 
         if self.parameters.view_dfs:
             return self.df_data
 
-    def _group_channels_de(
-        self,
-        df_to_group: pd.DataFrame,
-        groups: list[list[str]],
-        energy_bins_widths: list[list[float]],
-        names: list[str]
-    ) -> pd.DataFrame:
-        # I = ΣI_n*ΔE_n / ΣΔE_n
-        
-        grouped_all = {}
-        for columns, energy_bins_width, name in zip(groups, energy_bins_widths, names):
-            de = sum(energy_bins_width)
-            grouped_series = df_to_group.loc[slice(None), columns[0]]*energy_bins_width[0]
-            for column, eb_width in zip(columns[1:], energy_bins_width[1:]):
-                grouped_series = grouped_series.add(df_to_group.loc[slice(None), column]*eb_width, fill_value=0)
-            grouped_all[name] = grouped_series/de
-        df_grouped = pd.DataFrame(grouped_all)
-        return df_grouped
-
-    def group_energy_channels(self):
-        self.df_grouped = pd.DataFrame({})
-        for sensor, particles in self.parameters.sensors_particles.items():
-            for particle in particles:
-                if particle == "protons":
-                    particle_prefix = self.PROTON_COLUMN_PREFIX
-                elif particle == "electrons":
-                    particle_prefix = self.ELECTRON_COLUMN_PREFIX
-                for viewing in self.parameters.viewings:
-                    df_temp = self._group_channels_de(
-                        self.df_data[sensor][particle][viewing][particle_prefix],
-                        [[f"{particle_prefix}_{c}" for c in spec["channels"]]
-                         for spec in self.parameters.channel_groups[particle].values()
-                         if spec["sensor"] == sensor],
-                        [[self.df_energies.loc[(sensor, f"{particle_prefix}_{c}"), "Bin Width"] for c in spec["channels"]]
-                         for spec in self.parameters.channel_groups[particle].values()
-                         if spec["sensor"] == sensor],
-                        [key for key, spec in self.parameters.channel_groups[particle].items() if spec["sensor"] == sensor]
-                    )
-                    df_temp = pd.concat(
-                        [df_temp],
-                        keys=[(sensor, particle, viewing, particle_prefix)],
-                        axis="columns",
-                    )
-                    self.df_grouped = df_temp.copy() \
-                        if self.df_grouped.empty else \
-                        pd.concat([self.df_grouped, df_temp], axis="columns")
+    def _group_channels_de(self, values: np.ndarray, widths: np.ndarray) -> np.ndarray:
+        """Groups the (time x channel) `values` with the (channel x group) energy bin `widths` of every group.
+
+        I = ΣI_n*ΔE_n / ΣΔE_n, where missing values count as 0 unless all the channels of the group are missing.
+        """
+        valid = ~np.isnan(values)
+        sums = np.where(valid, values, 0) @ widths
+        n_valid = valid.astype(float) @ (widths != 0).astype(float)
+        return np.where(n_valid > 0, sums / widths.sum(axis=0), np.nan)
+
+    def _in_groups(self, particles, channels, groups: set) -> np.ndarray:
+        return np.array([(p, c) in groups for p, c in zip(particles, channels)], dtype=bool)
+
+    @_profiled("grouped_cube")
+    def group_energy_channels(self, groups: set | None = None):
+        """Groups the energy channels of `df_data` into `df_grouped`.
+
+        When `groups`, a set of (particle, channel group name) pairs, is given only
+        those channel groups are (re)computed, and groups no longer present in
+        `parameters.channel_groups` are dropped. The rest of `df_grouped` is kept.
+        """
+        blocks = []
+        columns = []
+        for item in self.plan.select(groups):
+            cube = self.data_cube.select(sensor=item.sensor, particle=item.particle, viewing=item.viewing,
+                                         prefix=item.prefix)
+            positions = {channel: i for i, channel in enumerate(cube.columns.get_level_values(-1))}
+            widths = np.zeros((len(positions), len(item.groups)))
+            for i, (channels, group_widths) in enumerate(zip(item.channels, item.widths)):
+                for c, width in zip(channels, group_widths):
+                    widths[positions[f"{item.prefix}_{c}"], i] = width
+            blocks.append(self._group_channels_de(cube.values, widths).astype(cube.values.dtype, copy=False))
+            columns += [(item.sensor, item.particle, item.viewing, item.prefix, key) for key in item.groups]
+
+        grouped_cube = self.data_cube.with_values(
+            np.hstack(blocks) if len(blocks) > 0 else np.empty((len(self.data_cube), 0), dtype=self.FLUX_DTYPE),
+            pd.MultiIndex.from_tuples(columns, names=self.data_cube.columns.names)
+            if len(columns) > 0 else self.data_cube.columns[:0],
+        )
+        if groups is None:
+            self.grouped_cube = grouped_cube
+        else:
+            columns = self.grouped_cube.columns
+            grouped_cube = self.grouped_cube.take_columns(~self._in_groups(
+                columns.get_level_values(1), columns.get_level_values(4), groups
+            )).concat_columns(grouped_cube)
+            self.grouped_cube = grouped_cube.take_columns(
+                [grouped_cube.columns.get_loc(c) for c in self._grouped_columns_order(grouped_cube.columns)]
+            )
 
         if self.parameters.view_dfs:
             return self.df_grouped
 
+    def _grouped_columns_order(self, columns: pd.MultiIndex) -> list:
+        # order of a full group_energy_channels run, the order of the plan
+        position = {}
+        for item in self.plan.items:
+            for key in item.groups:
+                position[item.sensor, item.particle, item.viewing, item.prefix, key] = len(position)
+        return sorted(columns, key=lambda c: position[c])
+
     def _onset_detection_sigma(
         self,
         series: pd.Series,
@@ -313,25 +857,14 @@ class VDA:
             bg_start = series.index[bg_start]
         if type(bg_end) is int:
             bg_end = series.index[bg_end]
-        bg_level = (bg_series := series[bg_start:bg_end]).mean()
+        bg_level = (bg_series := _time_window(series, bg_start, bg_end)).mean()
         threshold = bg_level + s * bg_series.std()
-        onset_time = None
-
-        streak = 0
-        for index, value in series.items():
-            if value > threshold:
-                streak += 1
-                if onset_time is None:
-                    onset_time = index
-            else:
-                streak = 0
-                onset_time = None
 
-            if streak >= n:
-                break
-
-        if streak < n:
-            onset_time = None
+        # the onset is the start of the first n consecutive points above the threshold
+        above = series.to_numpy() > threshold
+        streaks = np.flatnonzero(np.convolve(above, np.ones(n, dtype=int), mode="valid") == n) \
+            if len(above) >= n else []
+        onset_time = series.index[streaks[0]] if len(streaks) > 0 else None
 
         return (
             onset_time,
@@ -354,11 +887,15 @@ class VDA:
         sample_size: float = 0.75,
         limit_averaging: str = "4 min",
     ) -> tuple:
+        # pyonset brings in IPython, which is not needed by the other onset methods
+        from pyonset import Onset, BootstrapWindow
+
         if type(bg_start) is int:
             bg_start = series.index[bg_start]
         if type(bg_end) is int:
             bg_end = series.index[bg_end]
-        df = pd.DataFrame(series)
+        # pyonset looks the channel up by its name
+        df = series.to_frame(channel)
         df.index.freq = self.parameters.resample_frequency
         protons = Onset(
             spacecraft="Solar Orbiter",
@@ -373,10 +910,11 @@ class VDA:
             end_date="",
             data=df,
         )
-        channels = channel.split("-")
+        channels = self.parameters.channel_groups[particle][channel]["channels"]
+        low_energy, high_energy, _, _ = self.kinematics.lookup(sensor, particle, channels[0], channels[-1])
         protons.set_custom_channel_energies(
-            low_bounds=[self.df_energies.loc[sensor, channels[0]]["Low Energy"]],
-            high_bounds=[self.df_energies.loc[sensor, channels[1]]["High Energy"]],
+            low_bounds=[low_energy],
+            high_bounds=[high_energy],
             unit="MeV",
         )
         bg = BootstrapWindow(
@@ -405,6 +943,13 @@ class VDA:
 
     def _onset_detection(
         self, series: pd.Series, method: str = "sigma", **kwargs
+    ) -> tuple:
+        with self._profile(f"onset_detection[{method}]") as span:
+            span.rows = len(series)
+            return self._onset_detection_method(series, method, **kwargs)
+
+    def _onset_detection_method(
+        self, series: pd.Series, method: str = "sigma", **kwargs
     ) -> tuple:
         if method == "sigma":
             onset_results = self._onset_detection_sigma(
@@ -429,112 +974,124 @@ class VDA:
         return onset_results
 
     def _onset_detection_df(
-        self, df: pd.DataFrame, method: str = "sigma", **kwargs
-    ) -> dict:
-        df_onsets = pd.DataFrame({})
-        for index_event, df_event in df.groupby(level=0):
-            for sensor, particles in self.parameters.sensors_particles.items():
-                for particle in particles:
-                    if particle == "protons":
-                        particle_prefix = self.PROTON_COLUMN_PREFIX
-                    elif particle == "electrons":
-                        particle_prefix = self.ELECTRON_COLUMN_PREFIX
-                    for viewing in self.parameters.viewings:
-                        for column_name in (
-                            df_inner := df_event[sensor][particle][viewing][
-                                particle_prefix
-                            ]
-                        ).columns:
-                            new_kwargs = deepcopy(kwargs)
-                            new_kwargs["sensor"] = sensor
-                            new_kwargs["particle"] = particle
-                            new_kwargs["viewing"] = viewing
-                            new_kwargs["channel"] = column_name
-                            if "bg_start" in kwargs and type(kwargs["bg_start"]) is pd.Series:
-                                new_kwargs["bg_start"] = kwargs["bg_start"].loc[index_event].to_pydatetime()
-                                new_kwargs["bg_end"] = kwargs["bg_end"].loc[index_event].to_pydatetime()
-                            try:
-                                onset_time, bg_start, bg_stop, method_specific = (
-                                    self._onset_detection(
-                                        df_inner[column_name].droplevel(
-                                            0, axis="index"
-                                        ),
-                                        method,
-                                        **new_kwargs,
-                                    )
-                                )
-                                df_onsets = pd.concat(
-                                    [
-                                        df_onsets,
-                                        pd.DataFrame(
-                                            {
-                                                "Onset Time": [onset_time],
-                                                "Background Start": [bg_start],
-                                                "Background End": [bg_stop],
-                                                "Method Specific": [method_specific],
-                                            },
-                                            index=[
-                                                [index_event],
-                                                [sensor],
-                                                [particle],
-                                                [viewing],
-                                                [particle_prefix],
-                                                [column_name],
-                                            ],
-                                        ),
-                                    ]
-                                )
-                            except Exception as e:
-                                print(index_event, type(e).__name__, new_kwargs)
-                                df_onsets = pd.concat(
-                                    [
-                                        df_onsets,
-                                        pd.DataFrame(
-                                            {
-                                                "Onset Time": [pd.NaT],
-                                                "Background Start": [pd.NaT],
-                                                "Background End": [pd.NaT],
-                                                "Method Specific": [None],
-                                            },
-                                            index=[
-                                                [index_event],
-                                                [sensor],
-                                                [particle],
-                                                [viewing],
-                                                [particle_prefix],
-                                                [column_name],
-                                            ],
-                                        ),
-                                    ]
-                                )
-        df_onsets.index.names = [
-            self.EVENT_INDEX_NAME,
-            "sensor",
-            "particle",
-            "viewing",
-            "prefix",
-            "channels",
-        ]
-        return df_onsets
+        self, cube: VDA_event_cube, method: str = "sigma", checkpoint: bool = False, **kwargs
+    ) -> VDA_onset_store:
+        stores = []
+        total = cube.shape[1] * len(cube.events)
+        done = 0
+        self._report_progress("calculate_onsets", done, total)
+        for index_event in sorted(cube.events):
+            if checkpoint:
+                event_onsets = self._load_checkpoint("calculate_onsets", index_event)
+                if event_onsets is not None:
+                    done += cube.shape[1]
+                    self._report_progress("calculate_onsets", done, total)
+                    if isinstance(event_onsets, pd.DataFrame):
+                        # checkpointed before the onsets were kept in a VDA_onset_store
+                        event_onsets = VDA_onset_store.from_frame(event_onsets)
+                    stores.append(event_onsets)
+                    continue
+            keys = []
+            rows = []
+            times = cube.event_times(index_event)
+            values = cube.event_values(index_event)
+            event_kwargs = deepcopy(kwargs)
+            if "bg_start" in kwargs and type(kwargs["bg_start"]) is pd.Series:
+                event_kwargs["bg_start"] = kwargs["bg_start"].loc[index_event].to_pydatetime()
+                event_kwargs["bg_end"] = kwargs["bg_end"].loc[index_event].to_pydatetime()
+            for position, column in enumerate(cube.columns):
+                sensor, particle, viewing, particle_prefix, column_name = column
+                done += 1
+                self._report_progress("calculate_onsets", done, total)
+                new_kwargs = {**event_kwargs, "sensor": sensor, "particle": particle, "viewing": viewing,
+                              "channel": column_name}
+                keys.append((index_event, sensor, particle, viewing, particle_prefix, column_name))
+                try:
+                    onset_time, bg_start, bg_stop, method_specific = (
+                        self._onset_detection(
+                            # the background statistics are float64, whatever the precision of the data
+                            pd.Series(np.asarray(values[:, position], dtype=float), index=times, name=column,
+                                      copy=False),
+                            method,
+                            **new_kwargs,
+                        )
+                    )
+                    status = VDA_onset_store.STATUS_NOT_FOUND if pd.isna(onset_time) \
+                        else VDA_onset_store.STATUS_FOUND
+                    rows.append((onset_time, bg_start, bg_stop, status, method_specific))
+                except Exception as e:
+                    print(index_event, type(e).__name__, new_kwargs)
+                    rows.append((None, None, None, VDA_onset_store.STATUS_FAILED, None))
+            event_onsets = VDA_onset_store.from_rows(keys, rows)
+            if checkpoint:
+                self._save_checkpoint("calculate_onsets", index_event, event_onsets)
+            stores.append(event_onsets)
+        return VDA_onset_store.concat(stores) if len(stores) > 0 else VDA_onset_store.from_rows([], [])
 
-    def calculate_onsets(self):
-        self.df_onsets = self._onset_detection_df(
-            self.df_grouped,
-            self.parameters.onset_method,
-            **self.parameters.onset_method_parameters,
-        )
+    # df_onsets and df_onsets_existing are DataFrame exports of the onset stores the stages work on
+    @property
+    def df_onsets(self) -> pd.DataFrame:
+        return self.onset_store.to_frame()
+
+    @df_onsets.setter
+    def df_onsets(self, df: pd.DataFrame) -> None:
+        self.onset_store = VDA_onset_store.from_frame(df)
+
+    @property
+    def df_onsets_existing(self) -> pd.DataFrame:
+        return self.existing_onset_store.to_frame()
+
+    @df_onsets_existing.setter
+    def df_onsets_existing(self, df: pd.DataFrame) -> None:
+        self.existing_onset_store = VDA_onset_store.from_frame(df)
+
+    @_profiled("onset_store")
+    def calculate_onsets(self, groups: set | None = None):
+        """Determines the onsets of every channel group of `df_grouped` into `df_onsets`.
+
+        When `groups`, a set of (particle, channel group name) pairs, is given only
+        the onsets of those channel groups are (re)determined, see
+        `group_energy_channels`.
+        """
+        if groups is None:
+            self.onset_store = self._onset_detection_df(
+                self.grouped_cube,
+                self.parameters.onset_method,
+                checkpoint=True,
+                **self.parameters.onset_method_parameters,
+            )
+        else:
+            columns = self.grouped_cube.columns
+            mask = self._in_groups(columns.get_level_values(1), columns.get_level_values(4), groups)
+            kept = self.onset_store.take(~self._in_groups(
+                self.onset_store.level("particle"), self.onset_store.level("channels"), groups
+            ))
+            new = self._onset_detection_df(
+                self.grouped_cube.take_columns(mask),
+                self.parameters.onset_method,
+                **self.parameters.onset_method_parameters,
+            ) if mask.any() else kept.take([])
+            # same row order as a full run: events, then the columns of df_grouped
+            onset_store = VDA_onset_store.concat([kept, new])
+            order = np.lexsort((
+                columns.get_indexer(onset_store.index.droplevel(0)),
+                pd.factorize(onset_store.level(self.EVENT_INDEX_NAME), sort=True)[0],
+            ))
+            self.onset_store = onset_store.take(order)
 
         if self.parameters.view_dfs:
             return self.df_onsets
 
+    @_profiled("existing_onset_store")
     def clean_onsets(self):
-        self.df_onsets_existing = self.df_onsets[~pd.isna(self.df_onsets["Onset Time"])]
+        self.existing_onset_store = self.onset_store.existing()
 
         if self.parameters.view_dfs:
             return self.df_onsets_existing
 
+    @_profiled("df_options")
     def construct_options_df(self):
-        self.df_options = self.df_onsets_existing.reorder_levels(
+        self.df_options = self.existing_onset_store.to_frame(
             [
                 self.EVENT_INDEX_NAME,
                 "sensor",
@@ -548,6 +1105,199 @@ class VDA:
         # if self.parameters.view_dfs:
         #     return self.df_options
 
+    def construct_empty_selection(self) -> pd.DataFrame:
+        temp_df = self.df_options.droplevel(level=5)
+        df_index = temp_df.index[~temp_df.index.duplicated(keep="first")]
+        return pd.DataFrame({"Viewing": [None for _ in df_index]}, index=df_index)
+
+    def select_onsets_by_hierarchy(self, hierarchy: list[str] | None = None) -> pd.DataFrame:
+        """Selects, for every channel, the available viewing ranked highest in `hierarchy`.
+
+        Defaults to `parameters.viewings_hierarchy`, or `VIEWINGS_HIERARCHY` when
+        that is not set. Viewings missing from the hierarchy are never selected.
+        """
+        if hierarchy is None:
+            hierarchy = self.parameters.viewings_hierarchy or self.VIEWINGS_HIERARCHY
+        df_selected = self.construct_empty_selection()
+
+        # -1 for the viewings missing from the hierarchy
+        ranks = pd.Series(
+            pd.Index(hierarchy).get_indexer(self.df_options.index.get_level_values("viewing")),
+            index=self.df_options.index.droplevel("viewing"),
+        )
+        best = ranks[ranks >= 0].groupby(level=[0, 1, 2, 3, 4], sort=False).min()
+        df_selected.loc[best.index, "Viewing"] = np.asarray(hierarchy, dtype=object)[best.values]
+        return df_selected
+
+    @_profiled()
+    def select_onsets(self):
+        """Fills `parameters.selected_onsets` according to `parameters.onset_selection`.
+
+        The automatic modes (0: viewings hierarchy, 3: explore combinations) select
+        from scratch. For the manual modes the previous selection is kept wherever
+        its viewing still has an onset.
+        """
+        if self.parameters.onset_selection == 0:
+            selected = self.select_onsets_by_hierarchy()
+        elif self.parameters.onset_selection == 3:
+            selected = self.explore_onset_combinations()
+        else:
+            selected = self.construct_empty_selection()
+            if isinstance(self.parameters.selected_onsets, pd.DataFrame):
+                previous = self.parameters.selected_onsets["Viewing"].reindex(selected.index).dropna()
+                for i, viewing in previous.items():
+                    if i + (viewing,) in self.df_options.index:
+                        selected.loc[i, "Viewing"] = viewing
+        self.parameters.selected_onsets = selected
+
+        if self.parameters.view_dfs:
+            return self.parameters.selected_onsets
+
+    def _linear_regression(self, x: np.ndarray, y: np.ndarray) -> tuple:
+        """Least-squares fit of y = a*x + b over the last axis.
+
+        Equivalent to np.polyfit(x, y, 1, cov=True) for every leading index of
+        x and y at once. Fits with only two points have zero errors.
+
+        Returns:
+
+        1. Slope (a)
+        2. Intercept (b)
+        3. Slope error
+        4. Intercept error
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        n = x.shape[-1]
+        x_mean = x.mean(axis=-1, keepdims=True)
+        y_mean = y.mean(axis=-1, keepdims=True)
+        dx = x - x_mean
+        sxx = (dx ** 2).sum(axis=-1)
+        a = (dx * (y - y_mean)).sum(axis=-1) / sxx
+        b = y_mean[..., 0] - a * x_mean[..., 0]
+        if n <= 2:
+            zeros = np.zeros(np.broadcast(a, b).shape)
+            return a, b, zeros, zeros
+        residuals = y - (a[..., None] * x + b[..., None])
+        s2 = (residuals ** 2).sum(axis=-1) / (n - 2)
+        a_error = np.sqrt(s2 / sxx)
+        b_error = np.sqrt(s2 * (x ** 2).sum(axis=-1) / (n * sxx))
+        return a, b, a_error, b_error
+
+    def _offline_observer(self) -> bool:
+        return hasattr(self.data_source, "observer_distance")
+
+    def _t_sun_to_observer(self, index_event) -> float:
+        if self._offline_observer():
+            time = self.df_times.loc[index_event][self.BG_START_TIME_COLNAME]
+            return self.data_source.observer_distance(time) * self.AU_TO_M_RATIO / self.C
+
+        import astropy.units as u
+        from sunpy.coordinates import spice
+
+        with self._profile("spice"):
+            return (
+                spice.get_body(
+                    "Solar Orbiter",
+                    self.df_times.loc[index_event][self.BG_START_TIME_COLNAME],
+                    spice_frame="SOLO_HEEQ"
+                )
+                .distance.to(u.AU).value
+                * self.AU_TO_M_RATIO
+                / self.C
+            )
+
+    def explore_onset_combinations(
+        self,
+        max_combinations: int | None = None,
+        random_seed: int = 101010101,
+    ) -> pd.DataFrame:
+        """Fits every combination of available viewings across the channels of each event.
+
+        When an event has more than `max_combinations` combinations, that many
+        different ones are drawn at random instead. The distribution of the fits is
+        stored in `df_combinations` and the selection with the smallest residual
+        scatter per event is returned, in the same format as `parameters.selected_onsets`.
+        Equal scatters (e.g. of two channels, always on a line) and undefined ones
+        (all the channels at the same inverse beta) are decided by the viewings
+        hierarchy, as in `select_onsets_by_hierarchy`.
+        """
+        if max_combinations is None:
+            max_combinations = self.parameters.max_onset_combinations
+        rng = np.random.default_rng(random_seed)
+        hierarchy = pd.Index(self.parameters.viewings_hierarchy or self.VIEWINGS_HIERARCHY)
+
+        df_selected = self.construct_empty_selection()
+
+        df_combinations = []
+        keys = []
+        for index_event, df_event in self.df_options.groupby(level=0, sort=False):
+            onsets = df_event["Onset Time"].droplevel(0)
+            channels = onsets.index.droplevel("viewing").unique()
+            options = [onsets.loc[channel] for channel in channels]
+            n_options = np.array([len(o) for o in options])
+            if len(channels) < 2:
+                print(f"Not enough onset points in event {index_event}.")
+                continue
+
+            # onset timestamps padded to (channel, viewing option)
+            timestamps = np.full((len(channels), n_options.max()), np.nan)
+            # and their ranks in the hierarchy, viewings missing from it last
+            ranks = np.full(timestamps.shape, len(hierarchy))
+            for i, o in enumerate(options):
+                timestamps[i, :len(o)] = pd.to_datetime(o.values).asi8 / 1e9
+                rank = hierarchy.get_indexer(o.index)
+                ranks[i, :len(o)] = np.where(rank < 0, len(hierarchy), rank)
+            inv_betas = np.array([
+                self.df_channels_chars.loc[(sensor, particle, channel), "Inverse Beta"]
+                for sensor, particle, _, channel in channels
+            ])
+
+            n_total = int(np.prod(n_options, dtype=float))
+            if n_total <= max_combinations:
+                choices = np.stack(np.unravel_index(np.arange(n_total), n_options), axis=1)
+            elif n_total < np.iinfo(np.int64).max:
+                flat = np.sort(rng.choice(n_total, size=max_combinations, replace=False))
+                choices = np.stack(np.unravel_index(flat, n_options), axis=1)
+            else:
+                # too many combinations to number them, duplicates are then negligible
+                choices = rng.integers(0, n_options, size=(max_combinations, len(channels)))
+
+            y = timestamps[np.arange(len(channels)), choices]
+            x = np.broadcast_to(inv_betas, y.shape)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                # NaN fits when all the channels have the same inverse beta
+                a, b, a_error, b_error = self._linear_regression(x, y)
+                score = np.sqrt(((y - (a[:, None] * x + b[:, None])) ** 2).mean(axis=1))
+
+            t_sun_to_observer = self._t_sun_to_observer(index_event)
+            df_combinations.append(pd.DataFrame({
+                "Release Time": pd.to_datetime(b + t_sun_to_observer, unit="s"),
+                "Release Time Error": pd.to_timedelta(b_error, unit="s"),
+                "APL": a / t_sun_to_observer,
+                "APL Error": a_error / t_sun_to_observer,
+                "Score": score,
+            }))
+            keys.append(index_event)
+
+            finite = np.isfinite(score)
+            if finite.any():
+                # within a millisecond, far below the resolution of the onsets
+                candidates = np.flatnonzero(finite & (score <= score[finite].min() + 1e-3))
+            else:
+                candidates = np.arange(len(score))
+            candidate_ranks = ranks[np.arange(len(channels)), choices[candidates]]
+            # the highest ranked viewing of the first channel, then of the second one, ...
+            best = choices[candidates[np.lexsort(candidate_ranks.T[::-1])[0]]]
+            for (sensor, particle, particle_prefix, channel), o, c in zip(channels, options, best):
+                df_selected.loc[(index_event, sensor, particle, particle_prefix, channel), "Viewing"] = o.index[c]
+
+        self.df_combinations = pd.concat(
+            df_combinations, keys=keys, names=[self.EVENT_INDEX_NAME, "Combination"]
+        ) if df_combinations else pd.DataFrame({})
+
+        return df_selected
+
     def _plot_onset(
         self,
         series: pd.Series,
@@ -558,6 +1308,8 @@ class VDA:
         vlines: dict = None,
         hlines: dict = None,
     ) -> None:
+        from matplotlib import pyplot as plt
+
         ax = series.fillna(0).plot(title=title, logy=True, label="Data")
         ax.set_ylim((ylim := ax.get_ylim())[0] * 0.01, ylim[1] * 100)
         ax.axvline(onset_time, linestyle="--", label="Onset time")
@@ -586,46 +1338,62 @@ class VDA:
         plt.tight_layout()
         plt.show()
 
+    @property
+    def kinematics(self) -> VDA_kinematics_table:
+        """Kinematics of every contiguous channel range, built once per `df_energies`."""
+        if self._kinematics is None or self._kinematics[0] is not self.df_energies:
+            table = VDA_kinematics_table.from_energies(
+                self.df_energies,
+                self.parameters.AVAILABLE_CHANNELS,
+                {"protons": self.PROTON_COLUMN_PREFIX, "electrons": self.ELECTRON_COLUMN_PREFIX},
+                self.M_REST,
+            )
+            self._kinematics = (self.df_energies, table)
+        return self._kinematics[1]
+
+    @property
+    def plan(self) -> VDA_plan:
+        """What the stages iterate over, compiled again only when the channel groups, viewings or
+        `df_energies` change."""
+        fingerprint = self.parameters.fingerprint("channel_groups", "viewings_tt")
+        energies = getattr(self, "df_energies", None)
+        if self._plan is None or self._plan[0] != fingerprint or self._plan[1] is not energies:
+            plan = VDA_plan.compile(
+                self.parameters,
+                {"protons": self.PROTON_COLUMN_PREFIX, "electrons": self.ELECTRON_COLUMN_PREFIX},
+                self.kinematics.width if energies is not None else None,
+            )
+            self._plan = (fingerprint, energies, plan)
+        return self._plan[2]
+
+    @_profiled("df_channels_chars")
     def construct_energy_channels_characteristics(self):
-        self.df_channels_chars = pd.DataFrame({})
-        for sensor, particles in self.parameters.sensors_particles.items():
-            for particle in particles:
-                if particle == "protons":
-                    particle_prefix = self.PROTON_COLUMN_PREFIX
-                elif particle == "electrons":
-                    particle_prefix = self.ELECTRON_COLUMN_PREFIX
-                for channel in list(
-                    self.df_grouped[sensor][particle][self.parameters.viewings[0]][
-                        particle_prefix
-                    ].columns
-                ):
-                    low_energy_key = f"{particle_prefix}_{self.parameters.channel_groups[particle][channel]['channels'][0]}"
-                    high_energy_key = f"{particle_prefix}_{self.parameters.channel_groups[particle][channel]['channels'][-1]}"
-                    low_energy = self.df_energies.loc[sensor, low_energy_key]["Low Energy"]
-                    high_energy = self.df_energies.loc[sensor, high_energy_key]["High Energy"]
-                    
-                    geo_mean = sqrt(low_energy) * sqrt(high_energy)
-                    inv_beta = 1 / sqrt(
-                        1 - (1 / (1 + geo_mean / self.M_REST[particle])) ** 2
-                    )
-                    self.df_channels_chars = pd.concat(
-                        [
-                            self.df_channels_chars,
-                            pd.DataFrame(
-                                {
-                                    "Geomagnetic Mean": [geo_mean],
-                                    "Inverse Beta": [inv_beta],
-                                },
-                                index=[[sensor], [particle], [channel]],
-                            ),
-                        ]
-                    )
-        self.df_channels_chars.index.names = ["sensor", "particle", "channel"]
+        group_sensors, group_particles, group_channels, firsts, lasts = [], [], [], [], []
+        plan = self.plan
+        for item in plan.select(viewing=plan.viewings[0]):
+            for key, channels in zip(item.groups, item.channels):
+                group_sensors.append(item.sensor)
+                group_particles.append(item.particle)
+                group_channels.append(key)
+                firsts.append(channels[0])
+                lasts.append(channels[-1])
+
+        self.df_channels_chars = self.kinematics.gather(group_sensors, group_particles, firsts, lasts)[
+            ["Geomagnetic Mean", "Inverse Beta"]
+        ]
+        self.df_channels_chars.index = pd.MultiIndex.from_arrays(
+            [group_sensors, group_particles, group_channels], names=["sensor", "particle", "channel"]
+        )
 
         if self.parameters.view_dfs:
             return self.df_channels_chars
 
+    @_profiled()
     def define_spacecraft_parameters(self):
+        if self._offline_observer():
+            # the data source provides the observer distance, no SPICE kernels are needed
+            return
+
         kernel_urls = [
             "ck/solo_ANC_soc-sc-fof-ck_20180930-21000101_V03.bc",
             "ck/solo_ANC_soc-stix-ck_20180930-21000101_V03.bc",
@@ -642,156 +1410,273 @@ class VDA:
         kernel_urls = [f"https://spiftp.esac.esa.int/data/SPICE/SOLAR-ORBITER/kernels/{url}"
                     for url in kernel_urls]
 
+        from sunpy.coordinates import spice
+        from sunpy.data import cache
+
         kernel_files = [cache.download(url) for url in kernel_urls]
 
         spice.initialize(kernel_files)
 
-    def plot(self, savefig: bool = True, returnfig: bool = False):
-        for index_event, df_event in self.df_options.groupby(level=0):
-            vda_points = []
-            t_sun_to_observer = (
-                spice.get_body(
-                    "Solar Orbiter",
-                    self.df_times.loc[index_event][self.BG_START_TIME_COLNAME],
-                    spice_frame="SOLO_HEEQ"
-                )
-                .distance.to(u.AU).value
-                * self.AU_TO_M_RATIO
-                / self.C
-            )
-            for i, row in self.parameters.selected_onsets.loc[index_event].iterrows():
-                if row["Viewing"] is None:
-                    continue
-                sensor, particle, particle_prefix, channel = i
-                vda_points.append(
-                    (self.df_channels_chars.loc[
-                        sensor, particle, channel
-                    ]["Inverse Beta"],
-                    self.df_onsets_existing.loc[
-                        index_event,
-                        sensor,
-                        particle,
-                        row["Viewing"],
-                        particle_prefix,
-                        channel
-                    ]["Onset Time"]
-                    .to_pydatetime()
-                    .timestamp())
-                )
+    def _vda_points(self) -> dict:
+        """Joins the selected onsets with their onset times and inverse betas, for all the events at once.
 
-            if len(vda_points) < 2:
+        Returns, per event, the inverse betas and onset timestamps [s] of its selected onsets, by inverse beta.
+        """
+        selected = self.parameters.selected_onsets
+        selected = selected[selected["Viewing"].notna()]
+        events, sensors, particles, prefixes, channels = (
+            selected.index.get_level_values(i) for i in range(5)
+        )
+        onset_positions = self.existing_onset_store.index.get_indexer(
+            pd.MultiIndex.from_arrays([events, sensors, particles, selected["Viewing"], prefixes, channels])
+        )
+        chars_positions = self.df_channels_chars.index.get_indexer(
+            pd.MultiIndex.from_arrays([sensors, particles, channels])
+        )
+        if (onset_positions < 0).any() or (chars_positions < 0).any():
+            raise KeyError("Some selected onsets have no onset time or no channel characteristics")
+        inv_betas = self.df_channels_chars["Inverse Beta"].to_numpy(dtype=float)[chars_positions]
+        timestamps = self.existing_onset_store["Onset Time"][onset_positions].astype(np.int64) / 1e9
+
+        codes, uniques = pd.factorize(events)
+        # lexsort is stable: equal inverse betas keep the order of the selection
+        order = np.lexsort((inv_betas, codes))
+        bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+        return {
+            event: (inv_betas[order[start:end]], timestamps[order[start:end]])
+            for event, start, end in zip(uniques, bounds[:-1], bounds[1:])
+        }
+
+    @_profiled("results")
+    def calculate_vda(self):
+        if self.parameters.selected_onsets is None:
+            raise ValueError("No onsets are selected, run select_onsets first")
+        self.vda_fits = {}
+        vda_points = self._vda_points()
+        total = self.df_options.index.get_level_values(0).nunique()
+        self._report_progress("calculate_vda", 0, total)
+        for done, (index_event, df_event) in enumerate(self.df_options.groupby(level=0), start=1):
+            self._report_progress("calculate_vda", done, total)
+            selected_onsets = self.parameters.selected_onsets.loc[index_event]
+            checkpoint = self._load_checkpoint("calculate_vda", index_event, selected_onsets)
+            if checkpoint is not None:
+                result, fit = checkpoint
+                if fit is None:
+                    self.results.loc[index_event] = np.nan
+                else:
+                    self.results.loc[index_event] = result
+                    self.vda_fits[index_event] = fit
+                continue
+            t_sun_to_observer = self._t_sun_to_observer(index_event)
+            inv_betas, timestamps = vda_points.get(index_event, (np.array([]), np.array([])))
+
+            if len(inv_betas) < 2:
                 # Not enough points for the linear regression
                 # Consider throughing warning
                 print(f"Not enough onset points in event {index_event}.")
                 self.results.loc[index_event] = np.nan
+                self._save_checkpoint("calculate_vda", index_event, (None, None), selected_onsets)
                 continue
 
-            vda_points = sorted(vda_points, key=lambda x: x[0])
-            inv_betas = np.array([p[0] for p in vda_points])
-            timestamps = np.array([p[1] for p in vda_points])
-
-            try:
-                p, V = np.polyfit(inv_betas, timestamps, 1, cov=True)
-                a = p[0]
-                b = p[1]
-                a_error = np.sqrt(V[0][0])
-                b_error = np.sqrt(V[1][1])
-            except ValueError:
-                # not enough points for cov matrix
-                print(
-                    f"Not enough points for covariance matrix generation in event {index_event}"
-                )
-                a, b = np.polyfit(inv_betas, timestamps, 1)
-                a_error = 0
-                b_error = 0
+            with self._profile("polyfit") as span:
+                span.rows = len(inv_betas)
+                try:
+                    p, V = np.polyfit(inv_betas, timestamps, 1, cov=True)
+                    a = p[0]
+                    b = p[1]
+                    a_error = np.sqrt(V[0][0])
+                    b_error = np.sqrt(V[1][1])
+                except ValueError:
+                    # not enough points for cov matrix
+                    print(
+                        f"Not enough points for covariance matrix generation in event {index_event}"
+                    )
+                    a, b = np.polyfit(inv_betas, timestamps, 1)
+                    a_error = 0
+                    b_error = 0
             
-            self.results.loc[index_event] = {
-                "Release Time": datetime.fromtimestamp(b + t_sun_to_observer).strftime('%Y-%m-%d %H:%M:%S'),
+            result = {
+                "Release Time": _from_timestamp(b + t_sun_to_observer).strftime('%Y-%m-%d %H:%M:%S'),
                 "Release Time Error": timedelta(seconds=b_error),
                 "Extra Time": timedelta(seconds=t_sun_to_observer),
                 "APL": a / t_sun_to_observer,
                 "APL Error": a_error / t_sun_to_observer,
             }
+            self.results.loc[index_event] = result
+            self.vda_fits[index_event] = {
+                "inv_betas": inv_betas,
+                "timestamps": timestamps,
+                "a": a,
+                "b": b,
+                "a_error": a_error,
+                "b_error": b_error,
+                "t_sun_to_observer": t_sun_to_observer,
+                "date": self.grouped_cube.event_times(index_event)[1].to_pydatetime().strftime('%Y-%m-%d'),
+            }
+            self._save_checkpoint("calculate_vda", index_event, (result, self.vda_fits[index_event]), selected_onsets)
+
+        if self.parameters.results_store != "":
+            self.update_results_store()
+
+        if self.parameters.view_dfs:
+            return self.results
+
+    def _figure_filename(self, index_event, suffix: str = "", extension: str = "png") -> str:
+        # date_str = self.df_grouped.loc[index_event].index[1].to_pydatetime().strftime('%Y-%m-%d')
+        time_start_str = self.df_times.loc[index_event][self.BG_START_TIME_COLNAME].strftime("%Y-%m-%d_%H%M")
+        time_end_str = self.df_times.loc[index_event][self.END_TIME_COLNAME].strftime("%Y-%m-%d_%H%M")
+        date_str = f"{time_start_str}_{time_end_str}"
+        particles_str = "_".join([f'{s}-{p}' for s, ps in self.parameters.sensors_particles.items() for p in ps])
+        freq_str = self.parameters.resample_frequency if self.parameters.resample_frequency != "" else "noresample"
+        return f"{date_str}_{particles_str}_{freq_str}{suffix}.{extension}"
+
+    def _draw_vda(self, fig, ax, index_event, fit: dict) -> None:
+        from matplotlib import dates as mdates
+
+        inv_betas = fit["inv_betas"]
+        timestamps = fit["timestamps"]
+        a, b, a_error, b_error = fit["a"], fit["b"], fit["a_error"], fit["b_error"]
+        t_sun_to_observer = fit["t_sun_to_observer"]
+
+        ax.scatter(
+            inv_betas,
+            [_from_timestamp(t) for t in timestamps],
+            color="black",
+        )
+        ax.plot(
+            inv_betas,
+            [_from_timestamp(a * x + b) for x in inv_betas],
+            label="Linear Regression",
+            color="blue",
+        )
+        ax.fill_between(
+            inv_betas,
+            [_from_timestamp(a * x + b - 2 * b_error) for x in inv_betas],
+            [_from_timestamp(a * x + b + 2 * b_error) for x in inv_betas],
+            color="blue",
+            alpha=0.1,
+        )
+        ax.set_title(f"Event {index_event} ({fit['date']})")
+        ax.set_xlabel("Inverse Beta")
+        ax.set_ylabel("Time")
+        time_formatter = mdates.DateFormatter("%H:%M")
+        ax.yaxis.set_major_formatter(time_formatter)
+        ax.plot(
+            [],
+            [],
+            alpha=0,
+            label=f"Extra Time = {str(timedelta(seconds=t_sun_to_observer)).split('.')[0]}",
+        )
+        ax.plot(
+            [],
+            [],
+            alpha=0,
+            label=f"Release Time = {_from_timestamp(b + t_sun_to_observer).strftime('%Y-%m-%d %H:%M:%S')} +/- {str(timedelta(seconds=b_error)).split('.')[0]}",
+        )
+        ax.plot(
+            [],
+            [],
+            alpha=0,
+            label=f"APL = {a / t_sun_to_observer:.2f} +/- {a_error / t_sun_to_observer:.2f}",
+        )
+        ax.legend(bbox_to_anchor=(1, 0.6), loc="upper left")
+        fig.tight_layout()
+
+    @_profiled()
+    def plot(self, savefig: bool = True, returnfig: bool = False):
+        from matplotlib import pyplot as plt
 
+        self.calculate_vda()
+        for index_event, fit in self.vda_fits.items():
             fig, ax = plt.subplots(figsize=(10, 8))
-            ax.scatter(
-                inv_betas,
-                [datetime.fromtimestamp(t) for t in timestamps],
-                color="black",
-            )
-            ax.plot(
-                inv_betas,
-                [datetime.fromtimestamp(a * x + b) for x in inv_betas],
-                label="Linear Regression",
-                color="blue",
-            )
-            ax.fill_between(
-                inv_betas,
-                [datetime.fromtimestamp(a * x + b - 2 * b_error) for x in inv_betas],
-                [datetime.fromtimestamp(a * x + b + 2 * b_error) for x in inv_betas],
-                color="blue",
-                alpha=0.1,
-            )
-            plt.title(f"Event {index_event} ({self.df_grouped.loc[index_event].index[1].to_pydatetime().strftime('%Y-%m-%d')})")
-            plt.xlabel("Inverse Beta")
-            plt.ylabel("Time")
-            time_formatter = mdates.DateFormatter("%H:%M")
-            ax.yaxis.set_major_formatter(time_formatter)
-            plt.plot(
-                [],
-                [],
-                alpha=0,
-                label=f"Extra Time = {str(timedelta(seconds=t_sun_to_observer)).split('.')[0]}",
-            )
-            plt.plot(
-                [],
-                [],
-                alpha=0,
-                label=f"Release Time = {datetime.fromtimestamp(b + t_sun_to_observer).strftime('%Y-%m-%d %H:%M:%S')} +/- {str(timedelta(seconds=b_error)).split('.')[0]}",
-            )
-            plt.plot(
-                [],
-                [],
-                alpha=0,
-                label=f"APL = {a / t_sun_to_observer:.2f} +/- {a_error / t_sun_to_observer:.2f}",
-            )
-            plt.legend(bbox_to_anchor=(1, 0.6), loc="upper left")
-            plt.tight_layout()
+            with self._profile("draw_vda"):
+                self._draw_vda(fig, ax, index_event, fit)
             if savefig:
-                # date_str = self.df_grouped.loc[index_event].index[1].to_pydatetime().strftime('%Y-%m-%d')
-                time_start_str = self.df_times.loc[index_event][self.BG_START_TIME_COLNAME].strftime("%Y-%m-%d_%H%M")
-                time_end_str = self.df_times.loc[index_event][self.END_TIME_COLNAME].strftime("%Y-%m-%d_%H%M")
-                date_str = f"{time_start_str}_{time_end_str}"
-                particles_str = "_".join([f'{s}-{p}' for s, ps in self.parameters.sensors_particles.items() for p in ps])
-                freq_str = self.parameters.resample_frequency if self.parameters.resample_frequency != "" else "noresample"
-                filename = f"{date_str}_{particles_str}_{freq_str}.png"
-                plt.savefig(filename)
+                plt.savefig(self._figure_filename(index_event))
             plt.show()
             if returnfig:
                 return fig
 
+    def _bg_selection_window(self, event_no) -> tuple:
+        bg_start = self.df_times.loc[event_no][self.BG_START_TIME_COLNAME] \
+                   if self.parameters.input_type == 1 \
+                   else self.grouped_cube.event_times(event_no)[self.parameters.onset_method_parameters["bg_start"]]
+        bg_end = self.df_times.loc[event_no][self.BG_END_TIME_COLNAME] \
+                 if self.parameters.input_type == 1 \
+                 else self.grouped_cube.event_times(event_no)[self.parameters.onset_method_parameters["bg_end"]]
+        return bg_start, bg_end
+
+    def _draw_bg_selection(self, ax, temp_df: pd.DataFrame, bg_start: datetime, bg_end: datetime) -> None:
+        ax.plot(temp_df)
+        bot_lim, top_lim = ax.get_ylim()
+        if bot_lim <= 0:
+            bot_lim = np.nanmin(temp_df.replace(0, np.nan).values)
+        ax.fill_betweenx([0, top_lim*10],
+                         bg_start,
+                         bg_end,
+                         color="green",
+                         alpha=0.3)
+
+        ax.set_ylabel("Flux")
+        ax.set_yscale("log")
+        ax.set_ylim(bot_lim/10, top_lim*10)
+        ax.set_xlabel("Time")
+
+    @_profiled()
     def plot_bg_selection(self):
-        for event_no, event in self.df_grouped.groupby(level=0):
+        from matplotlib import pyplot as plt
+
+        for event_no in sorted(self.grouped_cube.events):
             _, ax = plt.subplots(figsize=(10, 8))
-            temp_df = event.droplevel(0)
-            plt.plot(temp_df)
-            bot_lim, top_lim = ax.get_ylim()
-            if bot_lim <= 0:
-                bot_lim = np.nanmin(temp_df.replace(0, np.nan).values)
-            bg_start = self.df_times.loc[event_no][self.BG_START_TIME_COLNAME] \
-                       if self.parameters.input_type == 1 \
-                       else self.df_grouped.loc[event_no].index[self.parameters.onset_method_parameters["bg_start"]]
-            bg_end = self.df_times.loc[event_no][self.BG_END_TIME_COLNAME] \
-                     if self.parameters.input_type == 1 \
-                     else self.df_grouped.loc[event_no].index[self.parameters.onset_method_parameters["bg_end"]]
-            plt.fill_betweenx([0, top_lim*10],
-                              bg_start,
-                              bg_end,
-                              color="green",
-                              alpha=0.3)
-
-            ax.set_ylabel("Flux")
-            ax.set_yscale("log")
-            ax.set_ylim(bot_lim/10, top_lim*10)
-            ax.set_xlabel("Time")
+            self._draw_bg_selection(ax, self.grouped_cube.event_frame(event_no), *self._bg_selection_window(event_no))
             plt.show()
+
+    def _draw_onset_panel(self, ax, series: pd.Series, onset_results: pd.Series | None) -> None:
+        from matplotlib import dates as mdates
+
+        ax.plot(series.fillna(0).ffill(), label="Data")
+        if onset_results is None:
+            return
+        xlim = ax.get_xlim()
+        ylim = ax.get_ylim()
+        ax.fill_betweenx([0, ylim[1]],
+                         onset_results["Background Start"],
+                         onset_results["Background End"],
+                         color="green",
+                         alpha=0.3,
+                         label="BG Sample")
+        if pd.notna(onset_results.get("bg_level")):
+            ax.hlines(onset_results["bg_level"],
+                      xlim[0],
+                      xlim[1],
+                      color="green",
+                      linestyles="dashed",
+                      label=f'BG ({onset_results["bg_level"]:.2f})')
+            ax.hlines(onset_results["threshold"],
+                      xlim[0],
+                      xlim[1],
+                      color="red",
+                      linestyles="dashed",
+                      label=f'Threshold ({onset_results["threshold"]:.2f})')
+        ax.vlines(onset_results["Onset Time"],
+                  0,
+                  ylim[1],
+                  color="purple",
+                  linestyles="dashed",
+                  label=f'Onset ({onset_results["Onset Time"].strftime("%H:%M")})')
+
+        ax.set_xlim(xlim)
+        ax.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M"))
+        ax.set_yscale("log")
+
+        ax.legend()
+
+    def _onset_panels_shape(self, nplots: int, ncols: int = 3) -> tuple:
+        if nplots <= ncols:
+            return 1, nplots
+        return ceil(nplots/ncols), ncols
+
+    def _energy_range_str(self, sensor: str, particle: str, channel: str) -> str:
+        used_i = self.parameters.channel_groups[particle][channel]["channels"]
+        low_energy, high_energy, _, _ = self.kinematics.lookup(sensor, particle, used_i[0], used_i[-1])
+        return f"{low_energy:.2f}-{high_energy:.2f}"
@@ -0,0 +1,254 @@
+"""Runs the VDA tool without the notebook.
+
+Example:
+    python vda_cli.py run config.toml --output-dir results
+
+The configuration file is a JSON or TOML serialization of `VDA_parameters`
+(see `VDA_parameters.save`). The exit status is 0 on success, 1 when the
+analysis fails and 2 when the configuration is invalid.
+
+Large catalogs can be split in shards, run by independent processes or nodes
+sharing the output directory, and merged afterwards:
+    python vda_cli.py run config.toml --output-dir results --shard 0/4
+    ...
+    python vda_cli.py run config.toml --output-dir results --shard 3/4
+    python vda_cli.py merge results
+"""
+import argparse
+import json
+import re
+import shutil
+import sys
+
+import pandas as pd
+
+from glob import glob
+from os import listdir, makedirs, path, remove
+
+from vda_tool_configuration import VDA_parameters
+
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_INVALID_CONFIG = 2
+
+# onset selection modes that need no user interaction
+HEADLESS_ONSET_SELECTIONS = (0, 3)
+
+# written last into an output directory, once all its outputs are complete
+DONE_FILENAME = "DONE"
+SHARD_DIRNAME = "shard-{}-of-{}"
+
+
+def _load_parameters(filepath: str, shard: str | None = None, checkpoint_dir: str | None = None,
+                     resume: bool = False, results_store: str | None = None,
+                     prefetch: int | None = None) -> VDA_parameters:
+    parameters = VDA_parameters.load(filepath)
+    if prefetch is not None:
+        parameters.prefetch_events = prefetch
+    if results_store is not None:
+        parameters.results_store = results_store
+    if checkpoint_dir is not None:
+        parameters.checkpoint_dir = checkpoint_dir
+    if resume:
+        if parameters.checkpoint_dir == "":
+            raise ValueError("Resuming needs a checkpoint directory")
+        parameters.resume = True
+    if shard is not None:
+        try:
+            parameters.shard = [int(x) for x in shard.split("/")]
+        except ValueError:
+            raise ValueError(f'Invalid shard "{shard}", expected <index>/<count>')
+    if parameters.shard is not None and (len(parameters.shard) != 2
+                                         or not 0 <= parameters.shard[0] < parameters.shard[1]):
+        raise ValueError(f"Invalid shard {parameters.shard}, expected [index, count] with 0 <= index < count")
+    if parameters.prefetch_events < 0:
+        raise ValueError(f"Invalid number of prefetched events {parameters.prefetch_events}")
+    if parameters.prefetch_events > 0 and parameters.load_data:
+        raise ValueError("Prefetching loads the data of the events, it cannot be combined with load_data")
+    parameters.view_dfs = False
+    if len(parameters.channel_groups) == 0:
+        parameters.channel_groups = parameters.channel_groups_from_defaults()
+    if parameters.onset_selection not in HEADLESS_ONSET_SELECTIONS:
+        raise ValueError(
+            f"Onset selection {parameters.onset_selection} needs the notebook, "
+            f"use one of {HEADLESS_ONSET_SELECTIONS}"
+        )
+    return parameters
+
+
+def _write_outputs(output_dir: str, results: pd.DataFrame, selected_onsets: pd.DataFrame,
+                   df_onsets: pd.DataFrame) -> None:
+    # the pickles keep the exact values and types (e.g. for merging), the csv files are for reading
+    results.to_pickle(path.join(output_dir, "results.pkl"))
+    selected_onsets.to_pickle(path.join(output_dir, "selected_onsets.pkl"))
+    df_onsets.to_pickle(path.join(output_dir, "onsets.pkl"))
+    results.to_csv(path.join(output_dir, "results.csv"))
+    selected_onsets.to_csv(path.join(output_dir, "selected_onsets.csv"))
+
+
+def _write_done(output_dir: str, info: dict) -> None:
+    with open(path.join(output_dir, DONE_FILENAME), "w") as f:
+        json.dump(info, f)
+
+
+def _read_done(output_dir: str) -> dict | None:
+    try:
+        with open(path.join(output_dir, DONE_FILENAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def run(args) -> int:
+    try:
+        parameters = _load_parameters(args.config, args.shard, args.checkpoint_dir, args.resume, args.results_store,
+                                      args.prefetch)
+    except (OSError, ValueError) as e:
+        print(f"Invalid configuration: {e}", file=sys.stderr)
+        return EXIT_INVALID_CONFIG
+    # identifies the campaign, so that only shards of the same configuration are merged
+    campaign_fingerprint = parameters.fingerprint(
+        *sorted(set(vars(parameters)) - {"shard", "checkpoint_dir", "resume", "results_store", "prefetch_events"})
+    )
+
+    output_dir = args.output_dir
+    if parameters.shard is not None:
+        output_dir = path.join(output_dir, SHARD_DIRNAME.format(*parameters.shard))
+    if _read_done(output_dir) is not None:
+        # outputs of a previous run are about to be replaced
+        remove(path.join(output_dir, DONE_FILENAME))
+
+    # the analysis modules are only needed once the configuration is valid
+    from vda import VDA
+    from vda_pipeline import VDA_pipeline
+    from vda_render import VDA_renderer
+
+    vda = VDA(parameters)
+    if args.profile is not None:
+        from vda_profiler import VDA_profiler
+        vda.profiler = VDA_profiler(memory=args.profile_memory)
+    pipeline = VDA_pipeline(vda, cache_dir=args.cache_dir)
+    try:
+        pipeline.run(until="construct_times_df")
+        if parameters.input_type == 1:
+            vda.define_bg_windows()
+        if parameters.prefetch_events > 0:
+            # the next events are loaded while the current one is processed
+            vda.run_streaming()
+        else:
+            pipeline.run()
+
+        makedirs(output_dir, exist_ok=True)
+        _write_outputs(output_dir, vda.results, parameters.selected_onsets, vda.df_onsets)
+        if len(args.figures) > 0:
+            campaign = path.splitext(path.basename(args.config))[0]
+            if parameters.shard is not None:
+                campaign += "-" + SHARD_DIRNAME.format(*parameters.shard)
+            VDA_renderer(vda).render(
+                output_dir,
+                figures=tuple(args.figures),
+                fmt=args.format,
+                processes=args.processes,
+                campaign=campaign,
+            )
+        _write_done(output_dir, {"shard": parameters.shard, "fingerprint": campaign_fingerprint})
+    except Exception as e:
+        print(f"VDA run failed: {type(e).__name__}: {e}", file=sys.stderr)
+        return EXIT_FAILED
+    finally:
+        if vda.profiler is not None:
+            vda.profiler.stop()
+            vda.profiler.export_trace(args.profile)
+            print(vda.profiler.report().to_string())
+
+    print(f"Results written to {output_dir}")
+    return EXIT_OK
+
+
+def merge(args) -> int:
+    """Merges the outputs of all the shards found in the output directory, in event order."""
+    shard_dirs = {}
+    for shard_dir in glob(path.join(args.output_dir, SHARD_DIRNAME.format("*", "*"))):
+        index, count = (int(x) for x in re.findall(r"\d+", path.basename(shard_dir)))
+        shard_dirs[index, count] = shard_dir
+    counts = {count for _, count in shard_dirs}
+    if len(counts) != 1:
+        print(f"Expected the shards of exactly one run in {args.output_dir}, found counts {sorted(counts)}",
+              file=sys.stderr)
+        return EXIT_FAILED
+    count = counts.pop()
+
+    infos = {}
+    for index in range(count):
+        info = _read_done(shard_dirs[index, count]) if (index, count) in shard_dirs else None
+        if info is None:
+            print(f"Shard {index}/{count} is not done", file=sys.stderr)
+            return EXIT_FAILED
+        infos[index] = info
+    if len({info["fingerprint"] for info in infos.values()}) != 1:
+        print("The shards were run with different configurations", file=sys.stderr)
+        return EXIT_FAILED
+
+    shard_dirs = [shard_dirs[index, count] for index in range(count)]
+    merged = []
+    for filename in ("results.pkl", "selected_onsets.pkl", "onsets.pkl"):
+        df = pd.concat([pd.read_pickle(path.join(d, filename)) for d in shard_dirs])
+        # stable sort on the event number only: the order within an event is the one of a single run
+        merged.append(df.iloc[df.index.get_level_values(0).argsort(kind="stable")])
+    _write_outputs(args.output_dir, *merged)
+
+    for shard_dir in shard_dirs:
+        for filename in listdir(shard_dir):
+            if filename.endswith((".png", ".pdf")):
+                shutil.copyfile(path.join(shard_dir, filename), path.join(args.output_dir, filename))
+    _write_done(args.output_dir, {"shard": None, "fingerprint": infos[0]["fingerprint"]})
+
+    print(f"Merged {count} shards into {args.output_dir}")
+    return EXIT_OK
+
+
+def construct_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="vda_cli.py", description="Velocity Dispersion Analysis of SEP events.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_run = subparsers.add_parser("run", help="run the full analysis of a configuration")
+    parser_run.add_argument("config", help="VDA_parameters configuration file (.json or .toml)")
+    parser_run.add_argument("-o", "--output-dir", default="vda_output", help="directory of the results and figures")
+    parser_run.add_argument("--figures", nargs="*", default=["vda"],
+                            choices=["vda", "bg_selection", "onsets"], help="figures to render")
+    parser_run.add_argument("--format", default="png", choices=["png", "pdf"],
+                            help="one file per figure (png) or one multi-page file (pdf)")
+    parser_run.add_argument("--processes", type=int, default=None, help="figure rendering processes")
+    parser_run.add_argument("--cache-dir", default=None, help="directory of the cached stage outputs")
+    parser_run.add_argument("--shard", default=None, metavar="INDEX/COUNT",
+                            help="run only every COUNT-th event starting at INDEX (0-based), "
+                                 "into the shard-INDEX-of-COUNT subdirectory")
+    parser_run.add_argument("--checkpoint-dir", default=None,
+                            help="directory of the per-event checkpoints of the long running stages")
+    parser_run.add_argument("--results-store", default=None,
+                            help="file of the results of processed events, reused for unchanged events")
+    parser_run.add_argument("--resume", action="store_true",
+                            help="skip the events already checkpointed by an interrupted run")
+    parser_run.add_argument("--prefetch", type=int, default=None, metavar="EVENTS",
+                            help="load the data of the next EVENTS events in the background while "
+                                 "processing the current one (without the stage cache)")
+    parser_run.add_argument("--profile", default=None, metavar="TRACEFILE",
+                            help="print the time spent per stage and write a Chrome trace (.json)")
+    parser_run.add_argument("--profile-memory", action="store_true",
+                            help="also trace the peak memory of every stage (slow)")
+    parser_run.set_defaults(func=run)
+
+    parser_merge = subparsers.add_parser("merge", help="merge the outputs of the shards of a run")
+    parser_merge.add_argument("output_dir", help="output directory given to the shard runs")
+    parser_merge.set_defaults(func=merge)
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = construct_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
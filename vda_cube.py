@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+
+from os import close, makedirs, remove
+from tempfile import mkstemp
+
+
+class VDA_event_cube:
+    """Time series of all the events of a catalog, in one contiguous (time x column) float array.
+
+    The rows of the events are stored one event after the other: the rows of
+    `events[i]` are `offsets[i]:offsets[i + 1]`, at the `times` of the same rows.
+    Every event has the same `columns`, a (sensor, particle, viewing, prefix,
+    channel) MultiIndex whose levels are the categorical coordinates of the
+    columns. The rows of an event, and selections of columns that are next to
+    each other (like a sensor, particle and viewing), share the array instead of
+    copying it.
+    `to_frame` and `event_frame` export pandas views of the array.
+    The values may be float32 (see `VDA_parameters.reduced_precision`) and, when
+    larger than the memory budget, a memory map of a file (see `from_frames`).
+    """
+
+    def __init__(self, values: np.ndarray, times: np.ndarray, events: np.ndarray, offsets: np.ndarray,
+                 columns: pd.MultiIndex, names: tuple = ("Event No", "Time")):
+        if values.shape != (len(times), len(columns)) or offsets[-1] != len(times) \
+                or len(offsets) != len(events) + 1:
+            raise ValueError("The values, times, event offsets and columns of an event cube do not match")
+        self.values = values
+        self.times = times
+        self.events = events
+        self.offsets = offsets
+        self.columns = columns
+        self.names = tuple(names)
+        self._positions = {event: i for i, event in enumerate(events)}
+
+    @classmethod
+    def from_frames(cls, events: list, frames: list, names: tuple = ("Event No", "Time"), dtype=float,
+                    spill_dir: str | None = None, max_bytes: int = 0) -> "VDA_event_cube":
+        """Builds a cube from one DataFrame (time index, MultiIndex columns) per event.
+
+        Frames can also be given as the paths of pickled DataFrames (spilled to disk), which are then
+        read one at a time. With a `spill_dir`, values of more than `max_bytes` are memory mapped from
+        a file there instead of being held in memory.
+        """
+        if len(frames) == 0:
+            return cls(np.empty((0, 0), dtype=dtype), np.array([], dtype="datetime64[ns]"), np.array(events),
+                       np.zeros(1, dtype=np.int64), pd.MultiIndex.from_arrays([[]] * 5), names)
+        columns = None
+        lengths = []
+        times = []
+        for frame in map(cls._frame, frames):
+            if columns is None:
+                columns = frame.columns
+            elif not frame.columns.equals(columns):
+                columns = columns.union(frame.columns, sort=False)
+            lengths.append(len(frame))
+            times.append(frame.index.to_numpy())
+        offsets = np.zeros(len(frames) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+        values = cls._allocate((offsets[-1], len(columns)), dtype, spill_dir, max_bytes)
+        for frame, start, end in zip(map(cls._frame, frames), offsets[:-1], offsets[1:]):
+            if not frame.columns.equals(columns):
+                frame = frame.reindex(columns=columns)
+            values[start:end] = frame.to_numpy(dtype=dtype)
+        return cls(values, np.concatenate(times), np.array(events), offsets, columns, names)
+
+    @classmethod
+    def _frame(cls, frame) -> pd.DataFrame:
+        return pd.read_pickle(frame) if isinstance(frame, str) else frame
+
+    @classmethod
+    def _allocate(cls, shape: tuple, dtype, spill_dir: str | None, max_bytes: int) -> np.ndarray:
+        if spill_dir is None or np.prod(shape) * np.dtype(dtype).itemsize <= max_bytes:
+            return np.empty(shape, dtype=dtype)
+        makedirs(spill_dir, exist_ok=True)
+        handle, filepath = mkstemp(suffix=".npy", dir=spill_dir)
+        close(handle)
+        values = np.lib.format.open_memmap(filepath, mode="w+", dtype=dtype, shape=shape)
+        try:
+            # the mapping outlives the file, which is then freed with the cube
+            remove(filepath)
+        except OSError:
+            # Windows: files in use are not removed
+            pass
+        return values
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, dtype=float) -> "VDA_event_cube":
+        """Builds a cube from a DataFrame with an (event, time) row MultiIndex, like `to_frame` exports."""
+        codes, events = pd.factorize(df.index.get_level_values(0))
+        if len(codes) > 0 and (np.diff(codes) < 0).any():
+            # the rows of every event have to be next to each other
+            order = np.argsort(codes, kind="stable")
+            df, codes = df.iloc[order], codes[order]
+        offsets = np.zeros(len(events) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(codes, minlength=len(events)))
+        return cls(
+            np.ascontiguousarray(df.to_numpy(dtype=dtype)),
+            df.index.get_level_values(1).to_numpy(),
+            np.asarray(events),
+            offsets,
+            df.columns,
+            df.index.names,
+        )
+
+    @classmethod
+    def concat_events(cls, cubes: list, spill_dir: str | None = None, max_bytes: int = 0) -> "VDA_event_cube":
+        """Stacks the events of several cubes (e.g. built one event at a time) into one cube.
+
+        `spill_dir` and `max_bytes` are the ones of `from_frames`.
+        """
+        cubes = [cube for cube in cubes if len(cube.events) > 0] or cubes[:1]
+        if len(cubes) == 0:
+            return cls.from_frames([], [])
+        if len(cubes) == 1:
+            return cubes[0]
+        first = cubes[0]
+        if any(not cube.columns.equals(first.columns) for cube in cubes[1:]):
+            # e.g. channels missing from the data of some events
+            events = [event for cube in cubes for event in cube.events]
+            frames = [cube.event_frame(event) for cube in cubes for event in cube.events]
+            return cls.from_frames(events, frames, first.names, first.values.dtype, spill_dir, max_bytes)
+        starts = np.cumsum([0] + [len(cube) for cube in cubes])
+        values = cls._allocate((starts[-1], len(first.columns)), first.values.dtype, spill_dir, max_bytes)
+        np.concatenate([cube.values for cube in cubes], out=values)
+        offsets = np.concatenate([first.offsets[:1]] + [cube.offsets[1:] + start
+                                                        for cube, start in zip(cubes, starts[:-1])])
+        return cls(values, np.concatenate([cube.times for cube in cubes]),
+                   np.concatenate([cube.events for cube in cubes]), offsets, first.columns, first.names)
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    @property
+    def shape(self) -> tuple:
+        return self.values.shape
+
+    def event_slice(self, event) -> slice:
+        i = self._positions[event]
+        return slice(self.offsets[i], self.offsets[i + 1])
+
+    def event_times(self, event) -> pd.DatetimeIndex:
+        return pd.DatetimeIndex(self.times[self.event_slice(event)], name=self.names[1])
+
+    def event_values(self, event) -> np.ndarray:
+        return self.values[self.event_slice(event)]
+
+    def event_frame(self, event) -> pd.DataFrame:
+        """Returns a DataFrame view of the rows of `event`, indexed by time."""
+        return pd.DataFrame(self.event_values(event), index=self.event_times(event), columns=self.columns,
+                            copy=False)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Returns a DataFrame view of the cube, with an (event, time) row MultiIndex."""
+        index = pd.MultiIndex.from_arrays(
+            [np.repeat(self.events, np.diff(self.offsets)), self.times], names=list(self.names)
+        )
+        return pd.DataFrame(self.values, index=index, columns=self.columns, copy=False)
+
+    def _indexer(self, positions: np.ndarray):
+        # a slice keeps the selection a view of the values
+        if len(positions) > 0 and (np.diff(positions) == 1).all():
+            return slice(positions[0], positions[-1] + 1)
+        return positions
+
+    def take_columns(self, columns) -> "VDA_event_cube":
+        """Returns the cube of the given column positions (or of a boolean mask of the columns)."""
+        positions = np.asarray(columns)
+        positions = np.flatnonzero(positions) if positions.dtype == bool else positions.astype(np.intp)
+        indexer = self._indexer(positions)
+        return self.with_values(self.values[:, indexer], self.columns[indexer])
+
+    def select(self, **coordinates) -> "VDA_event_cube":
+        """Returns the cube of the columns with the given coordinates, e.g. `select(sensor="het", viewing="sun")`."""
+        levels = ("sensor", "particle", "viewing", "prefix", "channel")
+        mask = np.ones(len(self.columns), dtype=bool)
+        for name, value in coordinates.items():
+            mask &= self.columns.get_level_values(levels.index(name)) == value
+        return self.take_columns(mask)
+
+    def with_values(self, values: np.ndarray, columns: pd.MultiIndex) -> "VDA_event_cube":
+        """Returns a cube with the events and times of this one, and other columns."""
+        return VDA_event_cube(values, self.times, self.events, self.offsets, columns, self.names)
+
+    def concat_columns(self, other: "VDA_event_cube") -> "VDA_event_cube":
+        return self.with_values(np.hstack([self.values, other.values]), self.columns.append(other.columns))
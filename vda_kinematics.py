@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+
+class VDA_kinematics_table:
+    """Energy range, geometric mean energy and inverse beta of every contiguous channel range.
+
+    For every sensor and particle, the entries `[i, j]` (i <= j) of the tables are
+    the kinematics of the channels `i` to `j` (of `AVAILABLE_CHANNELS`, numbered from 0), i.e. of a
+    channel group whose first and last channels are `i` and `j`: its low energy is
+    the low energy of channel `i`, its high energy the high energy of channel `j`.
+    Entries with i > j, or of channels without energies, are NaN. The energies and
+    bin widths of the single channels are kept as well (`low`, `high`, `width`).
+    """
+
+    def __init__(self, low: dict, high: dict, width: dict, geo_mean: dict, inv_beta: dict):
+        self.low = low
+        self.high = high
+        self.width = width
+        self.geo_mean = geo_mean
+        self.inv_beta = inv_beta
+
+    @classmethod
+    def from_energies(cls, df_energies: pd.DataFrame, channels: dict, prefixes: dict,
+                      m_rest: dict) -> "VDA_kinematics_table":
+        """Builds the tables from the (sensor, channel key) indexed `df_energies` of the VDA.
+
+        `channels` are the available channels of every sensor and particle, `prefixes`
+        the column prefix and `m_rest` the rest mass [MeV] of every particle.
+        """
+        low, high, width, geo_mean, inv_beta = {}, {}, {}, {}, {}
+        for sensor, particles in channels.items():
+            for particle, numbers in particles.items():
+                keys = pd.MultiIndex.from_arrays(
+                    [[sensor] * len(numbers), [f"{prefixes[particle]}_{c}" for c in numbers]]
+                )
+                energies = df_energies.reindex(keys)
+                low_energy = energies["Low Energy"].to_numpy(dtype=float)
+                high_energy = energies["High Energy"].to_numpy(dtype=float)
+
+                mean = np.sqrt(low_energy)[:, None] * np.sqrt(high_energy)[None, :]
+                mean[np.tril_indices(len(numbers), -1)] = np.nan
+                low[sensor, particle] = low_energy
+                high[sensor, particle] = high_energy
+                width[sensor, particle] = energies["Bin Width"].to_numpy(dtype=float)
+                geo_mean[sensor, particle] = mean
+                inv_beta[sensor, particle] = 1 / np.sqrt(1 - (1 / (1 + mean / m_rest[particle])) ** 2)
+        return cls(low, high, width, geo_mean, inv_beta)
+
+    def lookup(self, sensor: str, particle: str, first: int, last: int) -> tuple:
+        """Returns the (low energy, high energy, geometric mean, inverse beta) of channels `first` to `last`."""
+        key = (sensor, particle)
+        return (self.low[key][first], self.high[key][last],
+                self.geo_mean[key][first, last], self.inv_beta[key][first, last])
+
+    def gather(self, sensors, particles, firsts, lasts) -> pd.DataFrame:
+        """Returns the kinematics of many channel ranges at once, one row per range."""
+        sensors, particles = np.asarray(sensors, dtype=object), np.asarray(particles, dtype=object)
+        firsts, lasts = np.asarray(firsts, dtype=np.intp), np.asarray(lasts, dtype=np.intp)
+        columns = {name: np.full(len(firsts), np.nan)
+                   for name in ("Low Energy", "High Energy", "Geomagnetic Mean", "Inverse Beta")}
+        for key in dict.fromkeys(zip(sensors, particles)):
+            rows = (sensors == key[0]) & (particles == key[1])
+            i, j = firsts[rows], lasts[rows]
+            columns["Low Energy"][rows] = self.low[key][i]
+            columns["High Energy"][rows] = self.high[key][j]
+            columns["Geomagnetic Mean"][rows] = self.geo_mean[key][i, j]
+            columns["Inverse Beta"][rows] = self.inv_beta[key][i, j]
+        return pd.DataFrame(columns)
@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+
+from pandas.api.types import union_categoricals
+
+
+class VDA_onset_store:
+    """Onsets of the channel groups of every event, in typed columns.
+
+    Every row is keyed by (event, sensor, particle, viewing, prefix, channel
+    group), with the event as an integer array (an object array for event labels
+    that are not numbers) and the rest as categoricals.
+    The onset time and background window are datetime64[ns] columns, the
+    `Status` tells whether an onset was found, not found or its determination
+    failed, and the method specific results are separate numeric columns:
+    `bg_level` and `threshold` for the sigma method, the onset and confidence
+    interval times of the PyOnset statistics for the bootstrap method.
+    """
+
+    KEY_NAMES = ("Event No", "sensor", "particle", "viewing", "prefix", "channels")
+    TIME_COLUMNS = ("Onset Time", "Background Start", "Background End")
+    STATUS_FOUND = 0
+    STATUS_NOT_FOUND = 1
+    STATUS_FAILED = 2
+    # the statistics list of pyonset.Onset.onset_statistics
+    BOOTSTRAP_FIELDS = ("onset_mode", "onset_median", "confidence1_start", "confidence1_end",
+                        "confidence2_start", "confidence2_end")
+
+    def __init__(self, keys: list, columns: dict):
+        self.keys = keys
+        self.columns = columns
+        self._index = None
+
+    @classmethod
+    def from_rows(cls, keys: list, rows: list) -> "VDA_onset_store":
+        """Builds a store from (event, sensor, particle, viewing, prefix, channel) keys and
+        (onset time, background start, background end, status, method specific results) rows."""
+        key_columns = list(zip(*keys)) if len(keys) > 0 else [[]] * len(cls.KEY_NAMES)
+        store_keys = [cls._events(key_columns[0])] + \
+                     [pd.Categorical(column) for column in key_columns[1:]]
+        columns = {}
+        for name, values in zip(cls.TIME_COLUMNS, zip(*rows) if len(rows) > 0 else [[]] * 3):
+            columns[name] = cls._times(values)
+        columns["Status"] = np.array([row[3] for row in rows], dtype=np.int8)
+
+        fields = [cls._method_fields(row[4]) for row in rows]
+        for name in dict.fromkeys(name for f in fields for name in f):
+            values = [f.get(name) for f in fields]
+            if any(isinstance(v, (pd.Timestamp, np.datetime64)) for v in values):
+                columns[name] = cls._times(values)
+            else:
+                columns[name] = np.array([np.nan if v is None else v for v in values], dtype=float)
+        return cls(store_keys, columns)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "VDA_onset_store":
+        """Builds a store from a DataFrame like `to_frame` exports (or with a "Method Specific" column of dicts)."""
+        df = df.reorder_levels(list(cls.KEY_NAMES)) if set(df.index.names) == set(cls.KEY_NAMES) else df
+        onsets = df["Onset Time"] if "Onset Time" in df else pd.Series(pd.NaT, index=df.index)
+        if "Status" in df:
+            status = df["Status"]
+        else:
+            status = np.where(pd.isna(onsets), cls.STATUS_NOT_FOUND, cls.STATUS_FOUND)
+        method_specific = df["Method Specific"] if "Method Specific" in df else [None] * len(df)
+        rows = zip(
+            onsets,
+            df["Background Start"] if "Background Start" in df else [None] * len(df),
+            df["Background End"] if "Background End" in df else [None] * len(df),
+            status,
+            method_specific,
+        )
+        store = cls.from_rows(list(df.index), list(rows))
+        for name in df.columns.difference([*cls.TIME_COLUMNS, "Status", "Method Specific"], sort=False):
+            store.columns[name] = df[name].to_numpy()
+        return store
+
+    @classmethod
+    def _events(cls, values) -> np.ndarray:
+        # event numbers as integers, other event labels (the first column of the catalog) as they are
+        events = np.asarray(values)
+        if len(events) == 0 or events.dtype.kind in "iu":
+            return events.astype(np.int64)
+        return np.asarray(values, dtype=object)
+
+    @classmethod
+    def _times(cls, values) -> np.ndarray:
+        return pd.to_datetime(pd.Series(list(values), dtype=object)).to_numpy(dtype="datetime64[ns]")
+
+    @classmethod
+    def _method_fields(cls, method_specific) -> dict:
+        if isinstance(method_specific, dict):
+            return method_specific
+        if isinstance(method_specific, (list, tuple)):
+            return dict(zip(cls.BOOTSTRAP_FIELDS, (pd.Timestamp(v) for v in method_specific)))
+        return {}
+
+    @classmethod
+    def concat(cls, stores: list) -> "VDA_onset_store":
+        stores = [store for store in stores if len(store) > 0] or stores[:1]
+        if len(stores) == 1:
+            return stores[0]
+        # without the categories of rows left out of the stores (e.g. by `existing`), like a store built at once
+        keys = [np.concatenate([store.keys[0] for store in stores])] + [
+            union_categoricals([store.keys[i] for store in stores], sort_categories=True).remove_unused_categories()
+            for i in range(1, len(cls.KEY_NAMES))
+        ]
+        columns = {}
+        for name in dict.fromkeys(name for store in stores for name in store.columns):
+            dtype = next(store.columns[name].dtype for store in stores if name in store.columns)
+            missing = np.datetime64("NaT", "ns") if dtype.kind == "M" else np.nan
+            columns[name] = np.concatenate([
+                store.columns[name] if name in store.columns else np.full(len(store), missing, dtype=dtype)
+                for store in stores
+            ])
+        return cls(keys, columns)
+
+    def __len__(self) -> int:
+        return len(self.keys[0])
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    @property
+    def index(self) -> pd.MultiIndex:
+        if self._index is None:
+            self._index = pd.MultiIndex.from_arrays(self.keys, names=list(self.KEY_NAMES))
+        return self._index
+
+    def level(self, name: str) -> np.ndarray:
+        return np.asarray(self.keys[self.KEY_NAMES.index(name)])
+
+    def take(self, positions) -> "VDA_onset_store":
+        """Returns the store of the given row positions (or of a boolean mask of the rows)."""
+        positions = np.asarray(positions)
+        positions = np.flatnonzero(positions) if positions.dtype == bool else positions.astype(np.intp)
+        return VDA_onset_store(
+            [key[positions] for key in self.keys],
+            {name: column[positions] for name, column in self.columns.items()},
+        )
+
+    def existing(self) -> "VDA_onset_store":
+        """Returns the store of the found onsets."""
+        return self.take(self.columns["Status"] == self.STATUS_FOUND)
+
+    def positions(self, keys: list) -> np.ndarray:
+        """Returns the row positions of the given keys, -1 for missing ones."""
+        if len(keys) == 0:
+            return np.array([], dtype=np.intp)
+        return self.index.get_indexer(pd.MultiIndex.from_tuples(keys, names=list(self.KEY_NAMES)))
+
+    def to_frame(self, order: list | None = None) -> pd.DataFrame:
+        """Exports the store as a DataFrame, with the key levels in `order` (the key order by default)."""
+        df = pd.DataFrame(self.columns, index=self.index)
+        if order is not None:
+            df = df.reorder_levels(order)
+        return df
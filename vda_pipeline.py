@@ -0,0 +1,268 @@
+import hashlib
+import pandas as pd
+
+from copy import deepcopy
+from os import makedirs, path, stat
+
+
+class VDA_pipeline:
+    """Dependency-tracked execution of the VDA stages.
+
+    Every stage declares the parameters it reads and the stages it builds upon.
+    A parameter change (see `invalidate`) marks the stages that depend on it, and
+    everything downstream of them, as dirty; `run` then executes only the dirty
+    stages, in order.
+
+    Channel group changes are tracked per channel group: when the loaded data is
+    still valid, only the changed channel groups are regrouped and have their
+    onsets determined again, while the cheap downstream stages run in full.
+
+    Every stage also has a fingerprint of its inputs (its parameters and the
+    fingerprints of its upstream stages). A stage whose
+    fingerprint did not change since it last ran is skipped, and with a `cache_dir`
+    the outputs of every stage are stored on disk under their fingerprint, so that
+    re-running a campaign loads them instead of computing them again. The
+    fingerprints cover the contents of the input files a stage reads, and the
+    events left to process after the results store.
+    """
+
+    # stage (VDA method) -> parameters it reads, the stages it builds upon and the VDA
+    # attributes it produces, in execution order
+    STAGES = {
+        "construct_times_df": {
+            "parameters": ("input_type", "date_start", "date_end", "date_range_filepath",
+                           "reference_times_filepath", "bg_hours_prior", "bg_hours_after", "shard",
+                           "results_store"),
+            "upstream": (),
+            # stored_events is not cached: the results store changes with every run
+            "outputs": ("df_times",),
+        },
+        "construct_energies_df": {
+            "parameters": (),
+            "upstream": ("construct_times_df",),
+            "outputs": ("df_energies",),
+        },
+        "construct_particles_df": {
+            "parameters": ("load_data", "load_data_filepath", "viewings_tt", "resample_frequency",
+                           "sensors_particles", "reduced_precision"),
+            "upstream": ("construct_times_df",),
+            "outputs": ("data_cube",),
+        },
+        "group_energy_channels": {
+            "parameters": ("channel_groups",),
+            "upstream": ("construct_particles_df", "construct_energies_df"),
+            "outputs": ("grouped_cube",),
+        },
+        "calculate_onsets": {
+            "parameters": ("onset_method", "onset_method_parameters"),
+            "upstream": ("group_energy_channels",),
+            "outputs": ("onset_store",),
+        },
+        "clean_onsets": {
+            "parameters": (),
+            "upstream": ("calculate_onsets",),
+            "outputs": ("existing_onset_store",),
+        },
+        "construct_options_df": {
+            "parameters": (),
+            "upstream": ("clean_onsets",),
+            "outputs": ("df_options",),
+        },
+        "construct_energy_channels_characteristics": {
+            "parameters": ("channel_groups",),
+            "upstream": ("group_energy_channels", "construct_energies_df"),
+            "outputs": ("df_channels_chars",),
+        },
+        "define_spacecraft_parameters": {
+            "parameters": (),
+            "upstream": (),
+            "outputs": (),
+        },
+        "select_onsets": {
+            "parameters": ("onset_selection", "viewings_hierarchy", "max_onset_combinations"),
+            "upstream": ("construct_options_df", "construct_energy_channels_characteristics",
+                         "define_spacecraft_parameters"),
+            "outputs": ("parameters.selected_onsets", "df_combinations"),
+        },
+        "calculate_vda": {
+            "parameters": ("selected_onsets",),
+            "upstream": ("select_onsets",),
+            "outputs": ("results", "vda_fits"),
+        },
+    }
+
+    # stages that can be run for a subset of the channel groups
+    GROUP_SLICED_STAGES = ("group_energy_channels", "calculate_onsets")
+    # stages working on the channel groups and energy bin widths of `VDA.plan`
+    PLAN_STAGES = ("group_energy_channels", "construct_energy_channels_characteristics")
+
+    def __init__(self, vda_obj, auto_run: bool = False, cache_dir: str | None = None):
+        self.vda = vda_obj
+        self.auto_run = auto_run
+        self.cache_dir = cache_dir
+        # fingerprints of the inputs the current stage outputs were computed from
+        self.fingerprints = {}
+        self.dirty = set(self.STAGES)
+        self.dirty_groups = {}
+        self._channel_groups = None
+        self._sensors_particles = None
+        # file path -> (modification time, size, content hash), so that unchanged files are not read again
+        self._file_digests = {}
+
+    def _downstream(self, stage: str) -> list:
+        stages = [stage]
+        for name, spec in self.STAGES.items():
+            if any(s in stages for s in spec["upstream"]):
+                stages.append(name)
+        return stages
+
+    def _mark(self, stage: str, groups: set | None = None) -> None:
+        for name in self._downstream(stage):
+            if groups is not None and name in self.GROUP_SLICED_STAGES and name not in self.dirty:
+                self.dirty_groups.setdefault(name, set()).update(groups)
+            else:
+                self.dirty.add(name)
+
+    def _changed_groups(self) -> set:
+        old = self._channel_groups
+        new = self.vda.parameters.channel_groups
+        keys = {(p, key) for p, specs in old.items() for key in specs} | \
+               {(p, key) for p, specs in new.items() for key in specs}
+        return {(p, key) for p, key in keys if old.get(p, {}).get(key) != new.get(p, {}).get(key)}
+
+    def invalidate(self, parameter: str) -> None:
+        """Marks the stages depending on `parameter` (and their downstream stages) as dirty."""
+        if parameter == "channel_groups":
+            if self._sensors_particles is not None \
+                    and self.vda.parameters.sensors_particles != self._sensors_particles:
+                # other sensors/particles are needed, the data has to be loaded again
+                self._mark("construct_particles_df")
+                return
+            if self._channel_groups is not None:
+                self._mark("group_energy_channels", self._changed_groups())
+                self._mark("construct_energy_channels_characteristics")
+                return
+        for stage, spec in self.STAGES.items():
+            if parameter in spec["parameters"]:
+                self._mark(stage)
+
+    def _stage_parameters(self, stage: str) -> tuple:
+        parameters = self.STAGES[stage]["parameters"]
+        if stage == "select_onsets" and self.vda.parameters.onset_selection not in (0, 3):
+            # the manual modes build upon the previous selection
+            parameters += ("selected_onsets",)
+        return parameters
+
+    def fingerprint(self, stage: str, upstream: dict) -> str:
+        """Returns the fingerprint of the inputs of `stage`, given the fingerprints of its upstream stages."""
+        spec = self.STAGES[stage]
+        digest = hashlib.sha256(stage.encode())
+        digest.update(self.vda.parameters.fingerprint(*self._stage_parameters(stage)).encode())
+        if stage in self.PLAN_STAGES:
+            digest.update(self.vda.plan.fingerprint.encode())
+        for filepath in self._input_files(stage):
+            digest.update(self._file_digest(filepath).encode())
+        if stage == "construct_particles_df" and hasattr(self.vda, "df_times"):
+            # the events in the results store are not loaded
+            digest.update(repr(self.vda.events_to_process()).encode())
+        for name in spec["upstream"]:
+            digest.update(upstream[name].encode())
+        return digest.hexdigest()
+
+    def _input_files(self, stage: str) -> list:
+        parameters = self.vda.parameters
+        if stage == "construct_times_df":
+            return {1: [parameters.date_range_filepath], 2: [parameters.reference_times_filepath]}.get(
+                parameters.input_type, []
+            )
+        if stage == "construct_particles_df" and parameters.load_data:
+            return [parameters.load_data_filepath]
+        return []
+
+    def _file_digest(self, filepath: str) -> str:
+        if not path.exists(filepath):
+            return "missing"
+        status = stat(filepath)
+        cached = self._file_digests.get(filepath)
+        if cached is not None and cached[:2] == (status.st_mtime_ns, status.st_size):
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(filepath, "rb") as f:
+            for chunk in iter(lambda: f.read(2 ** 20), b""):
+                digest.update(chunk)
+        self._file_digests[filepath] = (status.st_mtime_ns, status.st_size, digest.hexdigest())
+        return digest.hexdigest()
+
+    def _cache_filepath(self, stage: str, fingerprint: str) -> str:
+        return path.join(self.cache_dir, f"{stage}-{fingerprint[:16]}.pkl")
+
+    def _load(self, stage: str, fingerprint: str) -> bool:
+        if self.cache_dir is None or len(self.STAGES[stage]["outputs"]) == 0:
+            return False
+        filepath = self._cache_filepath(stage, fingerprint)
+        if not path.exists(filepath):
+            return False
+        for name, value in pd.read_pickle(filepath).items():
+            owner, attribute = self._owner(name)
+            setattr(owner, attribute, value)
+        return True
+
+    def _save(self, stage: str, fingerprint: str) -> None:
+        if self.cache_dir is None or len(self.STAGES[stage]["outputs"]) == 0:
+            return
+        outputs = {}
+        for name in self.STAGES[stage]["outputs"]:
+            owner, attribute = self._owner(name)
+            if hasattr(owner, attribute):
+                outputs[name] = getattr(owner, attribute)
+        makedirs(self.cache_dir, exist_ok=True)
+        pd.to_pickle(outputs, self._cache_filepath(stage, fingerprint))
+
+    def _owner(self, name: str) -> tuple:
+        if name.startswith("parameters."):
+            return self.vda.parameters, name.split(".", 1)[1]
+        return self.vda, name
+
+    def run(self, until: str | None = None) -> None:
+        """Runs the stages whose inputs changed, in order, up to and including `until` (all of them by default).
+
+        Stages with an unchanged fingerprint are skipped and, with a `cache_dir`,
+        stages with cached outputs are loaded from disk instead of being run. When
+        every event is in the results store, the stages after construct_times_df
+        are replaced by `VDA.complete_from_results_store`.
+        """
+        fingerprints = {}
+        for stage in self.STAGES:
+            if stage != "construct_times_df" and self.vda.parameters.results_store != "" \
+                    and len(self.vda.events_to_process()) == 0:
+                # every event is in the results store, there are no data to analyse
+                self.vda.complete_from_results_store()
+                break
+            fingerprint = fingerprints[stage] = self.fingerprint(stage, fingerprints)
+            if fingerprint == self.fingerprints.get(stage) and stage not in self.dirty \
+                    and stage not in self.dirty_groups:
+                if stage == until:
+                    break
+                continue
+
+            if self._load(stage, fingerprint):
+                if stage == "construct_times_df":
+                    self.vda.stored_events = {}
+                    if self.vda.parameters.results_store != "":
+                        self.vda.diff_results_store()
+            elif stage in self.dirty_groups and stage not in self.dirty and stage in self.fingerprints:
+                getattr(self.vda, stage)(groups=self.dirty_groups[stage])
+                self._save(stage, fingerprint)
+            else:
+                getattr(self.vda, stage)()
+                self._save(stage, fingerprint)
+            self.fingerprints[stage] = fingerprint
+
+            self.dirty.discard(stage)
+            self.dirty_groups.pop(stage, None)
+            if stage == "construct_particles_df":
+                self._sensors_particles = self.vda.parameters.sensors_particles
+            if stage == "group_energy_channels":
+                self._channel_groups = deepcopy(self.vda.parameters.channel_groups)
+            if stage == until:
+                break
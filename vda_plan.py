@@ -0,0 +1,82 @@
+import hashlib
+
+from typing import NamedTuple
+
+
+class VDA_work_item(NamedTuple):
+    """The channel groups of one sensor, particle and viewing."""
+
+    sensor: str
+    particle: str
+    viewing: str
+    prefix: str
+    # names of the channel groups, and the channel numbers and energy bin widths [MeV] of each one
+    groups: tuple
+    channels: tuple
+    widths: tuple
+
+
+class VDA_plan(NamedTuple):
+    """What the stages iterate over, compiled once from `VDA_parameters`.
+
+    Unlike the properties of the parameters (`sensors_particles`, `viewings`, ...)
+    the plan is built once, and is immutable and hashable: equal parameters (and
+    energy tables) always give equal plans, with the same `fingerprint`.
+    The work items are in the order of the stage outputs: sensors, particles,
+    viewings, then the channel groups in the order of `channel_groups`.
+    """
+
+    sensors_particles: tuple
+    viewings: tuple
+    items: tuple
+
+    @classmethod
+    def compile(cls, parameters, prefixes: dict, widths: dict | None = None) -> "VDA_plan":
+        """Compiles the plan of `parameters`.
+
+        `prefixes` are the column prefixes of the particles and `widths` the energy
+        bin widths of the channels of every (sensor, particle), by channel number.
+        Without `widths` the widths of the work items are empty.
+        """
+        sensors_particles = tuple(
+            (sensor, tuple(particles)) for sensor, particles in parameters.sensors_particles.items()
+        )
+        viewings = tuple(parameters.viewings)
+        items = []
+        for sensor, particles in sensors_particles:
+            for particle in particles:
+                specs = {key: spec for key, spec in parameters.channel_groups[particle].items()
+                         if spec["sensor"] == sensor}
+                channels = tuple(tuple(int(c) for c in spec["channels"]) for spec in specs.values())
+                if widths is None:
+                    group_widths = ()
+                else:
+                    group_widths = tuple(
+                        tuple(float(widths[sensor, particle][c]) for c in group) for group in channels
+                    )
+                for viewing in viewings:
+                    items.append(VDA_work_item(sensor, particle, viewing, prefixes[particle],
+                                               tuple(specs), channels, group_widths))
+        return cls(sensors_particles, viewings, tuple(items))
+
+    @property
+    def fingerprint(self) -> str:
+        return hashlib.sha256(repr(tuple(self)).encode()).hexdigest()
+
+    def select(self, groups: set | None = None, viewing: str | None = None) -> list:
+        """Returns the work items reduced to `groups`, a set of (particle, channel group name)
+        pairs (all groups by default), and to `viewing` (all by default)."""
+        items = []
+        for item in self.items:
+            if viewing is not None and item.viewing != viewing:
+                continue
+            if groups is not None:
+                kept = [i for i, group in enumerate(item.groups) if (item.particle, group) in groups]
+                item = item._replace(
+                    groups=tuple(item.groups[i] for i in kept),
+                    channels=tuple(item.channels[i] for i in kept),
+                    widths=tuple(item.widths[i] for i in kept) if len(item.widths) > 0 else (),
+                )
+            if len(item.groups) > 0:
+                items.append(item)
+        return items
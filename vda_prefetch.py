@@ -0,0 +1,82 @@
+import threading
+
+from queue import Empty, Full, Queue
+
+
+class VDA_prefetcher:
+    """Data source loading the data of the next events in the background.
+
+    `requests` lists, per event in processing order, the keyword arguments of the
+    `epd_load` calls the event needs. A background thread makes these calls with
+    `loader` (e.g. `solo_epd_loader.epd_load`) and puts the data of every event
+    into a queue of `depth` events, waiting while the queue is full: at most
+    `depth` loaded events wait in memory, besides the one in use and the one being
+    loaded. Calls (with the arguments of `epd_load`) return the loaded data; events
+    that are never asked for (e.g. checkpointed ones) are skipped. Other attributes,
+    like `observer_distance`, are the ones of the loader.
+    """
+
+    def __init__(self, loader, requests: list, depth: int = 2):
+        if depth < 1:
+            raise ValueError(f"Invalid prefetch depth {depth}, at least 1 event has to be loaded ahead")
+        self.loader = loader
+        self.requests = requests
+        self.queue = Queue(maxsize=depth)
+        self._loaded = {}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._produce, name="vda-prefetcher", daemon=True)
+        self._thread.start()
+
+    def __getattr__(self, name):
+        if name == "loader":
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+    @classmethod
+    def _key(cls, sensor, level, startdate, enddate, viewing, path=None, autodownload=True) -> tuple:
+        return sensor, level, startdate, enddate, viewing
+
+    def _put(self, item) -> bool:
+        # waits for room in the queue (the backpressure), unless stopped
+        while not self._stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _produce(self) -> None:
+        for event_requests in self.requests:
+            try:
+                loaded = {self._key(**kwargs): self.loader(**kwargs) for kwargs in event_requests}
+            except Exception as e:
+                # raised by the consumer, once it asks for the data of this event
+                self._put(e)
+                return
+            if not self._put(loaded):
+                return
+        self._put(None)
+
+    def __call__(self, sensor, level, startdate, enddate, viewing, path=None, autodownload=True):
+        key = self._key(sensor, level, startdate, enddate, viewing)
+        while key not in self._loaded:
+            loaded = self.queue.get()
+            if loaded is None:
+                raise ValueError(f"No data of {sensor} {viewing} {startdate} - {enddate} was requested")
+            if isinstance(loaded, Exception):
+                raise loaded
+            self._loaded = loaded
+        # handed over once, so that the data of finished events are not kept
+        return self._loaded.pop(key)
+
+    def close(self) -> None:
+        """Stops the background loading (after the current call of the loader)."""
+        self._stopped.set()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                break
+        self._thread.join()
+        self._loaded = {}
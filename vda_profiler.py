@@ -0,0 +1,124 @@
+import json
+import threading
+import tracemalloc
+
+import pandas as pd
+
+from contextlib import contextmanager
+from os import getpid
+from time import perf_counter
+
+
+class VDA_span:
+
+    def __init__(self, name: str, start: float, memory_start: int):
+        self.name = name
+        self.start = start
+        self.memory_start = memory_start
+        self.rows = 0
+        # peak traced memory of the nested spans, see VDA_profiler.record
+        self.peak = 0
+
+
+class VDA_profiler:
+    """Records wall time, calls, processed rows and peak memory of the VDA stages.
+
+    Assign it to `VDA.profiler`: every stage and the inner hot paths (data loading,
+    resampling, onset detection, SPICE, fitting, drawing) are then recorded as
+    (nested) spans. `report()` aggregates them per name and `export_trace()`
+    writes them as a Chrome trace (chrome://tracing, https://ui.perfetto.dev).
+
+    With `memory=True` the peak memory allocated above the memory at the start
+    of every span is traced as well, which slows the run down considerably.
+    """
+
+    def __init__(self, memory: bool = False):
+        self.memory = memory
+        self.spans = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._origin = perf_counter()
+        self._started_tracing = self.memory and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+
+    def stop(self) -> None:
+        """Stops the memory tracing started by this profiler."""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _stack(self) -> list:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def record(self, name: str):
+        """Records the enclosed code as the span `name`; the yielded span takes the number of processed `rows`."""
+        stack = self._stack()
+        memory_start = 0
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if len(stack) > 0:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            memory_start = current
+        span = VDA_span(name, perf_counter(), memory_start)
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            end = perf_counter()
+            stack.pop()
+            peak_memory = 0
+            if self.memory:
+                peak = max(tracemalloc.get_traced_memory()[1], span.peak)
+                peak_memory = peak - span.memory_start
+                if len(stack) > 0:
+                    stack[-1].peak = max(stack[-1].peak, peak)
+                tracemalloc.reset_peak()
+            with self._lock:
+                self.spans.append({
+                    "name": name,
+                    "start": span.start - self._origin,
+                    "duration": end - span.start,
+                    "rows": span.rows,
+                    "peak_memory": peak_memory,
+                    "depth": len(stack),
+                    "thread": threading.get_ident(),
+                })
+
+    def report(self) -> pd.DataFrame:
+        """Returns, per span name, the calls, the total and mean wall time, the rows and the highest peak memory."""
+        df_spans = pd.DataFrame(self.spans, columns=["name", "start", "duration", "rows", "peak_memory"])
+        df_report = df_spans.groupby("name", sort=False).agg(
+            **{
+                "Calls": ("duration", "size"),
+                "Wall Time [s]": ("duration", "sum"),
+                "Mean Wall Time [s]": ("duration", "mean"),
+                "Rows": ("rows", "sum"),
+                "Peak Memory [MB]": ("peak_memory", "max"),
+            }
+        )
+        df_report["Peak Memory [MB]"] = df_report["Peak Memory [MB]"] / 2**20
+        df_report.index.name = "Span"
+        return df_report.sort_values("Wall Time [s]", ascending=False)
+
+    def export_trace(self, filepath: str) -> None:
+        """Writes the spans in the Chrome trace event format."""
+        pid = getpid()
+        events = [
+            {
+                "name": span["name"],
+                "ph": "X",
+                "ts": span["start"] * 1e6,
+                "dur": span["duration"] * 1e6,
+                "pid": pid,
+                "tid": span["thread"],
+                "args": {"rows": span["rows"], "peak_memory": span["peak_memory"]},
+            }
+            for span in self.spans
+        ]
+        with open(filepath, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,212 @@
+from os import cpu_count, makedirs, path
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+
+from vda import VDA
+
+
+# Per process state: a bare VDA object (for its drawing methods) and the figure
+# template that is cleared and redrawn for every task.
+_worker = {}
+
+
+def _init_worker(parameters, dpi):
+    _worker["vda"] = VDA(parameters)
+    _worker["figure"] = Figure(dpi=dpi)
+    FigureCanvasAgg(_worker["figure"])
+
+
+def _render_task(task):
+    """Draws one figure on the worker template.
+
+    Returns the written file path or, when the task has no file path (multi-page
+    export, assembled by the parent process), the drawn template itself, which the
+    parent writes as a vector page before the next task (from a pool, the figure
+    is pickled back as drawn).
+    """
+    kind, filepath, payload = task
+    vda = _worker["vda"]
+    fig = _worker["figure"]
+    fig.clear()
+    if kind == "vda":
+        fig.set_size_inches(10, 8)
+        ax = fig.add_subplot()
+        vda._draw_vda(fig, ax, payload["index_event"], payload["fit"])
+    elif kind == "bg_selection":
+        fig.set_size_inches(10, 8)
+        ax = fig.add_subplot()
+        vda._draw_bg_selection(ax, payload["data"], payload["bg_start"], payload["bg_end"])
+        ax.set_title(payload["title"])
+    elif kind == "onsets":
+        fig.set_size_inches(14, 8)
+        nrows, ncols = vda._onset_panels_shape(len(payload["panels"]))
+        axs_flat = fig.subplots(nrows, ncols, squeeze=False).flatten()
+        for ax in axs_flat[len(payload["panels"]):]:
+            ax.axis("off")
+        for ax, (viewing, series, onset_results) in zip(axs_flat, payload["panels"]):
+            ax.set_title(viewing)
+            if onset_results is not None:
+                vda._draw_onset_panel(ax, series, onset_results)
+        fig.suptitle(payload["title"])
+        fig.tight_layout()
+    else:
+        raise ValueError(f'Figure kind "{kind}" is not implemented')
+
+    if filepath is None:
+        return fig
+    fig.savefig(filepath)
+    return filepath
+
+
+def _bounded_map(executor, fn, tasks: list, window: int):
+    """Like `executor.map`, but with at most `window` tasks submitted and not yet consumed,
+    so that the results waiting for the consumer stay bounded."""
+    pending = deque()
+    for task in tasks:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(fn, task))
+    while pending:
+        yield pending.popleft().result()
+
+
+class VDA_renderer:
+    """Renders the figures of a finished VDA run without any interactive backend.
+
+    Figures are drawn with Agg in a process pool from the precomputed results of
+    the VDA object (`vda_fits` from `calculate_vda`, `df_grouped` and
+    `df_onsets_existing`), so `plot` does not need to be called beforehand.
+    """
+
+    FIGURES = ("vda", "bg_selection", "onsets")
+
+    def __init__(self, vda_obj):
+        self.vda = vda_obj
+
+    def _vda_tasks(self) -> list:
+        return [
+            ("vda", self.vda._figure_filename(index_event), {"index_event": index_event, "fit": fit})
+            for index_event, fit in self.vda.vda_fits.items()
+        ]
+
+    def _bg_selection_tasks(self) -> list:
+        tasks = []
+        for event_no in sorted(self.vda.grouped_cube.events):
+            bg_start, bg_end = self.vda._bg_selection_window(event_no)
+            tasks.append((
+                "bg_selection",
+                self.vda._figure_filename(event_no, "_bg_selection"),
+                {
+                    "data": self.vda.grouped_cube.event_frame(event_no),
+                    "bg_start": bg_start,
+                    "bg_end": bg_end,
+                    "title": f"Event {event_no} background selection",
+                },
+            ))
+        return tasks
+
+    def _onsets_tasks(self) -> list:
+        tasks = []
+        df_onsets = self.vda.df_onsets_existing
+        for event_no in sorted(self.vda.grouped_cube.events):
+            temp_df = self.vda.grouped_cube.event_frame(event_no)
+            date_str = temp_df.index[0].to_pydatetime().strftime('%Y-%m-%d')
+            for sensor, particles in self.vda.parameters.sensors_particles.items():
+                for particle in particles:
+                    if particle == "protons":
+                        particle_prefix = self.vda.PROTON_COLUMN_PREFIX
+                    elif particle == "electrons":
+                        particle_prefix = self.vda.ELECTRON_COLUMN_PREFIX
+                    columns = self.vda.grouped_cube.select(
+                        sensor=sensor, particle=particle, viewing=self.vda.parameters.viewings[0],
+                        prefix=particle_prefix,
+                    ).columns.get_level_values(-1)
+                    for number, column in enumerate(columns):
+                        panels = []
+                        for viewing in self.vda.parameters.viewings:
+                            key = (event_no, sensor, particle, viewing, particle_prefix, column)
+                            onset_results = df_onsets.loc[key] if key in df_onsets.index else None
+                            panels.append((
+                                viewing,
+                                temp_df[(sensor, particle, viewing, particle_prefix, column)],
+                                onset_results,
+                            ))
+                        if all(p[2] is None for p in panels):
+                            continue
+                        energy_range_str = self.vda._energy_range_str(sensor, particle, column)
+                        tasks.append((
+                            "onsets",
+                            self.vda._figure_filename(event_no, f"_onsets_{sensor}-{particle}-{number}"),
+                            {
+                                "panels": panels,
+                                "title": f"Detected onsets for event {event_no} ({date_str}) | "
+                                         f"{sensor}/{particle} ({energy_range_str} MeV)",
+                            },
+                        ))
+        return tasks
+
+    def construct_tasks(self, figures: tuple = FIGURES) -> list:
+        tasks = []
+        for kind in figures:
+            if kind == "vda":
+                tasks += self._vda_tasks()
+            elif kind == "bg_selection":
+                tasks += self._bg_selection_tasks()
+            elif kind == "onsets":
+                tasks += self._onsets_tasks()
+            else:
+                raise ValueError(f'Figure kind "{kind}" is not implemented')
+        return tasks
+
+    def render(
+        self,
+        output_dir: str,
+        figures: tuple = FIGURES,
+        fmt: str = "png",
+        processes: int | None = None,
+        dpi: int = 100,
+        campaign: str = "vda_campaign",
+    ) -> list[str]:
+        """Renders the requested figures into `output_dir`.
+
+        With `fmt="png"` every figure is written to its own file. With `fmt="pdf"`
+        all figures are written, in order and as they are drawn, as the vector pages
+        of one `<campaign>.pdf`. Returns the list of written files.
+        """
+        if fmt not in ("png", "pdf"):
+            raise ValueError(f'Output format "{fmt}" is not supported')
+        makedirs(output_dir, exist_ok=True)
+
+        tasks = [
+            (kind, path.join(output_dir, filename) if fmt == "png" else None, payload)
+            for kind, filename, payload in self.construct_tasks(figures)
+        ]
+        if processes is None:
+            processes = min(cpu_count() or 1, max(len(tasks), 1))
+
+        if processes <= 1:
+            _init_worker(self.vda.parameters, dpi)
+            if fmt == "png":
+                return [_render_task(task) for task in tasks]
+            return self._write_pdf(output_dir, campaign, map(_render_task, tasks))
+
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            initializer=_init_worker,
+            initargs=(self.vda.parameters, dpi),
+        ) as executor:
+            if fmt == "png":
+                return list(executor.map(_render_task, tasks, chunksize=max(len(tasks) // (4 * processes), 1)))
+            # the drawn pages wait for the parent to write them, a few per process at most
+            return self._write_pdf(output_dir, campaign, _bounded_map(executor, _render_task, tasks, 2 * processes))
+
+    def _write_pdf(self, output_dir: str, campaign: str, pages) -> list[str]:
+        filepath = path.join(output_dir, f"{campaign}.pdf")
+        with PdfPages(filepath) as pdf:
+            for page in pages:
+                pdf.savefig(page)
+        return [filepath]
@@ -0,0 +1,176 @@
+import numpy as np
+import pandas as pd
+
+from datetime import datetime, timedelta
+
+
+class VDA_synthetic_source:
+    """Synthetic stand-in for `solo_epd_loader.epd_load`, with known SEP onsets.
+
+    Assign it to `VDA.data_source` to run the tool offline. Calls take the
+    arguments of `epd_load` and return `(df_protons, df_electrons, energies)` with
+    the column and energy table layout of the EPD level 2 data: `H_Flux`/`Ion_Flux`
+    and `Electron_Flux` columns (plus their uncertainties) and the
+    `<H|Ion|Electron>_Bins_<Low_Energy|Width|Text>` energy entries.
+
+    Every event of `events` (columns "Release Time", the solar release, and
+    "Path Length" in AU) injects, into every channel, a flux increase starting
+    at the arrival time of particles of the channel's mean energy travelling
+    along the path, on top of a constant background with multiplicative noise.
+    Data are generated per day from a seed, so repeated loads are identical.
+    The distance of the observer (`observer_distance`, AU) replaces SPICE, and
+    `energy_tables` provides the energy entries without generating data.
+    """
+
+    # number of channels and energy range (MeV) of every sensor and particle
+    CHANNELS = {
+        "het": {"protons": (36, 6.8, 107.0), "electrons": (4, 0.45, 18.8)},
+        "ept": {"protons": (64, 0.005, 15.0), "electrons": (34, 0.03, 0.47)},
+    }
+    # relative intensity of the event as seen by every viewing
+    VIEWING_INTENSITY = {"sun": 1.0, "north": 0.6, "south": 0.6, "asun": 0.3, "omni": 0.6}
+    M_REST = {"protons": 938.27, "electrons": 0.511}
+    C = 299_792_458
+    AU_TO_M_RATIO = 1.495978707e11
+
+    def __init__(
+        self,
+        events: pd.DataFrame,
+        observer_distance: float = 0.8,
+        cadence: str = "1min",
+        background: float = 10.0,
+        peak_ratio: float = 100.0,
+        noise: float = 0.05,
+        rise_minutes: float = 20.0,
+        decay_hours: float = 12.0,
+        seed: int = 0,
+    ):
+        self.events = events
+        self.observer_distance_au = observer_distance
+        self.cadence = cadence
+        self.background = background
+        self.peak_ratio = peak_ratio
+        self.noise = noise
+        self.rise_minutes = rise_minutes
+        self.decay_hours = decay_hours
+        self.seed = seed
+
+    @classmethod
+    def random_catalog(
+        cls,
+        n_events: int,
+        start: datetime = datetime(2021, 10, 28, 14, 0),
+        spacing_days: float = 3.0,
+        seed: int = 0,
+        **kwargs,
+    ) -> "VDA_synthetic_source":
+        """Builds a source with `n_events` events, `spacing_days` apart, with random release times and path lengths."""
+        rng = np.random.default_rng(seed)
+        release_times = [
+            start + timedelta(days=spacing_days * i, minutes=float(rng.uniform(0, 600)))
+            for i in range(n_events)
+        ]
+        events = pd.DataFrame(
+            {
+                "Release Time": pd.to_datetime(release_times).floor("s"),
+                "Path Length": rng.uniform(1.0, 2.0, n_events),
+            },
+            index=pd.RangeIndex(1, n_events + 1, name="Event No"),
+        )
+        return cls(events, seed=seed, **kwargs)
+
+    def energies(self, sensor: str, particle: str) -> tuple:
+        n, low, high = self.CHANNELS[sensor][particle]
+        edges = np.geomspace(low, high, n + 1)
+        return edges[:-1], np.diff(edges)
+
+    def _inverse_beta(self, energy: np.ndarray, particle: str) -> np.ndarray:
+        return 1 / np.sqrt(1 - (1 / (1 + energy / self.M_REST[particle])) ** 2)
+
+    def observer_distance(self, time: datetime) -> float:
+        return self.observer_distance_au
+
+    def _light_travel_time(self) -> float:
+        return self.observer_distance_au * self.AU_TO_M_RATIO / self.C
+
+    def reference_times(self, minutes_after_release: float = 30) -> pd.DataFrame:
+        """Reference times of the events, for the reference times input (input type 2)."""
+        return pd.DataFrame(
+            {"Reference Time": self.events["Release Time"] + pd.Timedelta(minutes=minutes_after_release)},
+            index=self.events.index.rename("Event"),
+        )
+
+    def expected_results(self) -> pd.DataFrame:
+        """Ground truth of `VDA.results`: release time (as seen by the observer) and apparent path length."""
+        return pd.DataFrame(
+            {
+                "Release Time": self.events["Release Time"] + pd.Timedelta(seconds=self._light_travel_time()),
+                "APL": self.events["Path Length"] / self.observer_distance_au,
+            },
+            index=self.events.index,
+        )
+
+    def _day_flux(self, sensor: str, particle: str, viewing: str, day: pd.Timestamp) -> pd.DataFrame:
+        times = pd.date_range(day, day + pd.Timedelta(days=1), freq=self.cadence, inclusive="left")
+        low, width = self.energies(sensor, particle)
+        mean_energy = np.sqrt(low * (low + width))
+        inv_beta = self._inverse_beta(mean_energy, particle)
+        background = self.background * (mean_energy / mean_energy[0]) ** -2
+
+        t = times.to_numpy()[:, None]
+        signal = np.zeros((len(times), len(mean_energy)))
+        for release_time, path_length in zip(self.events["Release Time"], self.events["Path Length"]):
+            travel_time = path_length * self.AU_TO_M_RATIO / self.C * inv_beta
+            onset = np.datetime64(release_time) + (travel_time * 1e9).astype("timedelta64[ns]")
+            dt = (t - onset[None, :]) / np.timedelta64(1, "m")
+            rising = dt > 0
+            signal[rising] += (
+                (1 - np.exp(-dt[rising] / self.rise_minutes)) * np.exp(-dt[rising] / (60 * self.decay_hours))
+            )
+        flux = background * (1 + self.peak_ratio * self.VIEWING_INTENSITY[viewing] * signal)
+
+        stream = [self.seed, list(self.CHANNELS).index(sensor), list(self.M_REST).index(particle),
+                  list(self.VIEWING_INTENSITY).index(viewing), day.toordinal()]
+        rng = np.random.default_rng(stream)
+        flux *= np.clip(1 + self.noise * rng.standard_normal(flux.shape), 0, None)
+        return pd.DataFrame(flux, index=times)
+
+    def _particle_df(self, sensor: str, particle: str, viewing: str, startdate, enddate) -> pd.DataFrame:
+        # like epd_load, whole days are returned
+        days = pd.date_range(pd.Timestamp(startdate).floor("D"), pd.Timestamp(enddate).floor("D"), freq="D")
+        df = pd.concat([self._day_flux(sensor, particle, viewing, day) for day in days])
+        if particle == "electrons":
+            name = "Electron"
+        elif sensor == "het":
+            name = "H"
+        else:
+            name = "Ion"
+        flux = df.to_numpy()
+        return pd.concat(
+            [
+                pd.DataFrame(flux, index=df.index, columns=[f"{name}_Flux_{i}" for i in range(flux.shape[1])]),
+                pd.DataFrame(self.noise * flux, index=df.index,
+                             columns=[f"{name}_Uncertainty_{i}" for i in range(flux.shape[1])]),
+            ],
+            keys=[f"{name}_Flux", f"{name}_Uncertainty"],
+            axis="columns",
+        )
+
+    def __call__(self, sensor: str, level: str, startdate, enddate, viewing: str, path=None, autodownload=True):
+        sensor = sensor.lower()
+        if sensor not in self.CHANNELS:
+            raise ValueError(f'Sensor "{sensor}" is not available in the synthetic data')
+        df_protons = self._particle_df(sensor, "protons", viewing, startdate, enddate)
+        df_electrons = self._particle_df(sensor, "electrons", viewing, startdate, enddate)
+
+        return df_protons, df_electrons, self.energy_tables(sensor)
+
+    def energy_tables(self, sensor: str) -> dict:
+        """The energy entries of the loaded data, without loading any."""
+        energies = {}
+        for particle, name in (("protons", "H" if sensor == "het" else "Ion"), ("electrons", "Electron")):
+            low, width = self.energies(sensor, particle)
+            energies[f"{name}_Bins_Low_Energy"] = low
+            energies[f"{name}_Bins_Width"] = width
+            energies[f"{name}_Bins_Text"] = np.array([f"{lo:.4f} - {lo + w:.4f} MeV" for lo, w in zip(low, width)])
+        return energies
@@ -1,5 +1,14 @@
+import hashlib
+import json
+
 from datetime import datetime, timezone
 
+try:
+    import tomllib
+except ModuleNotFoundError:
+    # Python < 3.11
+    tomllib = None
+
 
 class VDA_parameters:
 
@@ -15,8 +24,22 @@ class VDA_parameters:
         self.load_data_filepath: str = ""
         self.save_data: bool = False
         self.save_data_filepath: str = ""
+        # per-event results of the long running stages are written here ("": no checkpoints)
+        self.checkpoint_dir: str = ""
+        # skip the events already checkpointed in checkpoint_dir
+        self.resume: bool = False
+        # results of every processed event, reused while its window and parameters do not change ("": none)
+        self.results_store: str = ""
         self.viewings_tt: list = [True if v == "sun" else False for v in self.AVAILABLE_VIEWINGS]
         self.resample_frequency: str = "5min"
+        # store the flux data as float32 (the background statistics and fits stay float64)
+        self.reduced_precision: bool = False
+        # MB of flux data held in memory, beyond which the loaded events are spilled to spill_dir (0: no budget)
+        self.memory_budget: float = 0
+        # directory of the spilled flux data ("": the spill directory of the particle data)
+        self.spill_dir: str = ""
+        # events whose data are loaded in the background while the current one is processed (0: no streaming)
+        self.prefetch_events: int = 0
         self.default_channel_groups: dict = {
             "protons": {
                 "HET": [
@@ -44,9 +67,109 @@ class VDA_parameters:
             for k, v in self.AVAILABLE_ONSET_METHODS[self.onset_method].items()
         }
         self.onset_selection: int = 0
+        self.viewings_hierarchy: list | None = None
+        self.max_onset_combinations: int = 10000
         self.selected_onsets: dict | None = None
+        # [index, count]: run only the events at positions index, index + count, ... of the catalog
+        self.shard: list | None = None
         self.view_dfs: bool = True
 
+    def _canonical(self, value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+        if isinstance(value, (set, frozenset)):
+            return sorted(value, key=repr)
+        if hasattr(value, "to_numpy"):
+            # pandas objects (e.g. per-event background windows, selected onsets)
+            import pandas as pd
+            return hashlib.sha256(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes()).hexdigest()
+        if hasattr(value, "tolist"):
+            return value.tolist()
+        raise TypeError(f"Parameter value of type {type(value).__name__} cannot be fingerprinted")
+
+    def fingerprint(self, *names: str, per_event: bool = False) -> str:
+        """Returns a hash of the values of the given parameters (all of them by default).
+
+        Equal values always give the same hash, independently of dict ordering.
+        With `per_event`, values given per event (pandas objects inside dicts, e.g.
+        the background windows of input type 1) are left out: fingerprints of a
+        single event then do not change when other events are added to the catalog.
+        """
+        if len(names) == 0:
+            names = sorted(vars(self))
+        values = {name: getattr(self, name) for name in names}
+        if per_event:
+            values = {
+                name: {k: v for k, v in value.items() if not hasattr(v, "to_numpy")}
+                if isinstance(value, dict) else value
+                for name, value in values.items()
+            }
+        text = json.dumps(values, sort_keys=True, default=self._canonical)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def to_dict(self) -> dict:
+        """Returns the parameters as plain JSON/TOML compatible values.
+
+        Values derived while running (e.g. per-event background windows and the
+        selected onsets) are left out.
+        """
+        d = {}
+        for name, value in vars(self).items():
+            if value is None or hasattr(value, "to_numpy"):
+                continue
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            elif isinstance(value, dict):
+                value = {k: v for k, v in value.items() if not hasattr(v, "to_numpy")}
+            d[name] = value
+        return d
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "VDA_parameters":
+        parameters = cls()
+        for name, value in d.items():
+            if name not in vars(parameters):
+                raise ValueError(f'Unknown parameter "{name}"')
+            if isinstance(getattr(parameters, name), datetime) and isinstance(value, str):
+                value = datetime.fromisoformat(value)
+            elif name == "onset_method_parameters":
+                value = {**parameters.onset_method_parameters, **value}
+            setattr(parameters, name, value)
+        if parameters.onset_method not in parameters.AVAILABLE_ONSET_METHODS:
+            raise ValueError(f'Onset method "{parameters.onset_method}" is not implemented')
+        return parameters
+
+    @classmethod
+    def load(cls, filepath: str) -> "VDA_parameters":
+        """Reads parameters from a JSON (.json) or TOML (.toml) file."""
+        if filepath.endswith(".toml"):
+            if tomllib is None:
+                raise ValueError("TOML configuration files need Python >= 3.11")
+            with open(filepath, "rb") as f:
+                return cls.from_dict(tomllib.load(f))
+        elif filepath.endswith(".json"):
+            with open(filepath) as f:
+                return cls.from_dict(json.load(f))
+        raise ValueError(f'Unsupported configuration file "{filepath}" (expected .json or .toml)')
+
+    def save(self, filepath: str) -> None:
+        """Writes the parameters to a JSON file."""
+        with open(filepath, "w") as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    def channel_groups_from_defaults(self) -> dict:
+        """Builds `channel_groups` from `default_channel_groups`, labelled like the notebook widgets do."""
+        channel_groups = {}
+        for species, sensors in self.default_channel_groups.items():
+            for sensor, selections in sensors.items():
+                for number, selection in enumerate(selections, start=1):
+                    label = f"{sensor}/{species} Channel {number}"
+                    channel_groups.setdefault(species, {})[label] = {
+                        "sensor": sensor.lower(),
+                        "channels": list(selection),
+                    }
+        return channel_groups
+
     @property
     def sensors(self):
         return set([spec["sensor"] for g in self.channel_groups.values() for spec in g.values()])
@@ -66,7 +189,7 @@ class VDA_parameters:
                 except KeyError:
                     sp[sensor] = []
                     sp[sensor].append(p)
-                sp[sensor] = list(set(sp[sensor]))
+                sp[sensor] = sorted(set(sp[sensor]))
         return sp
 
     @property
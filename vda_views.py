@@ -1,24 +1,52 @@
 import pandas as pd
+from copy import copy, deepcopy
+from datetime import timedelta
+from threading import Event
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor
 from IPython.display import display
 from ipywidgets import widgets
-from math import ceil
-from matplotlib import pyplot as plt
-from matplotlib import dates as mdates
 
 from vda_tool_configuration import *
+from vda import VDA_cancelled
 
 
 class VDA_nb_displayer:
 
-    def __init__(self, vda_obj):
+    # the stages following construct_energies_df, in order
+    BACKGROUND_STAGES = ("construct_particles_df",
+                         "group_energy_channels",
+                         "calculate_onsets",
+                         "clean_onsets",
+                         "construct_options_df",
+                         "construct_energy_channels_characteristics",
+                         "select_onsets",
+                         "calculate_vda")
+
+    def __init__(self, vda_obj, pipeline=None):
         ############### Widgets ###############
         self.WIDGETS_LAYOUT = widgets.Layout(width="auto")
         self.WIDGETS_STYLE = {"description_width": "initial"}
 
         self.vda = vda_obj
+        # optional VDA_pipeline, notified of every parameter change made through the widgets
+        self.pipeline = pipeline
+        # single worker, so that queued stages run one after the other
+        self._stage_executor = None
+        # single worker preparing the next pages of the onset gallery, shared by all the galleries
+        self._gallery_executor = None
+        self._gallery_prepared = {}
+
+    def _parameter_changed(self, parameter):
+        if self.pipeline is None:
+            return
+        self.pipeline.invalidate(parameter)
+        if self.pipeline.auto_run:
+            self.pipeline.run()
 
     def _change_parameter(self, parameter, new_value):
         self.vda.parameters.__setattr__(parameter, new_value)
+        self._parameter_changed(parameter)
 
     def _change_parameter_index(self, parameter, index, new_value, index_sep=None):
         if index_sep is None:
@@ -35,6 +63,7 @@ class VDA_nb_displayer:
             par[str(index[-1])] = new_value
         except TypeError:
             par[int(index[-1])] = new_value
+        self._parameter_changed(parameter)
 
     def _change_parameter_df_index(self, parameter, index, col, new_value, index_sep=None):
         if index_sep is None:
@@ -51,6 +80,7 @@ class VDA_nb_displayer:
                 par = par.loc[int(i)]
                 curated_indices.append(int(i))
         self.vda.parameters.__getattribute__(parameter).loc[tuple(curated_indices), col] = new_value
+        self._parameter_changed(parameter)
 
     def _delete_parameter_index(self, parameter, index, cascade=False, index_sep=None):
         if index_sep is None:
@@ -74,6 +104,7 @@ class VDA_nb_displayer:
                 index = index[:-1]
             else:
                 break
+        self._parameter_changed(parameter)
 
     def display_input_type(self):
         w = widgets.Dropdown(
@@ -245,71 +276,7 @@ class VDA_nb_displayer:
         return vbox
 
     def construct_energies_df(self):
-        self.vda.df_energies = pd.DataFrame({})
-        df_sensors = []
-        for sensor, particles in self.vda.parameters.AVAILABLE_SENSORS_PARTICLES.items():
-            
-            if len(particles) == 0:
-                continue
-
-            df_protons, df_electrons, energies = self.vda._epd_load(
-                sensor=sensor,
-                level="l2",
-                startdate=self.vda.df_times.iloc[0][self.vda.BG_START_TIME_COLNAME],
-                enddate=self.vda.df_times.iloc[0][self.vda.END_TIME_COLNAME],
-                viewing="sun",
-                path=self.vda.DATA_PATH,
-                autodownload=True,
-            )
-            if sensor == "het":
-                flux_cols_name = "H_Flux"
-                energy_bins_cols_name = "H_Bins"
-            elif sensor == "ept":
-                flux_cols_name = "Ion_Flux"
-                energy_bins_cols_name = "Ion_Bins"
-            df_protons = df_protons.rename(
-                lambda x: x.replace(flux_cols_name, self.vda.PROTON_COLUMN_PREFIX),
-                axis="columns",
-            )
-            df_electrons = df_electrons.rename(
-                lambda x: x.replace("Electron_Flux", self.vda.ELECTRON_COLUMN_PREFIX),
-                axis="columns",
-            )
-
-            df_energies_protons = pd.DataFrame(
-                {
-                    "Low Energy": energies[f"{energy_bins_cols_name}_Low_Energy"],
-                    "Bin Width": energies[f"{energy_bins_cols_name}_Width"],
-                },
-                index=df_protons[self.vda.PROTON_COLUMN_PREFIX].columns,
-            )
-            df_energies_protons["High Energy"] = (
-                df_energies_protons["Low Energy"] + df_energies_protons["Bin Width"]
-            )
-
-            df_energies_electrons = pd.DataFrame(
-                {
-                    "Low Energy": energies["Electron_Bins_Low_Energy"],
-                    "Bin Width": energies["Electron_Bins_Width"],
-                },
-                index=df_electrons[self.vda.ELECTRON_COLUMN_PREFIX].columns,
-            )
-            df_energies_electrons["High Energy"] = (
-                df_energies_electrons["Low Energy"] + df_energies_electrons["Bin Width"]
-            )
-
-            if "protons" in particles and "electrons" in particles:
-                df_sensors.append(pd.concat([df_energies_protons, df_energies_electrons]))
-            elif "protons" in particles:
-                df_sensors.append(pd.concat([df_energies_protons]))
-            elif "electrons" in particles:
-                df_sensors.append(pd.concat([df_energies_electrons]))
-
-        self.vda.df_energies = pd.concat(
-            df_sensors,
-            keys=[s for s, p in self.vda.parameters.AVAILABLE_SENSORS_PARTICLES.items() if len(p) > 0],
-            names=["sensor", "channel"],
-        )
+        self.vda.construct_energies_df()
 
         with pd.option_context("display.max_rows", None):
             display(self.vda.df_energies)
@@ -445,13 +412,10 @@ class VDA_nb_displayer:
             widget_params["style"] = self.WIDGETS_STYLE
             widget_params["layout"] = self.WIDGETS_LAYOUT
             if parameter.startswith("bg_") and self.vda.parameters.input_type == 1:
-                if parameter == "bg_start":
-                    col = self.vda.BG_START_TIME_COLNAME
-                elif parameter == "bg_end":
-                    col = self.vda.BG_END_TIME_COLNAME
-                else:
+                if parameter not in ("bg_start", "bg_end"):
                     raise ValueError(f"Invalid bg parameter: {parameter}")
-                self.vda.parameters.onset_method_parameters[parameter] = self.vda.df_times[col]
+                self.vda.define_bg_windows()
+                self._parameter_changed("onset_method_parameters")
                 continue
             if pinfo["type"] == int:
                 widget_type = widgets.IntSlider
@@ -490,159 +454,266 @@ class VDA_nb_displayer:
         widgets.VBox(list(dict_wgt_onset_params.values()))
 
     def display_onset_selection_selection(self):
-        w = widgets.Dropdown(options=[("Use all", 0), ("Interactive", 1), ("Custom List", 2)], 
-                             value=self.vda.parameters.onset_selection, 
-                             description="Onset selection method:", 
-                             disabled=False, 
+        w = widgets.Dropdown(options=[("Use all", 0), ("Interactive", 1), ("Custom List", 2),
+                                      ("Explore combinations", 3)],
+                             value=self.vda.parameters.onset_selection,
+                             description="Onset selection method:",
+                             disabled=False,
                              style=self.WIDGETS_STYLE)
         w.observe(lambda traitlet: self._change_parameter("onset_selection", traitlet["new"]),
                   names="value")
         return w
 
+    def _run_stage(self, stage, cancel_event, on_progress):
+        # The stage runs on a copy of the VDA object with its own parameters, so the
+        # widgets can keep changing the parameters meanwhile. New results are
+        # published back to the VDA object once the stage has finished.
+        vda = copy(self.vda)
+        vda.parameters = deepcopy(self.vda.parameters)
+        selected_onsets = vda.parameters.selected_onsets
+        vda.results = self.vda.results.copy()
+        vda.cancel_event = cancel_event
+        vda.progress_callback = on_progress
+        getattr(vda, stage)()
+        for attribute, value in vars(vda).items():
+            if attribute in ("parameters", "cancel_event", "progress_callback"):
+                continue
+            if getattr(self.vda, attribute, None) is not value:
+                setattr(self.vda, attribute, value)
+        # the only parameter the stages produce
+        if vda.parameters.selected_onsets is not selected_onsets:
+            self.vda.parameters.selected_onsets = vda.parameters.selected_onsets
+
+    def display_background_stages(self, stages=BACKGROUND_STAGES):
+        if self._stage_executor is None:
+            self._stage_executor = ThreadPoolExecutor(max_workers=1)
+        rows = []
+        for stage in stages:
+            btn_run = widgets.Button(description=f"Run {stage}", layout=self.WIDGETS_LAYOUT)
+            btn_cancel = widgets.Button(description="Cancel", disabled=True)
+            wgt_progress = widgets.FloatProgress(value=0, min=0, max=1)
+            wgt_status = widgets.Label(value="Not started")
+            state = {"cancel_event": None, "start": None}
+
+            def on_progress(stage, done, total, wgt_progress=wgt_progress, wgt_status=wgt_status, state=state):
+                if state["start"] is None:
+                    state["start"] = monotonic()
+                wgt_progress.max = max(total, 1)
+                wgt_progress.value = done
+                elapsed = monotonic() - state["start"]
+                if 0 < done < total:
+                    eta = timedelta(seconds=round(elapsed * (total - done) / done))
+                    wgt_status.value = f"{done}/{total} | ETA {eta}"
+                else:
+                    wgt_status.value = f"{done}/{total}"
+
+            def job(stage=stage, btn_run=btn_run, btn_cancel=btn_cancel, wgt_progress=wgt_progress,
+                    wgt_status=wgt_status, state=state, on_progress=on_progress):
+                if state["cancel_event"].is_set():
+                    wgt_status.value = "Cancelled"
+                else:
+                    wgt_status.value = "Running..."
+                    state["start"] = monotonic()
+                    try:
+                        self._run_stage(stage, state["cancel_event"], on_progress)
+                        wgt_progress.value = wgt_progress.max
+                        wgt_status.value = f"Done in {timedelta(seconds=round(monotonic() - state['start']))}"
+                    except VDA_cancelled:
+                        wgt_status.value = "Cancelled"
+                    except Exception as e:
+                        wgt_status.value = f"Failed: {type(e).__name__}: {e}"
+                btn_run.disabled = False
+                btn_cancel.disabled = True
+
+            def run(_, job=job, btn_run=btn_run, btn_cancel=btn_cancel, wgt_status=wgt_status, state=state):
+                state["cancel_event"] = Event()
+                state["start"] = None
+                btn_run.disabled = True
+                btn_cancel.disabled = False
+                wgt_status.value = "Queued"
+                self._stage_executor.submit(job)
+
+            def cancel(_, state=state):
+                state["cancel_event"].set()
+
+            btn_run.on_click(run)
+            btn_cancel.on_click(cancel)
+            rows.append(widgets.HBox([btn_run, wgt_progress, wgt_status, btn_cancel]))
+
+        return widgets.VBox(rows)
+
     def display_view_toggle(self):
-        w = widgets.Checkbox(value=self.vda.parameters.view_dfs, 
-                             description="Display the produced DataFrames", 
-                             disabled=False, 
-                             indent=True, 
+        w = widgets.Checkbox(value=self.vda.parameters.view_dfs,
+                             description="Display the produced DataFrames",
+                             disabled=False,
+                             indent=True,
                              style=self.WIDGETS_STYLE)
         w.observe(lambda traitlet: self._change_parameter("view_dfs", traitlet["new"]),
                   names="value")
         return w
 
-    def select_onsets(self):
+    def display_onset_gallery(self):
+        """Interactive onset selection, one event/channel per page.
+
+        A single figure is reused for every page by updating its artists, and the
+        data of the next page is prepared in the background while the current one
+        is on display.
+        """
+        from matplotlib import pyplot as plt
+        from matplotlib import dates as mdates
+
+        viewings = self.vda.parameters.viewings
         temp_df = self.vda.df_options.droplevel(level=5)
-        df_index = temp_df.index[~temp_df.index.duplicated(keep="first")]
-        self.vda.parameters.selected_onsets = pd.DataFrame({"Viewing": [None for _ in df_index]}, index=df_index)
+        pages = list(temp_df.index[~temp_df.index.duplicated(keep="first")])
+        if len(pages) == 0:
+            print("No onsets to select from.")
+            return
+        df_onsets_existing = self.vda.df_onsets_existing
+
+        def page_data(page):
+            event_no, sensor, particle, particle_prefix, column = pages[page]
+            df_event = self.vda.grouped_cube.event_frame(event_no)
+            panels = []
+            for viewing in viewings:
+                series = df_event[(sensor, particle, viewing, particle_prefix, column)].fillna(0).ffill()
+                key = (event_no, sensor, particle, viewing, particle_prefix, column)
+                onset_results = df_onsets_existing.loc[key] if key in df_onsets_existing.index else None
+                panels.append((series, onset_results))
+            energy_range_str = self.vda._energy_range_str(sensor, particle, column)
+            return {
+                "panels": panels,
+                "options": [None] + [v for v, (_, o) in zip(viewings, panels) if o is not None],
+                "title": f"{event_no} ({df_event.index[0].to_pydatetime().strftime('%Y-%m-%d')}) | "
+                         f"{sensor}/{particle} ({energy_range_str} MeV)",
+            }
+
+        if self._gallery_executor is None:
+            self._gallery_executor = ThreadPoolExecutor(max_workers=1)
+        executor = self._gallery_executor
+        # the pages still queued by a replaced gallery are not needed anymore
+        for future in self._gallery_prepared.values():
+            future.cancel()
+        prepared = self._gallery_prepared = {}
+
+        def prefetch(page):
+            if 0 <= page < len(pages) and page not in prepared:
+                prepared[page] = executor.submit(page_data, page)
+
+        # figure and artists created once, updated on every page
+        nrows, ncols = self.vda._onset_panels_shape(len(viewings))
+        with plt.ioff():
+            fig, axs = plt.subplots(nrows, ncols, figsize=(14, 8), squeeze=False)
+        axs_flat = axs.flatten()
+        for ax in axs_flat[len(viewings):]:
+            ax.axis("off")
+        artists = []
+        for ax, viewing in zip(axs_flat, viewings):
+            ax.set_title(viewing)
+            ax.set_yscale("log")
+            ax.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M"))
+            artists.append({
+                "data": ax.plot([], [], label="Data")[0],
+                "bg_level": ax.axhline(1, color="green", linestyle="dashed"),
+                "threshold": ax.axhline(1, color="red", linestyle="dashed"),
+                "onset": ax.axvline(0, color="purple", linestyle="dashed"),
+                "bg_sample": None,
+            })
+
+        canvas_is_widget = isinstance(fig.canvas, widgets.DOMWidget)
+        if not canvas_is_widget:
+            # displayed explicitly in out_figure, keep it out of pyplot's automatic display
+            plt.close(fig)
+        out_figure = widgets.Output()
+        wgt_title = widgets.Label(style=self.WIDGETS_STYLE, layout=self.WIDGETS_LAYOUT)
+        wgt_page = widgets.Label()
+        btn_previous = widgets.Button(description="Previous")
+        btn_next = widgets.Button(description="Next")
+        wrb = widgets.RadioButtons(options=[None],
+                                   orientation="horizontal",
+                                   style=self.WIDGETS_STYLE,
+                                   layout=self.WIDGETS_LAYOUT)
+        state = {"page": 0, "updating": False}
+
+        def draw_page(page):
+            data = prepared.pop(page, None)
+            data = page_data(page) if data is None else data.result()
+            for ax, art, (series, onset_results) in zip(axs_flat, artists, data["panels"]):
+                art["data"].set_data(series.index, series.values)
+                if art["bg_sample"] is not None:
+                    art["bg_sample"].remove()
+                    art["bg_sample"] = None
+                found = onset_results is not None
+                levels = found and pd.notna(onset_results.get("bg_level"))
+                for name in ("bg_level", "threshold"):
+                    art[name].set_visible(levels)
+                    if levels:
+                        art[name].set_ydata([onset_results[name]] * 2)
+                art["bg_level"].set_label(f'BG ({onset_results["bg_level"]:.2f})' if levels else "_BG")
+                art["threshold"].set_label(f'Threshold ({onset_results["threshold"]:.2f})' if levels else "_Threshold")
+                art["onset"].set_visible(found)
+                if found:
+                    art["onset"].set_xdata([onset_results["Onset Time"]] * 2)
+                    art["onset"].set_label(f'Onset ({onset_results["Onset Time"].strftime("%H:%M")})')
+                    art["bg_sample"] = ax.axvspan(onset_results["Background Start"],
+                                                  onset_results["Background End"],
+                                                  color="green",
+                                                  alpha=0.3,
+                                                  label="BG Sample")
+                else:
+                    art["onset"].set_label("_Onset")
+                ax.relim(visible_only=True)
+                ax.autoscale_view()
+                ax.legend()
+            fig.suptitle(f"Detected onsets for event {data['title']}")
+            fig.tight_layout()
+
+            state["updating"] = True
+            wrb.options = data["options"]
+            wrb.value = self.vda.parameters.selected_onsets.loc[pages[page], "Viewing"]
+            state["updating"] = False
+            wgt_title.value = f"Event {data['title']}:"
+            wgt_page.value = f"{page + 1} / {len(pages)}"
+            btn_previous.disabled = page == 0
+            btn_next.disabled = page == len(pages) - 1
+
+            if canvas_is_widget:
+                fig.canvas.draw_idle()
+            else:
+                with out_figure:
+                    out_figure.clear_output(wait=True)
+                    display(fig)
+
+            prefetch(page + 1)
+            prefetch(page - 1)
+
+        def change_page(step):
+            state["page"] += step
+            draw_page(state["page"])
+
+        def select_viewing(traitlet):
+            if state["updating"]:
+                return
+            self.vda.parameters.selected_onsets.loc[pages[state["page"]], "Viewing"] = traitlet["new"]
+            self._parameter_changed("selected_onsets")
+
+        btn_previous.on_click(lambda _: change_page(-1))
+        btn_next.on_click(lambda _: change_page(1))
+        wrb.observe(select_viewing, names="value")
+
+        draw_page(0)
+        display(widgets.VBox([
+            widgets.HBox([btn_previous, wgt_page, btn_next]),
+            widgets.HBox([wgt_title, wrb]),
+            fig.canvas if canvas_is_widget else out_figure,
+        ]))
+
+    def select_onsets(self):
+        self.vda.parameters.selected_onsets = self.vda.construct_empty_selection()
         if self.vda.parameters.onset_selection == 0:
-            # Use all (priority by default viewings)
-            for i, _ in self.vda.parameters.selected_onsets.iterrows():
-                for v in self.vda.parameters.viewings:
-                    try:
-                        self.vda.df_options.loc[i+(v,)]
-                    except KeyError:
-                        continue
-                    self.vda.parameters.selected_onsets.loc[i, "Viewing"] = v
+            # Use all (priority by the viewings hierarchy)
+            self.vda.select_onsets()
         elif self.vda.parameters.onset_selection == 1:
-            time_formatter = mdates.DateFormatter("%H:%M")
-            for event_no, event in self.vda.df_grouped.groupby(level=0):
-                temp_df = event.droplevel(0)
-                for sensor, particles in self.vda.parameters.sensors_particles.items():
-                    for particle in particles:
-                        if particle == "protons":
-                            particle_prefix = self.vda.PROTON_COLUMN_PREFIX
-                        elif particle == "electrons":
-                            particle_prefix = self.vda.ELECTRON_COLUMN_PREFIX
-                        columns = temp_df[sensor][particle][self.vda.parameters.viewings[0]][particle_prefix].columns
-                        for column in columns:
-                            onset_found = False
-                            nplots = len(self.vda.parameters.viewings)
-                            ncols = 3
-                            if nplots <= ncols:
-                                nrows = 1
-                                ncols = nplots
-                            else:
-                                nrows = ceil(nplots/ncols)
-                            fig, axs = plt.subplots(nrows,
-                                                    ncols,
-                                                    figsize=(14, 8))
-                            try:
-                                axs_flat = axs.flatten()
-                            except AttributeError:
-                                axs_flat = [axs]
-                            for ax in axs_flat[len(self.vda.parameters.viewings):]:
-                                ax.axis("off")
-                            for ax, viewing in zip(axs_flat, self.vda.parameters.viewings):
-                                ax.set_title(viewing)
-                                try:
-                                    onset_results = self.vda.df_onsets_existing.loc[(event_no,
-                                                                                sensor,
-                                                                                particle,
-                                                                                viewing,
-                                                                                particle_prefix,
-                                                                                column)]
-                                    onset_found = True
-                                except KeyError:
-                                    continue
-
-                                ax.plot(temp_df[sensor][particle][viewing][particle_prefix][column].fillna(0).ffill(), label="Data")
-                                xlim = ax.get_xlim()
-                                ylim = ax.get_ylim()
-                                ax.fill_betweenx([0, ylim[1]],
-                                                onset_results["Background Start"],
-                                                onset_results["Background End"],
-                                                color="green",
-                                                alpha=0.3,
-                                                label="BG Sample")
-                                ax.hlines(onset_results["Method Specific"]["bg_level"],
-                                        xlim[0],
-                                        xlim[1],
-                                        color="green",
-                                        linestyles="dashed",
-                                        label=f'BG ({onset_results["Method Specific"]["bg_level"]:.2f})')
-                                ax.hlines(onset_results["Method Specific"]["threshold"],
-                                        xlim[0],
-                                        xlim[1],
-                                        color="red",
-                                        linestyles="dashed",
-                                        label=f'Threshold ({onset_results["Method Specific"]["threshold"]:.2f})')
-                                ax.vlines(onset_results["Onset Time"],
-                                        0,
-                                        ylim[1],
-                                        color="purple",
-                                        linestyles="dashed",
-                                        label=f'Onset ({onset_results["Onset Time"].strftime("%H:%M")})')
-
-                                ax.set_xlim(xlim)
-                                ax.xaxis.set_major_formatter(time_formatter)
-                                # ax.set_ylim(top=ylim[1])
-                                ax.set_yscale("log")
-
-                                ax.legend()
-                            
-                            if not onset_found:
-                                plt.close()
-                                continue
-
-                            used_i = self.vda.parameters.channel_groups[particle][column]["channels"]
-                            low_i = used_i[0]
-                            high_i = used_i[-1]
-                            low_energy = self.vda.df_energies.loc[(sensor, f"{particle_prefix}_{low_i}"), "Low Energy"]
-                            high_energy = self.vda.df_energies.loc[(sensor, f"{particle_prefix}_{high_i}"), "High Energy"]
-                            energy_range_str = f"{low_energy:.2f}-{high_energy:.2f}"
-                            
-                            twgt = widgets.Label(
-                                value=f"Event {event_no} ({temp_df.index[0].to_pydatetime().strftime('%Y-%m-%d')}) | {sensor}/{particle} ({energy_range_str} MeV):",
-                                style=self.WIDGETS_STYLE,
-                                layout=self.WIDGETS_LAYOUT
-                            )
-                            wrb = widgets.RadioButtons(
-                                options=[None] + [v for v in self.vda.parameters.viewings 
-                                                    if v in self.vda.df_options.loc[(event_no,
-                                                                                sensor,
-                                                                                particle,
-                                                                                particle_prefix,
-                                                                                column)].index],
-                                index=0,
-                                description=f"{event_no}|{sensor}|{particle}|{particle_prefix}|{column}",
-                                orientation="horizontal",
-                                style=self.WIDGETS_STYLE,
-                                layout=self.WIDGETS_LAYOUT
-                            )
-                            wrb.observe(
-                                lambda traitlet: self._change_parameter_df_index(
-                                    "selected_onsets",
-                                    traitlet["owner"].description,
-                                    "Viewing",
-                                    traitlet["new"],
-                                    "|",
-                                ),
-                                names="value",
-                            )
-                            display(widgets.HBox([twgt, wrb]))
-
-                            plt.suptitle(f"Detected onsets for event {event_no} ({temp_df.index[0].to_pydatetime().strftime('%Y-%m-%d')}) | {sensor}/{particle} ({energy_range_str} MeV)")
-                            plt.tight_layout()
-                            plt.show()
+            self.display_onset_gallery()
         elif self.vda.parameters.onset_selection == 2:
             # # Custom list
             # df_selections = pd.DataFrame({})
@@ -681,5 +752,10 @@ class VDA_nb_displayer:
 
             # assert False
             pass
+        elif self.vda.parameters.onset_selection == 3:
+            # Explore all viewing combinations and keep the best fitting one
+            self.vda.construct_energy_channels_characteristics()
+            self.vda.define_spacecraft_parameters()
+            self.vda.select_onsets()
 
     
\ No newline at end of file